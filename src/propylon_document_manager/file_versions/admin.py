@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-from .models import User, BaseFile, FileVersion
+from .models import User, BaseFile, Blob, FileVersion
 
 print("Registering User model with custom UserAdmin in admin.py")
 @admin.register(User)
@@ -18,12 +18,27 @@ class UserAdmin(BaseUserAdmin):
         }),
     )
 
+    def delete_model(self, request, obj):
+        FileVersion.objects.delete_documents(obj.base_files.all())
+        super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        FileVersion.objects.delete_documents(BaseFile.objects.filter(owner__in=queryset))
+        super().delete_queryset(request, queryset)
+
 @admin.register(BaseFile)
 class BaseFileAdmin(admin.ModelAdmin):
     list_display = ("id", "file_name", "latest_version_number", "owner")
     search_fields = ("file_name", "owner__username")
     list_filter = ("owner",)
 
+    # deleting a document releases the blob references of its versions
+    def delete_model(self, request, obj):
+        FileVersion.objects.delete_documents([obj])
+
+    def delete_queryset(self, request, queryset):
+        FileVersion.objects.delete_documents(queryset)
+
 @admin.register(FileVersion)
 class FileVersionAdmin(admin.ModelAdmin):
     list_display = (
@@ -36,4 +51,28 @@ class FileVersionAdmin(admin.ModelAdmin):
     )
     search_fields = ("base_file__file_name", "file_hash")
     list_filter = ("base_file__owner", "created_at")
-    raw_id_fields = ("base_file",)
\ No newline at end of file
+    raw_id_fields = ("base_file",)
+
+    # versions are created through the API, which stores and registers
+    # the content, and deleted through delete_version, which releases it
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def delete_model(self, request, obj):
+        FileVersion.objects.delete_version(obj)
+
+    def delete_queryset(self, request, queryset):
+        for fv in queryset:
+            FileVersion.objects.delete_version(fv)
+
+@admin.register(Blob)
+class BlobAdmin(admin.ModelAdmin):
+    list_display = ("file_hash", "size", "codec", "refcount", "unreferenced_at", "created_at", "verified_at")
+    search_fields = ("file_hash",)
+    readonly_fields = (
+        "file_hash", "size", "codec", "refcount", "unreferenced_at", "created_at", "verified_at",
+        "pack", "pack_offset", "pack_length", "indexed_at",
+    )
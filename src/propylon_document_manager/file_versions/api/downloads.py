@@ -0,0 +1,268 @@
+# propylon_document_manager/file_versions/api/downloads.py
+import mimetypes
+import re
+import uuid
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe
+
+# More ranges than this is not a reader skipping around; send the whole file.
+MAX_RANGES = 64
+STREAM_CHUNK_SIZE = 64 * 1024
+
+_RANGE_SPEC_RE = re.compile(r"^(\d*)-(\d*)$")
+
+
+def _validators(fv, pinned, encoding=""):
+    # the gzip-encoded representation is a different byte sequence, so it
+    # needs its own strong ETag
+    etag = f'"{fv.file_hash}+{encoding}"' if encoding else f'"{fv.file_hash}"'
+    # "latest" can move back to an older revision when the newest one is
+    # deleted, so only the content hash is a safe validator there.
+    last_modified = int(fv.created_at.timestamp()) if pinned else None
+    return etag, last_modified
+
+
+def _cache_headers(response, etag, last_modified, vary=False):
+    response["ETag"] = etag
+    if vary:
+        patch_vary_headers(response, ["Accept-Encoding"])
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified)
+    # documents are per-user, never let shared caches store them. Even a
+    # ?revision=N response is revalidated: deleting the newest revision
+    # frees its number for the next upload.
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def _parse_range(header, size):
+    """
+    Parse a ``Range: bytes=...`` header into sorted, coalesced
+    ``(start, end)`` pairs (``end`` inclusive).
+
+    Returns None when the header should be ignored (absent, malformed, other
+    unit, too many ranges) and an empty list when no range is satisfiable.
+    """
+    unit, _, specs = (header or "").partition("=")
+    if unit.strip().lower() != "bytes" or not specs:
+        return None
+    specs = specs.split(",")
+    if len(specs) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for spec in specs:
+        m = _RANGE_SPEC_RE.match(spec.strip())
+        if not m or m.group(1) == m.group(2) == "":
+            return None
+        first, last = m.groups()
+        if first == "":
+            # suffix range: the last N bytes
+            length = int(last)
+            if length == 0:
+                continue
+            start, end = max(size - length, 0), size - 1
+        else:
+            start = int(first)
+            end = size - 1 if last == "" else min(int(last), size - 1)
+            if last != "" and int(last) < start:
+                return None
+            if start >= size:
+                continue
+        ranges.append((start, end))
+
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _if_range_passes(request, etag, last_modified):
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        # strong comparison only
+        return if_range == etag
+    if if_range.startswith("W/"):
+        return False
+    since = parse_http_date_safe(if_range)
+    return since is not None and last_modified is not None and since == last_modified
+
+
+def _read_range(fh, start, end):
+    fh.seek(start)
+    remaining = end - start + 1
+    while remaining > 0:
+        chunk = fh.read(min(STREAM_CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+
+def _stream_ranges(fh, parts):
+    try:
+        for head, rng in parts:
+            yield head
+            if rng is not None:
+                yield from _read_range(fh, *rng)
+    finally:
+        fh.close()
+
+
+def _accepts_gzip(request):
+    for coding in request.META.get("HTTP_ACCEPT_ENCODING", "").split(","):
+        name, _, params = coding.partition(";")
+        if name.strip().lower() not in ("gzip", "x-gzip"):
+            continue
+        params = params.strip().lower()
+        if params.startswith("q="):
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return True
+        return True
+    return False
+
+
+def _iter_decoded(reader):
+    with reader:
+        while chunk := reader.read(STREAM_CHUNK_SIZE):
+            yield chunk
+
+
+def _content_type(fv):
+    # CAS paths carry no extension, use the logical document name
+    return mimetypes.guess_type(fv.base_file.file_name)[0] or "application/octet-stream"
+
+
+def _partial_response(fv, fh, ranges, size):
+    content_type = _content_type(fv)
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        response = StreamingHttpResponse(_stream_ranges(fh, [(b"", (start, end))]),
+                                         status=206, content_type=content_type)
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response["Content-Length"] = str(end - start + 1)
+        return response
+
+    boundary = uuid.uuid4().hex
+    parts, length = [], 0
+    for start, end in ranges:
+        head = (
+            f"\r\n--{boundary}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+        ).encode("ascii")
+        parts.append((head, (start, end)))
+        length += len(head) + end - start + 1
+    tail = f"\r\n--{boundary}--\r\n".encode("ascii")
+    parts.append((tail, None))
+    length += len(tail)
+
+    response = StreamingHttpResponse(_stream_ranges(fh, parts), status=206,
+                                     content_type=f"multipart/byteranges; boundary={boundary}")
+    response["Content-Length"] = str(length)
+    return response
+
+
+def _encoded_response(fv, codec, encoding):
+    """
+    Whole content of a compressed or delta blob: the stored bytes as they
+    are when the client accepts ``encoding``, otherwise decoded on the fly.
+    Such blobs cannot be seeked into, so Range is not offered.
+    """
+    content_type = _content_type(fv)
+    if encoding:
+        response = FileResponse(fv.open_stored(), as_attachment=False, content_type=content_type)
+        response["Content-Encoding"] = encoding
+    else:
+        response = StreamingHttpResponse(_iter_decoded(fv.open_content()), content_type=content_type)
+        if fv.file_size is not None:
+            response["Content-Length"] = str(fv.file_size)
+    response["Accept-Ranges"] = "none"
+    return response
+
+
+def _offloaded_response(fv):
+    """
+    Let the front-end web server stream the blob. It also takes care of
+    Range requests, so the worker is released right away.
+    """
+    mode = settings.DOCUMENT_DELIVERY
+    response = HttpResponse(content_type=_content_type(fv))
+    if mode == "x-accel-redirect":
+        prefix = settings.DOCUMENT_DELIVERY_INTERNAL_URL.rstrip("/")
+        response["X-Accel-Redirect"] = quote(f"{prefix}/{fv.file_content.name}")
+    elif mode == "x-sendfile":
+        response["X-Sendfile"] = default_storage.path(fv.file_content.name)
+    else:
+        raise ImproperlyConfigured(f"Unknown DOCUMENT_DELIVERY mode {mode!r}.")
+    return response
+
+
+def document_response(request, fv, pinned):
+    """
+    Serve the content of FileVersion ``fv`` with validators and cache headers.
+
+    ``file_hash`` is used as a strong ETag, so If-None-Match (and, for pinned
+    revisions, If-Modified-Since) answer 304 without touching the blob.
+    ``Range`` requests are answered with 206 by seeking into the CAS blob;
+    ``If-Range`` is checked against the same validators.
+    Outside the "python" DOCUMENT_DELIVERY mode the bytes are served by
+    the front-end web server instead, unless the blob is in a pack file.
+    Compressed blobs (``blob_codec`` annotation) are always sent from here:
+    gzip ones as stored to clients accepting gzip, otherwise decompressed.
+    Chunked blobs have no file the web server could send either; they are
+    streamed chunk by chunk, and ranges seek with the manifest offsets.
+    """
+    codec = getattr(fv, "blob_codec", "")
+    encoding = "gzip" if codec == "gzip" and _accepts_gzip(request) else ""
+    chunked = codec == "chunked"
+    vary = bool(codec) and not chunked
+    etag, last_modified = _validators(fv, pinned, encoding)
+    headers = _cache_headers(HttpResponse(), etag, last_modified, vary)
+    conditional = get_conditional_response(request, etag=etag, last_modified=last_modified, response=headers)
+    if conditional is not headers:
+        return conditional
+
+    if codec and not chunked:
+        return _cache_headers(_encoded_response(fv, codec, encoding), etag, last_modified, vary)
+
+    # neither a packed nor a chunked blob is a file the web server could send
+    if settings.DOCUMENT_DELIVERY != "python" and not chunked and not getattr(fv, "blob_packed", False):
+        return _cache_headers(_offloaded_response(fv), etag, last_modified)
+    open_seekable = fv.open_content if chunked else fv.open_stored
+
+    range_header = request.META.get("HTTP_RANGE")
+    if range_header and _if_range_passes(request, etag, last_modified):
+        size = fv.file_size if fv.file_size is not None else fv.file_content.size
+        ranges = _parse_range(range_header, size)
+        if ranges == []:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return _cache_headers(response, etag, last_modified)
+        if ranges:
+            response = _partial_response(fv, open_seekable(), ranges, size)
+            response["Accept-Ranges"] = "bytes"
+            return _cache_headers(response, etag, last_modified)
+
+    if chunked:
+        response = StreamingHttpResponse(_iter_decoded(fv.open_content()), content_type=_content_type(fv))
+        response["Content-Length"] = str(fv.file_size)
+    else:
+        response = FileResponse(fv.open_stored(), as_attachment=False, content_type=_content_type(fv))
+    response["Accept-Ranges"] = "bytes"
+    return _cache_headers(response, etag, last_modified)
@@ -0,0 +1,14 @@
+# propylon_document_manager/file_versions/api/negotiation.py
+from rest_framework.negotiation import DefaultContentNegotiation
+
+
+class FormatParamContentNegotiation(DefaultContentNegotiation):
+    """
+    On the document endpoints ``?format=`` selects the view's own output
+    (diff formats, NDJSON, archives) rather than a DRF renderer, so values
+    no renderer knows must not turn into a 404. Error responses are still
+    rendered by the usual renderers.
+    """
+
+    def filter_renderers(self, renderers, format):
+        return [renderer for renderer in renderers if renderer.format == format] or renderers
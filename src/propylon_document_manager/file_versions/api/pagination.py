@@ -0,0 +1,110 @@
+# propylon_document_manager/file_versions/api/pagination.py
+import base64
+import binascii
+import json
+from functools import reduce
+from operator import or_
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset ("seek") pagination over a fixed, unique ordering.
+
+    Each page continues strictly after the last row of the previous one
+    (``WHERE (a, b) > (last_a, last_b)``), so the cost of a page does not
+    grow with its depth and concurrent inserts never shift rows between
+    pages. The response body stays a plain list; the next page is announced
+    in an RFC 8288 ``Link: <...>; rel="next"`` header.
+    """
+
+    # (field, descending) pairs; together they must identify a row
+    ordering = ()
+    page_size = 100
+    max_page_size = 1000
+    page_size_query_param = "limit"
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Invalid cursor"
+
+    def get_ordering(self):
+        return [f"-{field}" if desc else field for field, desc in self.ordering]
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(encoded.encode("ascii")))
+        except (ValueError, binascii.Error, UnicodeEncodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def encode_cursor(self, position):
+        return base64.urlsafe_b64encode(json.dumps(position).encode()).decode("ascii")
+
+    def position_of(self, row):
+        position = []
+        for field, _ in self.ordering:
+            value = row
+            for attr in field.split("__"):
+                value = value[attr] if isinstance(value, dict) else getattr(value, attr)
+            position.append(value)
+        return position
+
+    def after(self, position):
+        """Q selecting the rows that sort strictly after ``position``."""
+        clauses = []
+        for k, (field, desc) in enumerate(self.ordering):
+            equal = {f: v for (f, _), v in zip(self.ordering[:k], position[:k])}
+            lookup = "lt" if desc else "gt"
+            clauses.append(Q(**equal, **{f"{field}__{lookup}": position[k]}))
+        return reduce(or_, clauses)
+
+    def filter_queryset(self, queryset, request):
+        """Apply the cursor and ordering without slicing (for streaming)."""
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(self.after(position))
+        return queryset.order_by(*self.get_ordering())
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        limit = self.get_page_size(request)
+        rows = list(self.filter_queryset(queryset, request)[: limit + 1])
+        self.next_position = self.position_of(rows[limit - 1]) if len(rows) > limit else None
+        return rows[:limit]
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        response = Response(data)
+        next_link = self.get_next_link()
+        if next_link:
+            response["Link"] = f'<{next_link}>; rel="next"'
+        return response
+
+
+class DocumentListPagination(KeysetPagination):
+    ordering = (("base_file__file_name", False), ("version_number", True), ("base_file_id", False))
+
+
+class VersionHistoryPagination(KeysetPagination):
+    ordering = (("version_number", True),)
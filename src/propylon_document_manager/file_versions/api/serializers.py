@@ -73,11 +73,30 @@ class FileVersionSerializer(serializers.ModelSerializer):
         # Use custom manager to handle version bump + BaseFile creation
         return FileVersion.objects.create(
             file_content=file_content,
+            file_hash=getattr(file_content, "sha256", ""),
             file_name=file_name,
             owner=user,
             **validated_data,
         )
 
+class FileVersionHistorySerializer(serializers.ModelSerializer):
+    """Version metadata of a single document, read from ``values()`` rows."""
+    file_version_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = FileVersion
+        fields = [
+            "version_number",
+            "file_hash",
+            "file_size",
+            "created_at",
+            "file_version_url",
+        ]
+        read_only_fields = fields
+
+    def get_file_version_url(self, obj):
+        return f"{self.context['file_name']}?revision={obj['version_number']}"
+
 def _normalize_doc_path(p: str) -> str:
     p = (p or "").strip()
     if not p.startswith("/"):
@@ -1,21 +1,39 @@
 # propylon_document_manager/file_versions/api/views.py
+import datetime
+import json
+import re
 from urllib.parse import unquote
 
-from django.db import transaction
-from django.http import FileResponse, Http404, HttpResponse
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count
+from django.urls import reverse
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from django.shortcuts import get_object_or_404
-from django.core.files.storage import default_storage
 from rest_framework.decorators import action
 from rest_framework import status, permissions, viewsets
 from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import ParseError
 from rest_framework.mixins import RetrieveModelMixin, ListModelMixin
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.viewsets import GenericViewSet
-from django.db.models import Max
+from rest_framework.utils.encoders import JSONEncoder
 
-from ..models import FileVersion, BaseFile
-from .serializers import FileVersionSerializer
+from .. import archives, diffs, search, uploads
+from ..models import BaseFile, BlobChunk, FileVersion, UploadSession
+from ..paths import invalidate_document, resolve_document
+from .downloads import document_response
+from .negotiation import FormatParamContentNegotiation
+from .pagination import DocumentListPagination, VersionHistoryPagination
+from .serializers import FileVersionHistorySerializer, FileVersionSerializer
+
+
+DIFF_FORMATS = ("html", "unified", "json", "stats")
+SEARCH_MAX_LIMIT = 100
+EXPORT_FORMATS = {"zip": "application/zip", "tar": "application/x-tar"}
 
 
 def _normalize_doc_path(p: str) -> str:
@@ -27,23 +45,131 @@ def _normalize_doc_path(p: str) -> str:
         p = p[:-1]
     return p
 
+def _flag(value):
+    return (value or "").lower() in ("1", "true", "yes")
 
-from difflib import HtmlDiff
-import io
-
-def _read_text_or_none(fh):
-    data = fh.read()
+def _as_of(request):
+    """The ``as_of`` query parameter (ISO 8601 datetime or date) as an aware datetime, or None."""
+    value = request.query_params.get("as_of")
+    if value is None:
+        return None
     try:
-        return data.decode("utf-8")
-    except UnicodeDecodeError:
+        when = parse_datetime(value)
+        if when is None and (day := parse_date(value)) is not None:
+            # a whole day: its state at the end of it
+            when = datetime.datetime.combine(day, datetime.time.max)
+    except ValueError:
+        when = None
+    if when is None:
+        raise ParseError("'as_of' must be an ISO 8601 date or datetime.")
+    if timezone.is_naive(when):
+        when = timezone.make_aware(when)
+    return when
+
+def _iter_ndjson(qs):
+    # plain tuples instead of model + serializer instances, same fields as FileVersionSerializer
+    rows = qs.values_list(
+        "id", "base_file__file_name", "version_number", "created_at",
+        "updated_at", "file_hash", "file_content",
+    ).iterator(chunk_size=2000)
+    encoder = JSONEncoder()
+    for pk, file_name, version_number, created_at, updated_at, file_hash, file_path in rows:
+        yield encoder.encode({
+            "id": pk,
+            "file_name": file_name,
+            "version_number": version_number,
+            "created_at": created_at,
+            "updated_at": updated_at,
+            "file_hash": file_hash,
+            "file_version_url": f"{file_name}?revision={version_number}",
+            "file_path": file_path,
+        }) + "\n"
+
+def _user_has_blob(user, file_hash):
+    return FileVersion.objects.filter(base_file__owner=user, file_hash=file_hash).exists()
+
+_HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+
+def _parse_hashes(value):
+    """A list of SHA-256 hex digests from a JSON body or a JSON-encoded form field, or None."""
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return None
+    if not isinstance(value, list) or not all(isinstance(h, str) for h in value):
+        return None
+    value = [h.lower() for h in value]
+    if not all(_HASH_RE.match(h) for h in value):
         return None
+    return value
+
+def _user_chunks(user, chunk_hashes):
+    # only chunks of the caller's own content, like _user_has_blob
+    return set(BlobChunk.objects
+        .filter(chunk_id__in=set(chunk_hashes),
+                blob_id__in=FileVersion.objects.filter(base_file__owner=user).values("file_hash"))
+        .values_list("chunk_id", flat=True))
+
+def _version_created(fv, logical_path):
+    return Response(
+        {
+            "id": fv.id,
+            "file_name": logical_path,
+            "version_number": fv.version_number,
+            "document_url": logical_path,
+            "file_version_url": f"{logical_path}?revision={fv.version_number}",
+            "created_at": fv.created_at,
+        },
+        status=status.HTTP_201_CREATED,
+    )
+
+def _session_state(session, status_code=status.HTTP_200_OK):
+    return Response(
+        {
+            "id": str(session.pk),
+            "file_name": session.file_name,
+            "size": session.size,
+            "received": session.received,
+            "complete": session.complete,
+            "upload_url": reverse("file_versions:uploads", kwargs={"session_id": session.pk}),
+        },
+        status=status_code,
+    )
+
+def _resolve_or_404(user, logical_path):
+    doc = resolve_document(user, logical_path)
+    if doc is None:
+        raise Http404("No document matches the given path.")
+    return doc
 
-def _get_revision(bf, rev_str):
+def _get_version(base_file_id, version_number):
+    return (FileVersion.objects.with_codec()
+        .filter(base_file_id=base_file_id, version_number=version_number)
+        .select_related("base_file")
+        .first())
+
+def _get_latest_by_pk(doc):
+    return (FileVersion.objects.with_codec()
+        .filter(pk=doc.latest_version_id, base_file_id=doc.base_file_id)
+        .select_related("base_file")
+        .first())
+
+def _get_latest_version(user, logical_path, doc):
+    fv = _get_latest_by_pk(doc)
+    if fv is None:
+        # stale resolution (changed outside FileVersionManager): retry from the database
+        invalidate_document(user.pk, logical_path)
+        doc = resolve_document(user, logical_path)
+        fv = doc and _get_latest_by_pk(doc)
+    return fv
+
+def _get_revision(base_file_id, rev_str):
     try:
         rev = int(rev_str)
     except (TypeError, ValueError):
         return None
-    return bf.versions.filter(version_number=rev).first()
+    return _get_version(base_file_id, rev)
 
 
 class FileVersionViewSet(viewsets.ModelViewSet):
@@ -52,101 +178,486 @@ class FileVersionViewSet(viewsets.ModelViewSet):
     queryset = FileVersion.objects.all()
     authentication_classes = [TokenAuthentication]
     permission_classes = [permissions.IsAuthenticated]
+    content_negotiation_class = FormatParamContentNegotiation
 
     def list_available_files(self, request):
+        """
+        GET /documents/mine[?latest=1|as_of=<timestamp>][&limit=<int>][&cursor=<str>][&format=ndjson]
+        The caller's versions ordered by file name, newest version first.
+        Pages are a plain JSON list, the next one is linked from the
+        ``Link`` header. ``latest=1`` keeps only the newest version of each
+        document, ``as_of`` the newest one created by that time.
+        ``format=ndjson`` streams every matching row instead, one JSON
+        object per line.
+        """
+        as_of = _as_of(request)
         qs = (FileVersion.objects
             .filter(base_file__owner=request.user)
-            .select_related("base_file")
-            .order_by("base_file__file_name", "-version_number"))
-        ser = FileVersionSerializer(qs, many=True, context={"request": request})
-        return Response(ser.data)
+            .select_related("base_file"))
+        if as_of is not None:
+            qs = qs.as_of(as_of)
+        elif _flag(request.query_params.get("latest")):
+            qs = qs.filter(latest_of__isnull=False)
+
+        paginator = DocumentListPagination()
+        if request.query_params.get("format") == "ndjson":
+            rows = paginator.filter_queryset(qs, request)
+            return StreamingHttpResponse(_iter_ndjson(rows), content_type="application/x-ndjson")
 
+        page = paginator.paginate_queryset(qs, request, view=self)
+        ser = FileVersionSerializer(page, many=True, context={"request": request})
+        return paginator.get_paginated_response(ser.data)
+
+    def export_documents(self, request):
+        """
+        GET /documents/export[?prefix=<dir>][&path=<file-path>...][&revisions=latest|all]
+                             [&as_of=<timestamp>][&format=zip|tar]
+        Stream the caller's documents as an archive built on the fly: all
+        of them, those under ``prefix``, or the listed ``path``s. Only the
+        latest revision of each by default; with ``revisions=all`` every
+        revision, as ``<path>@<version_number>``. ``as_of`` exports the
+        documents as they were at that time.
+        """
+        as_of = _as_of(request)
+        fmt = request.query_params.get("format", "zip")
+        revisions = request.query_params.get("revisions", "latest")
+        if fmt not in EXPORT_FORMATS or revisions not in ("latest", "all"):
+            return Response({"detail": "Use format=zip|tar and revisions=latest|all."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        qs = (FileVersion.objects.with_codec()
+            .filter(base_file__owner=request.user)
+            .select_related("base_file"))
+        prefix = request.query_params.get("prefix")
+        if prefix:
+            qs = qs.filter(base_file__file_name__startswith=_normalize_doc_path("/documents/" + prefix) + "/")
+        paths = request.query_params.getlist("path")
+        if paths:
+            qs = qs.filter(base_file__file_name__in=[_normalize_doc_path("/documents/" + p) for p in paths])
+        if revisions == "all":
+            if as_of is not None:
+                qs = qs.filter(created_at__lte=as_of)
+        elif as_of is not None:
+            qs = qs.as_of(as_of)
+        else:
+            qs = qs.filter(latest_of__isnull=False)
+
+        qs = qs.order_by("base_file__file_name", "version_number")
+        repeated = None
+        if fmt == "zip":
+            # zip has no links: repeated content is kept until its last entry
+            repeated = dict(qs.order_by()
+                .values("file_hash")
+                .annotate(n=Count("id"))
+                .filter(n__gt=1)
+                .values_list("file_hash", "n"))
+
+        def entries():
+            for fv in qs.iterator(chunk_size=500):
+                name = fv.base_file.file_name.removeprefix("/documents/")
+                if revisions == "all":
+                    name = f"{name}@{fv.version_number}"
+                size = fv.file_size if fv.file_size is not None else fv.file_content.size
+                yield archives.ExportEntry(name, fv.file_hash, size, fv.created_at, fv.open_content)
+
+        if fmt == "zip":
+            content = archives.stream_zip(entries(), repeated)
+        else:
+            content = archives.stream_tar(entries())
+        response = StreamingHttpResponse(content, content_type=EXPORT_FORMATS[fmt])
+        response["Content-Disposition"] = f'attachment; filename="documents.{fmt}"'
+        return response
+
+    def search_documents(self, request):
+        """
+        GET /documents/search?q=<words>[&revisions=latest|all][&limit=<int>][&offset=<int>]
+        The caller's text documents containing every word of ``q``, best
+        match first, each with a snippet around the matches (marked with
+        ``**``). Only the latest version of each document unless
+        ``revisions=all``.
+        """
+        text = request.query_params.get("q", "")
+        revisions = request.query_params.get("revisions", "latest")
+        try:
+            limit = min(int(request.query_params.get("limit", 20)), SEARCH_MAX_LIMIT)
+            offset = int(request.query_params.get("offset", 0))
+        except ValueError:
+            limit = offset = -1
+        if not text.strip() or revisions not in ("latest", "all") or limit < 1 or offset < 0:
+            return Response({"detail": "Provide ?q=<words>, revisions=latest|all and a positive limit."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if search.backend() is None:
+            return Response({"detail": "Search is not available on this database."},
+                            status=status.HTTP_501_NOT_IMPLEMENTED)
+
+        hits = search.search(request.user, text, latest=revisions == "latest", limit=limit, offset=offset)
+        return Response([
+            {
+                "id": fv.id,
+                "file_name": fv.base_file.file_name,
+                "version_number": fv.version_number,
+                "file_version_url": f"{fv.base_file.file_name}?revision={fv.version_number}",
+                "created_at": fv.created_at,
+                "snippet": snippet,
+                "score": score,
+            }
+            for fv, snippet, score in hits
+        ])
+
+    def list_document_history(self, request, path=None):
+        """
+        GET /documents/history/<file-path>[?limit=<int>][&cursor=<str>]
+        Version metadata of one document, newest first, paginated by
+        version number. Served from the (base_file, version_number)
+        covering index without loading the versions as model instances.
+        """
+        logical_path = _normalize_doc_path("/documents/" + unquote(path))
+        doc = _resolve_or_404(request.user, logical_path)
+
+        qs = (FileVersion.objects
+            .filter(base_file_id=doc.base_file_id)
+            .values("version_number", "file_hash", "file_size", "created_at"))
+        paginator = VersionHistoryPagination()
+        page = paginator.paginate_queryset(qs, request, view=self)
+        ser = FileVersionHistorySerializer(page, many=True, context={"request": request, "file_name": logical_path})
+        return paginator.get_paginated_response(ser.data)
 
     def diff_file_versions(self, request, path=None):
         """
-        GET /documents/<file-path>/diff?from=<int>&to=<int>
-        Returns an HTML side-by-side diff of the file *contents only*
-        for two UTF-8 text versions.
+        GET /documents/<file-path>/diff?from=<int>&to=<int>[&format=...][&context=<int>]
+        Diff of the file *contents only* for two UTF-8 text versions.
+        ``format`` is one of:
+          html     side-by-side HTML page (default, whole file unless ``context``)
+          unified  unified diff text, streamed hunk by hunk
+          json     {"from", "to", "stats", "hunks": [...]}, streamed hunk by hunk
+          stats    {"added", "removed", "changed"} line counts only
+        ``context`` is the number of unchanged lines around each change
+        (default 3 for unified/json).
         """
         logical_path = _normalize_doc_path("/documents/" + unquote(path))
-        bf = get_object_or_404(BaseFile, file_name=logical_path, owner=request.user)
+        doc = _resolve_or_404(request.user, logical_path)
 
         # Validate query params
         rev_from = request.query_params.get("from")
         rev_to   = request.query_params.get("to")
         if rev_from is None or rev_to is None:
             return Response({"detail": "Provide ?from=<int>&to=<int>."}, status=400)
+        fmt = request.query_params.get("format", "html")
+        if fmt not in DIFF_FORMATS:
+            return Response({"detail": f"'format' must be one of {', '.join(DIFF_FORMATS)}."}, status=400)
+        context = request.query_params.get("context")
+        if context is not None:
+            try:
+                context = int(context)
+            except ValueError:
+                context = -1
+            if context < 0:
+                return Response({"detail": "'context' must be a non-negative integer."}, status=400)
+        elif fmt in ("unified", "json"):
+            context = 3
 
-        fv_a = _get_revision(bf, rev_from)
-        fv_b = _get_revision(bf, rev_to)
+        fv_a = _get_revision(doc.base_file_id, rev_from)
+        fv_b = _get_revision(doc.base_file_id, rev_to)
         if not fv_a or not fv_b:
             return Response({"detail": "One or both revisions not found."}, status=404)
 
+        if fmt == "stats":
+            # a cached diff answers without reading either blob
+            opcodes = diffs.get_cached_diff_opcodes(fv_a.file_hash, fv_b.file_hash)
+            if opcodes is not None:
+                return Response(diffs.diff_stats(opcodes))
+
         # Read *only* the raw contents
-        with fv_a.file_content.open("rb") as fa, fv_b.file_content.open("rb") as fb:
-            try:
-                text_a = fa.read().decode("utf-8")
-                text_b = fb.read().decode("utf-8")
-            except UnicodeDecodeError:
-                return Response(
-                    {"detail": "Diff only supported for UTF-8 text files."},
-                    status=415
-                )
+        with fv_a.open_content() as fa, fv_b.open_content() as fb:
+            text_a = search.extract_text(fa)
+            text_b = search.extract_text(fb)
+        if text_a is None or text_b is None:
+            return Response(
+                {"detail": "Diff only supported for UTF-8 text files."},
+                status=415
+            )
 
-        # Build HTML diff of contents only
-        html = HtmlDiff(wrapcolumn=800).make_file(
-            text_a.splitlines(),
-            text_b.splitlines(),
-            fromdesc=f"Revision {fv_a.version_number}",
-            todesc=f"Revision {fv_b.version_number}",
-            context=False,
-        )
+        lines_a, lines_b = text_a.splitlines(), text_b.splitlines()
+        opcodes = diffs.cached_diff_opcodes(fv_a.file_hash, fv_b.file_hash, lines_a, lines_b)
+        fromdesc = f"Revision {fv_a.version_number}"
+        todesc = f"Revision {fv_b.version_number}"
+
+        if fmt == "stats":
+            return Response(diffs.diff_stats(opcodes))
+        if fmt == "unified":
+            return StreamingHttpResponse(
+                diffs.iter_unified(lines_a, lines_b, opcodes,
+                                   f"{logical_path}?revision={fv_a.version_number}",
+                                   f"{logical_path}?revision={fv_b.version_number}",
+                                   context=context),
+                content_type="text/x-diff; charset=utf-8",
+            )
+        if fmt == "json":
+            return StreamingHttpResponse(
+                diffs.iter_json(lines_a, lines_b, opcodes, fromdesc, todesc, context=context),
+                content_type="application/json",
+            )
+
+        html = diffs.render_html(lines_a, lines_b, opcodes, fromdesc=fromdesc, todesc=todesc, context=context)
         return HttpResponse(html, content_type="text/html")
 
-    @transaction.atomic
+    def blob_exists(self, request, sha256=None):
+        """
+        HEAD /blobs/<sha256>
+        200 when the caller already stored content with this digest, so the
+        version can be created from the hash alone; 404 otherwise.
+        Only the caller's own documents are considered, so the endpoint
+        cannot be used to probe other users' content.
+        """
+        if not _user_has_blob(request.user, sha256.lower()):
+            return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+        response = HttpResponse(status=status.HTTP_200_OK)
+        response["ETag"] = f'"{sha256.lower()}"'
+        return response
+
+    def missing_chunks(self, request):
+        """
+        POST /blobs/missing  {"chunks": [<sha256>, ...]}
+        Of the chunks of a content the client is about to upload, those it
+        has to send; the others are stored already and can be listed in the
+        manifest of the upload without their bytes.
+        """
+        chunk_hashes = _parse_hashes(request.data.get("chunks"))
+        if chunk_hashes is None:
+            return Response({"detail": "'chunks' must be a list of SHA-256 digests."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        known = _user_chunks(request.user, chunk_hashes)
+        missing = list(dict.fromkeys(h for h in chunk_hashes if h not in known))
+        return Response({"missing": missing})
+
     def create_document_version(self, request, path=None):
         uploaded = request.FILES.get("file")
-        if not uploaded:
-            return Response({"detail": "'file' is required."},
+        file_hash = (request.data.get("file_hash") or "").lower()
+        manifest = request.data.get("manifest")
+        if not uploaded and not file_hash and manifest is None:
+            return Response({"detail": "'file', 'file_hash' or 'manifest' is required."},
                             status=status.HTTP_400_BAD_REQUEST)
 
         logical_path = _normalize_doc_path("/documents/" + unquote(path))
-        fv = FileVersion.objects.create(
-            file_content=uploaded,
-            file_name=logical_path,
+        if manifest is not None and not uploaded:
+            # the content as a list of chunks; only the ones missing on the
+            # server are uploaded, each as a part named by its hash
+            chunk_hashes = _parse_hashes(manifest)
+            if not chunk_hashes:
+                return Response({"detail": "'manifest' must be a non-empty list of SHA-256 digests."},
+                                status=status.HTTP_400_BAD_REQUEST)
+            parts = {h: request.FILES[h] for h in chunk_hashes if h in request.FILES}
+            known = _user_chunks(request.user, set(chunk_hashes) - parts.keys())
+            missing = list(dict.fromkeys(h for h in chunk_hashes if h not in parts and h not in known))
+            if missing:
+                return Response({"detail": "Chunks are missing.", "missing": missing},
+                                status=status.HTTP_400_BAD_REQUEST)
+            try:
+                fv = FileVersion.objects.create_from_chunks(
+                    chunk_hashes, parts, file_name=logical_path, owner=request.user,
+                )
+            except ValueError as exc:
+                return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        elif uploaded:
+            fv = FileVersion.objects.create(
+                file_content=uploaded,
+                file_hash=getattr(uploaded, "sha256", ""),
+                file_name=logical_path,
+                owner=request.user,
+            )
+        else:
+            # client skipped the upload: content must already be stored
+            if not _user_has_blob(request.user, file_hash):
+                return Response({"detail": "No stored content matches 'file_hash'."},
+                                status=status.HTTP_404_NOT_FOUND)
+            fv = FileVersion.objects.create(
+                file_hash=file_hash,
+                file_name=logical_path,
+                owner=request.user,
+            )
+
+        return _version_created(fv, logical_path)
+
+    def create_documents_batch(self, request):
+        """
+        POST /batch/documents[?path=<directory>]
+        Create many versions in one request, from either
+          - a multipart body with one file part per document, the field
+            name being its path (Django's DATA_UPLOAD_MAX_NUMBER_FILES
+            caps the number of parts), or
+          - a tar (optionally gzip/bzip2/xz compressed) or zip body, each
+            regular file of the archive becoming the document at its path.
+        Paths are taken relative to ``path``. 201 with one result per
+        entry; 207 if some entries were rejected, the others are created.
+        """
+        prefix = (request.query_params.get("path") or "").strip("/")
+        entries = archives.iter_archive(request.content_type, request.stream)
+        if entries is None:
+            entries = ((name, f) for name, files in request.FILES.lists() for f in files)
+
+        results = []
+
+        def accepted():
+            # entries are checked as create_many reads them, so only the
+            # current window of files is open at a time
+            for name, f in entries:
+                if len(results) >= settings.BATCH_UPLOAD_MAX_ENTRIES:
+                    f.close()
+                    raise ParseError(f"At most {settings.BATCH_UPLOAD_MAX_ENTRIES} entries per batch.")
+                name = name.strip("/")
+                if not name:
+                    f.close()
+                    results.append({"file_name": name, "status": status.HTTP_400_BAD_REQUEST,
+                                    "detail": "Empty document path."})
+                    continue
+                logical_path = _normalize_doc_path("/documents/" + (f"{prefix}/{name}" if prefix else name))
+                results.append({"file_name": logical_path, "status": status.HTTP_201_CREATED})
+                yield logical_path, f
+
+        try:
+            versions = FileVersion.objects.create_many(
+                request.user, accepted(), workers=settings.BATCH_UPLOAD_WORKERS,
+            )
+        except IntegrityError:
+            # a document of the batch was created concurrently
+            return Response({"detail": "Conflicting concurrent upload, retry the batch."},
+                            status=status.HTTP_409_CONFLICT)
+        if not results:
+            return Response({"detail": "No documents in the request."}, status=status.HTTP_400_BAD_REQUEST)
+        created = iter(versions)
+        for result in results:
+            if result["status"] == status.HTTP_201_CREATED:
+                fv = next(created)
+                result.update({
+                    "id": fv.id,
+                    "version_number": fv.version_number,
+                    "file_hash": fv.file_hash,
+                    "file_version_url": f"{result['file_name']}?revision={fv.version_number}",
+                })
+        rejected = len(versions) < len(results)
+        return Response({"results": results},
+                        status=status.HTTP_207_MULTI_STATUS if rejected else status.HTTP_201_CREATED)
+
+    def create_upload_session(self, request):
+        """
+        POST /uploads  {"path": <document path>, "size": <bytes>}
+        Start a resumable upload of the next version of a document. The
+        content is sent with PUT requests to ``upload_url`` and turned into
+        a version by POSTing to ``upload_url`` + ``/commit``.
+        """
+        path = request.data.get("path")
+        try:
+            size = int(request.data.get("size"))
+        except (TypeError, ValueError):
+            size = -1
+        if not path or size < 0:
+            return Response({"detail": "'path' and a non-negative 'size' are required."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if size > settings.UPLOAD_SESSION_MAX_SIZE:
+            return Response({"detail": f"'size' may be at most {settings.UPLOAD_SESSION_MAX_SIZE} bytes."},
+                            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        session = UploadSession.objects.create(
             owner=request.user,
+            file_name=_normalize_doc_path("/documents/" + path),
+            size=size,
         )
+        try:
+            uploads.create_staging(session)
+        except OSError:
+            # e.g. larger than the staging filesystem allows
+            uploads.discard(session.pk)
+            session.delete()
+            return Response({"detail": "The upload cannot be staged."},
+                            status=status.HTTP_507_INSUFFICIENT_STORAGE)
+        return _session_state(session, status.HTTP_201_CREATED)
 
-        return Response(
-            {
-                "id": fv.id,
-                "file_name": logical_path,
-                "version_number": fv.version_number,
-                "document_url": logical_path,
-                "file_version_url": f"{logical_path}?revision={fv.version_number}",
-                "created_at": fv.created_at,
-            },
-            status=status.HTTP_201_CREATED,
-        )
+    def upload_session_status(self, request, session_id=None):
+        """
+        GET /uploads/<id>
+        The byte ranges received so far, to resume after a failure.
+        """
+        return _session_state(get_object_or_404(UploadSession, pk=session_id, owner=request.user))
+
+    def upload_chunk(self, request, session_id=None):
+        """
+        PUT /uploads/<id>?offset=<int>   (body: the bytes)
+        Write one chunk of the content at ``offset``. Chunks may be sent in
+        parallel, in any order, and again after a dropped connection.
+        """
+        session = get_object_or_404(UploadSession, pk=session_id, owner=request.user)
+        try:
+            offset = int(request.query_params.get("offset", ""))
+            length = int(request.META.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            offset = length = -1
+        if offset < 0 or length < 0 or offset + length > session.size:
+            return Response({"detail": "The chunk must lie within the declared size."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            written = uploads.write_chunk(session, offset, request.stream, length) if length else 0
+        except FileNotFoundError:
+            # committed or aborted meanwhile
+            raise Http404("No such upload session.")
+        with transaction.atomic():
+            session = get_object_or_404(UploadSession.objects.select_for_update(), pk=session.pk)
+            if written:
+                session.received = uploads.add_range(session.received, offset, offset + written)
+                session.save(update_fields=["received"])
+        return _session_state(session)
+
+    def commit_upload_session(self, request, session_id=None):
+        """
+        POST /uploads/<id>/commit  [{"sha256": <expected digest>}]
+        Create the version from a complete upload. 409 lists the ranges
+        received when bytes are still missing.
+        """
+        session = get_object_or_404(UploadSession, pk=session_id, owner=request.user)
+        if not session.complete:
+            response = _session_state(session, status.HTTP_409_CONFLICT)
+            response.data["detail"] = "The upload is incomplete."
+            return response
+        expected = (request.data.get("sha256") or "").lower()
+        try:
+            fv = FileVersion.objects.create_from_upload(session, expected)
+        except UploadSession.DoesNotExist:
+            raise Http404("No such upload session.")
+        except ValueError:
+            return Response({"detail": "The uploaded content does not match 'sha256'."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return _version_created(fv, session.file_name)
+
+    def abort_upload_session(self, request, session_id=None):
+        """DELETE /uploads/<id>: drop the session and its staged bytes."""
+        get_object_or_404(UploadSession, pk=session_id, owner=request.user).delete()
+        uploads.discard(session_id)
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
     def retrieve_document(self, request, path=None):
         logical_path = _normalize_doc_path("/documents/" + unquote(path))
-        bf = get_object_or_404(BaseFile, file_name=logical_path, owner=request.user)
+        doc = _resolve_or_404(request.user, logical_path)
 
         rev = request.query_params.get("revision")
+        as_of = _as_of(request)
         if rev is not None:
             try:
                 rev_num = int(rev)
             except (TypeError, ValueError):
                 raise Http404("Invalid revision")
-            fv = bf.versions.filter(version_number=rev_num).first()
+            fv = _get_version(doc.base_file_id, rev_num)
+        elif as_of is not None:
+            fv = (FileVersion.objects.with_codec()
+                .filter(base_file_id=doc.base_file_id)
+                .as_of(as_of)
+                .select_related("base_file")
+                .first())
         else:
-            fv = bf.versions.first()
+            fv = _get_latest_version(request.user, logical_path, doc)
 
         if not fv or not fv.file_content:
             raise Http404("Requested revision not found")
 
-        return FileResponse(fv.file_content.open("rb"), as_attachment=False)
+        return document_response(request, fv, pinned=rev is not None)
 
     @transaction.atomic
     def delete_document_version(self, request, path=None):
@@ -167,28 +678,8 @@ class FileVersionViewSet(viewsets.ModelViewSet):
         if not fv:
             raise Http404("Requested revision not found")
 
-        hash_to_check = fv.file_hash
-        cas_name = fv.file_content.name
-        # delete the chosen version
-        fv.delete()
-        # if no more versions remain for this BaseFile, delete the BaseFile too
-        remaining_qs = bf.versions.all()
-        if not remaining_qs.exists():
-            bf.delete()
-        else:
-            # keep latest_version_number = next free (max + 1)
-            max_ver = remaining_qs.aggregate(Max("version_number"))["version_number__max"]
-            bf.latest_version_number = (max_ver + 1) if max_ver is not None else 0
-            bf.save(update_fields=["latest_version_number"])
-        # Delete CAS blob if no more FileVersions reference it
-        if hash_to_check:
-            still_used = FileVersion.objects.filter(file_hash=hash_to_check).exists()
-            if (not still_used) and cas_name:
-                try:
-                    if default_storage.exists(cas_name):
-                        default_storage.delete(cas_name)
-                except Exception as e:
-                    print(f"Warning: failed to delete CAS file {cas_name}: {e}")
-                    pass
+        # delete the chosen version; the BaseFile goes with its last one and
+        # an unreferenced blob is left to the sweep_blobs command
+        FileVersion.objects.delete_version(fv)
 
         return Response(status=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,192 @@
+"""
+Reading documents out of uploaded archives for batch ingestion, and
+writing exports as archives streamed on the fly.
+
+A tar body (plain, gzip, bzip2 or xz) is read as a stream, member by
+member, without storing the archive. A zip has its directory at the end,
+so the body is spooled first. Only regular files become entries.
+
+Exports are written in path order and hold one chunk of a blob in
+memory at a time. Entries sharing a hash are read once: tar stores the
+repeats as hard links; zip has no links, so it keeps a repeated blob
+until its last entry, small ones in memory and the rest in temporary
+files.
+"""
+import io
+import shutil
+import tarfile
+import tempfile
+import zipfile
+from collections import namedtuple
+
+from django.core.files import File
+
+# entries up to this size stay in memory
+ENTRY_SPOOL_SIZE = 1024 * 1024
+ARCHIVE_SPOOL_SIZE = 64 * 1024 * 1024
+COPY_SIZE = 1024 * 1024
+
+TAR_CONTENT_TYPES = (
+    "application/x-tar",
+    "application/gzip",
+    "application/x-gzip",
+    "application/x-gtar",
+    "application/x-bzip2",
+    "application/x-xz",
+)
+ZIP_CONTENT_TYPES = ("application/zip", "application/x-zip-compressed")
+# repeated blobs a zip export keeps in memory, in all; the rest go to temporary files
+ZIP_REPEAT_BUFFER_SIZE = 16 * 1024 * 1024
+
+# ``open`` returns a readable file of the decoded content; ``mtime`` is a datetime
+ExportEntry = namedtuple("ExportEntry", ["name", "file_hash", "size", "mtime", "open"])
+
+
+def _spool(fh):
+    spooled = tempfile.SpooledTemporaryFile(max_size=ENTRY_SPOOL_SIZE)
+    shutil.copyfileobj(fh, spooled, COPY_SIZE)
+    spooled.seek(0)
+    return File(spooled)
+
+
+def iter_tar(stream):
+    """Yield ``(member name, File)`` for the regular files of a tar stream."""
+    with tarfile.open(fileobj=stream, mode="r|*") as tar:
+        for member in tar:
+            if member.isfile():
+                yield member.name, _spool(tar.extractfile(member))
+
+
+def iter_zip(stream):
+    """Yield ``(member name, File)`` for the regular files of a zip body."""
+    with tempfile.SpooledTemporaryFile(max_size=ARCHIVE_SPOOL_SIZE) as body:
+        shutil.copyfileobj(stream, body, COPY_SIZE)
+        with zipfile.ZipFile(body) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    with archive.open(info) as fh:
+                        yield info.filename, _spool(fh)
+
+
+def iter_archive(content_type, stream):
+    """Entries of an archive body by its content type; None for other types."""
+    if content_type in TAR_CONTENT_TYPES:
+        return iter_tar(stream)
+    if content_type in ZIP_CONTENT_TYPES:
+        return iter_zip(stream)
+    return None
+
+
+def _read(entry):
+    with entry.open() as fh:
+        while data := fh.read(COPY_SIZE):
+            yield data
+
+
+def stream_tar(entries):
+    """Yield a tar archive of ``entries``; repeated content becomes hard links to its first entry."""
+    first_name = {}
+    for entry in entries:
+        info = tarfile.TarInfo(entry.name)
+        info.mtime = int(entry.mtime.timestamp())
+        info.mode = 0o644
+        link = first_name.get(entry.file_hash)
+        if link is not None:
+            info.type = tarfile.LNKTYPE
+            info.linkname = link
+            yield info.tobuf(tarfile.PAX_FORMAT)
+            continue
+        first_name[entry.file_hash] = entry.name
+        info.size = entry.size
+        yield info.tobuf(tarfile.PAX_FORMAT)
+        written = 0
+        for data in _read(entry):
+            written += len(data)
+            yield data
+        if written != entry.size:
+            raise ValueError(f"{entry.name}: read {written} of {entry.size} bytes.")
+        yield tarfile.NUL * (-entry.size % tarfile.BLOCKSIZE)
+    # end-of-archive marker
+    yield tarfile.NUL * (2 * tarfile.BLOCKSIZE)
+
+
+class _Sink:
+    """Unseekable file collecting what zipfile writes until the generator drains it."""
+
+    def __init__(self):
+        self._chunks = []
+        self._pos = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _release(kept, file_hash):
+    fh = kept.pop(file_hash)
+    size = fh.tell() if isinstance(fh, io.BytesIO) else 0
+    fh.close()
+    return size
+
+
+def stream_zip(entries, repeated=None):
+    """
+    Yield a zip archive of ``entries``. ``repeated`` maps each hash shared
+    by several entries to their number: that content is read once and
+    kept until its last entry, in memory up to ZIP_REPEAT_BUFFER_SIZE in
+    all and in temporary files beyond that.
+    """
+    sink = _Sink()
+    remaining = dict(repeated or {})
+    kept = {}
+    in_memory = 0
+    try:
+        with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            for entry in entries:
+                info = zipfile.ZipInfo(entry.name, date_time=entry.mtime.timetuple()[:6])
+                info.compress_type = zipfile.ZIP_DEFLATED
+                # lets zipfile switch to ZIP64 for large entries up front
+                info.file_size = entry.size
+                with archive.open(info, "w") as out:
+                    keep = kept.get(entry.file_hash)
+                    if keep is not None:
+                        keep.seek(0)
+                        while data := keep.read(COPY_SIZE):
+                            out.write(data)
+                            yield sink.drain()
+                    else:
+                        if entry.file_hash in remaining:
+                            if in_memory + entry.size <= ZIP_REPEAT_BUFFER_SIZE:
+                                keep = io.BytesIO()
+                                in_memory += entry.size
+                            else:
+                                keep = tempfile.TemporaryFile()
+                        for data in _read(entry):
+                            out.write(data)
+                            if keep is not None:
+                                keep.write(data)
+                            yield sink.drain()
+                        if keep is not None:
+                            kept[entry.file_hash] = keep
+                yield sink.drain()
+                if entry.file_hash in remaining:
+                    remaining[entry.file_hash] -= 1
+                    if not remaining[entry.file_hash]:
+                        del remaining[entry.file_hash]
+                        in_memory -= _release(kept, entry.file_hash)
+        yield sink.drain()
+    finally:
+        for file_hash in list(kept):
+            _release(kept, file_hash)
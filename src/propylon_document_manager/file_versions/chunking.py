@@ -0,0 +1,316 @@
+"""
+Content-defined chunking of large blobs.
+
+With BLOB_CHUNKING enabled, the chunk_blobs command splits loose blobs
+of at least BLOB_CHUNKING_MIN_SIZE bytes where a rolling Gear hash of the
+preceding bytes hits a bit mask (FastCDC-style normalized chunking).
+Boundaries depend only on nearby content, so an edit changes the chunks
+around it and all others keep their hashes. Every chunk is stored as a
+blob of its own; the whole blob gets ``codec="chunked"``, no file at its
+CAS path, and an ordered manifest of BlobChunk rows. Each manifest entry
+holds a reference on its chunk, so a chunk is swept only when no manifest
+uses it any more.
+
+The hash is computed byte by byte in Python, a few MB/s, so uploads are
+stored whole and split afterwards rather than in the request. Clients
+may also upload just the chunks the server lacks (see
+FileVersionManager.create_from_chunks).
+"""
+import bisect
+import hashlib
+import io
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from .compression import choose_codec, open_decoded
+
+# 64-bit Gear table, derived from SHA-256 so it is stable across processes
+_GEAR = [int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], "big") for i in range(256)]
+_MASK_64 = (1 << 64) - 1
+READ_SIZE = 4 * 1024 * 1024
+MANIFEST_BATCH = 64
+
+
+def _top_bits(n):
+    # the high bits of a Gear hash depend on the last 64 bytes, the low ones on far fewer
+    return ((1 << n) - 1) << (64 - n)
+
+
+def _masks(avg_size):
+    bits = max(avg_size.bit_length() - 1, 2)
+    # stricter before the average size, looser after: chunk sizes cluster around it
+    return _top_bits(bits + 1), _top_bits(bits - 1)
+
+
+def cut_point(buf, avg_size):
+    """Length of the first chunk of ``buf`` (the whole of it if it is short)."""
+    min_size, max_size = avg_size // 4, avg_size * 4
+    n = len(buf)
+    if n <= min_size:
+        return n
+    n = min(n, max_size)
+    mask_s, mask_l = _masks(avg_size)
+    normal = min(avg_size, n)
+    gear, mask_64 = _GEAR, _MASK_64
+    h, i = 0, min_size
+    while i < normal:
+        h = ((h << 1) + gear[buf[i]]) & mask_64
+        if not h & mask_s:
+            return i + 1
+        i += 1
+    while i < n:
+        h = ((h << 1) + gear[buf[i]]) & mask_64
+        if not h & mask_l:
+            return i + 1
+        i += 1
+    return n
+
+
+def iter_chunks(f, avg_size):
+    """Yield the content-defined chunks of readable file ``f``."""
+    buf, start, eof = bytearray(), 0, False
+    while True:
+        while not eof and len(buf) - start < avg_size * 4:
+            data = f.read(READ_SIZE)
+            if not data:
+                eof = True
+                break
+            # consumed bytes are dropped once per read, not once per chunk
+            del buf[:start]
+            start = 0
+            buf += data
+        if start == len(buf):
+            return
+        with memoryview(buf) as view:
+            rest = view[start:]
+            cut = cut_point(rest, avg_size)
+            chunk = bytes(rest[:cut])
+            rest.release()
+        start += cut
+        yield chunk
+
+
+def _store_chunk(blobs, chunk):
+    from .models import _cas_path, _store_blob
+
+    chunk_hash = hashlib.sha256(chunk).hexdigest()
+    codec, registered = blobs.acquire(chunk_hash, len(chunk), choose_codec(io.BytesIO(chunk)))
+    try:
+        if registered or not default_storage.exists(_cas_path(chunk_hash)):
+            _store_blob(_cas_path(chunk_hash), ContentFile(chunk), codec)
+    except BaseException:
+        blobs.release(chunk_hash)
+        raise
+    return chunk_hash, len(chunk)
+
+
+def write_manifest(blobs, file_hash, chunks, start=0, offset=0):
+    """Append ``(chunk hash, size)`` entries to the manifest; they take over the chunk references."""
+    from .models import BlobChunk
+
+    rows = []
+    for index, (chunk_hash, size) in enumerate(chunks, start):
+        rows.append(BlobChunk(blob_id=file_hash, index=index, chunk_id=chunk_hash, offset=offset))
+        offset += size
+    BlobChunk.objects.using(blobs.db).bulk_create(rows)
+    return offset
+
+
+def store_chunked(blobs, file_hash, f, avg_size):
+    """Split ``f`` into chunks, store the new ones and write the manifest of blob ``file_hash``."""
+    f.seek(0)
+    pending, index, offset = [], 0, 0
+    try:
+        for chunk in iter_chunks(f, avg_size):
+            pending.append(_store_chunk(blobs, chunk))
+            if len(pending) == MANIFEST_BATCH:
+                offset = write_manifest(blobs, file_hash, pending, index, offset)
+                index += len(pending)
+                pending = []
+        write_manifest(blobs, file_hash, pending, index, offset)
+    except BaseException:
+        release_chunks(blobs, pending)
+        raise
+
+
+def _drop_manifest(blobs, file_hash):
+    from .models import BlobChunk
+
+    manifest = BlobChunk.objects.using(blobs.db).filter(blob_id=file_hash)
+    chunks = list(manifest.values_list("chunk_id", "offset"))
+    manifest.delete()
+    release_chunks(blobs, chunks)
+
+
+def split_blob(blobs, blob, avg_size):
+    """
+    Turn the loose, stored ``blob`` into a chunked one: store its chunks,
+    write the manifest and, once the row says "chunked", delete the file.
+    Returns False (and keeps the blob as it was) when the blob was packed,
+    re-encoded, swept or made a delta base meanwhile.
+    """
+    from .models import Blob
+
+    try:
+        with open_decoded(default_storage.open(blob.cas_path, "rb"), blob.codec) as fh:
+            store_chunked(blobs, blob.file_hash, fh, avg_size)
+        with transaction.atomic(using=blobs.db):
+            converted = (Blob.objects.using(blobs.db)
+                .filter(pk=blob.pk, codec=blob.codec, pack__isnull=True, refcount__gt=0)
+                .exclude(Exists(Blob.objects.filter(delta_base=OuterRef("pk"))))
+                .update(codec="chunked"))
+    except BaseException:
+        _drop_manifest(blobs, blob.file_hash)
+        raise
+    if not converted:
+        _drop_manifest(blobs, blob.file_hash)
+        return False
+    # a reader that looked up the old codec just before falls back to the manifest
+    default_storage.delete(blob.cas_path)
+    return True
+
+
+def acquire_chunks(blobs, chunk_hashes, parts):
+    """
+    Reference every chunk of an upload negotiated chunk by chunk. Chunks
+    in ``parts`` (hash → uploaded file) are stored when new; the others
+    must be registered already. Returns ``(hash, size)`` entries.
+    """
+    from .models import Blob
+
+    held = []
+    try:
+        for chunk_hash in chunk_hashes:
+            part = parts.get(chunk_hash)
+            if part is not None:
+                part.seek(0)
+                data = part.read()
+                if hashlib.sha256(data).hexdigest() != chunk_hash:
+                    raise ValueError(f"Chunk {chunk_hash} does not match its content.")
+                held.append(_store_chunk(blobs, data))
+            elif blobs.add_ref(chunk_hash):
+                size = Blob.objects.using(blobs.db).values_list("size", flat=True).get(pk=chunk_hash)
+                held.append((chunk_hash, size))
+            else:
+                raise ValueError(f"Chunk {chunk_hash} is not stored.")
+    except BaseException:
+        release_chunks(blobs, held)
+        raise
+    return held
+
+
+def release_chunks(blobs, chunks):
+    for chunk_hash, _ in chunks:
+        blobs.release(chunk_hash)
+
+
+class ChunkedFile:
+    """
+    Read-only file streaming the chunks of a manifest one after another.
+    Given the ``offsets`` of the chunks in the content it can also seek,
+    opening only the chunk the new position falls in.
+    """
+
+    def __init__(self, parts, offsets=None):
+        self._parts = list(parts)
+        self._offsets = offsets
+        self._index = 0
+        self._current = None
+        self._pos = 0
+
+    def _next(self):
+        if self._index >= len(self._parts):
+            return False
+        path, codec = self._parts[self._index]
+        self._index += 1
+        self._current = open_decoded(default_storage.open(path, "rb"), codec)
+        return True
+
+    def _close_current(self):
+        if self._current is not None:
+            self._current.close()
+            self._current = None
+
+    def read(self, size=-1):
+        out = []
+        while size != 0:
+            if self._current is None and not self._next():
+                break
+            data = self._current.read(size)
+            if not data:
+                self._close_current()
+                continue
+            out.append(data)
+            self._pos += len(data)
+            if size > 0:
+                size -= len(data)
+        return b"".join(out)
+
+    def seekable(self):
+        return self._offsets is not None
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            pos += self._pos
+        elif whence != io.SEEK_SET or self._offsets is None:
+            raise io.UnsupportedOperation("seek")
+        self._close_current()
+        self._index = max(bisect.bisect_right(self._offsets, pos) - 1, 0)
+        self._pos = pos
+        if self._next() and pos > self._offsets[self._index - 1]:
+            self._current.seek(pos - self._offsets[self._index - 1])
+        return pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        self._close_current()
+        self._index = len(self._parts)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def manifest_parts(file_hash):
+    """``(CAS path, codec)`` of each chunk of blob ``file_hash``, in order."""
+    from .models import BlobChunk, _cas_path
+
+    parts = (BlobChunk.objects
+        .filter(blob_id=file_hash)
+        .order_by("index")
+        .values_list("chunk_id", "chunk__codec"))
+    return [(_cas_path(chunk_hash), codec) for chunk_hash, codec in parts]
+
+
+def open_chunked(file_hash):
+    """Open the content of chunked blob ``file_hash`` for reading; the file can seek."""
+    from .models import BlobChunk, _cas_path
+
+    manifest = list(BlobChunk.objects
+        .filter(blob_id=file_hash)
+        .order_by("index")
+        .values_list("chunk_id", "chunk__codec", "offset"))
+    return ChunkedFile(
+        [(_cas_path(chunk_hash), codec) for chunk_hash, codec, _ in manifest],
+        [offset for _, _, offset in manifest],
+    )
+
+
+def hash_chunks(chunk_hashes):
+    """SHA-256 and size of the content made of the given stored chunks."""
+    from .models import Blob, _cas_path
+
+    codecs = dict(Blob.objects.filter(pk__in=set(chunk_hashes)).values_list("file_hash", "codec"))
+    digest, size = hashlib.sha256(), 0
+    with ChunkedFile([(_cas_path(h), codecs[h]) for h in chunk_hashes]) as fh:
+        while data := fh.read(READ_SIZE):
+            digest.update(data)
+            size += len(data)
+    return digest.hexdigest(), size
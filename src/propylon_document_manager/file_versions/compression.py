@@ -0,0 +1,117 @@
+"""
+Optional compression of stored CAS blobs.
+
+Blobs stay at their ``cas/xx/yy/<sha256>`` path and the hash is always that
+of the original content; only the bytes on disk are encoded. The codec of
+each blob is recorded in ``Blob.codec`` ("" for raw bytes).
+
+Which codec new blobs get is set by BLOB_COMPRESSION. Content that will not
+shrink — known compressed formats, or a sample that already looks random —
+is stored raw so reads of it stay seekable.
+"""
+import gzip
+import lzma
+import math
+import shutil
+import tempfile
+from collections import Counter
+
+from django.conf import settings
+
+CODEC_CHOICES = [("", "none"), ("gzip", "gzip"), ("xz", "xz")]
+
+SAMPLE_SIZE = 64 * 1024
+# bits per byte above which a sample is treated as incompressible
+MAX_ENTROPY = 7.5
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# signatures of formats that are compressed already
+_COMPRESSED_MAGIC = (
+    b"%PDF",  # streams inside are deflated
+    b"PK\x03\x04",  # zip, docx, odt, epub
+    b"\x1f\x8b",  # gzip
+    b"\xfd7zXZ\x00",  # xz
+    b"BZh",  # bzip2
+    b"7z\xbc\xaf\x27\x1c",  # 7-zip
+    b"\x28\xb5\x2f\xfd",  # zstd
+    b"\x89PNG",
+    b"\xff\xd8\xff",  # jpeg
+    b"GIF8",
+    b"RIFF",  # webp, avi, wav
+)
+
+
+def _entropy(sample):
+    n = len(sample)
+    return -sum(c / n * math.log2(c / n) for c in Counter(sample).values())
+
+
+def choose_codec(f):
+    """Codec to store the content of file ``f`` with, from a sample of its head."""
+    codec = settings.BLOB_COMPRESSION
+    if not codec:
+        return ""
+    f.seek(0)
+    sample = f.read(SAMPLE_SIZE)
+    f.seek(0)
+    if len(sample) < settings.BLOB_COMPRESSION_MIN_SIZE:
+        return ""
+    if sample.startswith(_COMPRESSED_MAGIC) or _entropy(sample) > MAX_ENTROPY:
+        return ""
+    return codec
+
+
+def _encoder(codec, fileobj):
+    if codec == "gzip":
+        # mtime=0 keeps the output a function of the content alone
+        return gzip.GzipFile(fileobj=fileobj, mode="wb", mtime=0)
+    if codec == "xz":
+        return lzma.LZMAFile(fileobj, mode="wb")
+    raise ValueError(f"Unknown blob codec {codec!r}.")
+
+
+def encode(f, codec):
+    """Return a temporary file holding the content of ``f`` encoded with ``codec``."""
+    tmp = tempfile.TemporaryFile()
+    f.seek(0)
+    with _encoder(codec, tmp) as out:
+        shutil.copyfileobj(f, out, COPY_CHUNK_SIZE)
+    tmp.seek(0)
+    return tmp
+
+
+class DecodedFile:
+    """Reader decompressing a stored blob; closing it closes the blob too."""
+
+    def __init__(self, reader, fh):
+        self._reader = reader
+        self._fh = fh
+
+    def read(self, size=-1):
+        return self._reader.read(size)
+
+    def fileno(self):
+        return self._fh.fileno()
+
+    def close(self):
+        try:
+            self._reader.close()
+        finally:
+            self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_decoded(fh, codec):
+    """Wrap the stored file ``fh`` in a reader that decompresses as it goes."""
+    if not codec:
+        return fh
+    if codec == "gzip":
+        return DecodedFile(gzip.GzipFile(fileobj=fh, mode="rb"), fh)
+    if codec == "xz":
+        return DecodedFile(lzma.LZMAFile(fh, mode="rb"), fh)
+    raise ValueError(f"Unknown blob codec {codec!r}.")
@@ -0,0 +1,185 @@
+"""
+Delta storage of revisions against the previous blob of the same document.
+
+With BLOB_DELTA enabled a new version whose content differs from the
+document's latest blob by a few lines is stored as a delta: a zlib
+compressed list of "copy bytes from the base" and "insert these bytes"
+operations, found with the patience line matcher used for diffs. The Blob
+row records ``codec="delta"``, its base and the length of the chain down
+to a full blob; every BLOB_DELTA_MAX_CHAIN versions a full keyframe is
+stored instead, which bounds the work of a read.
+
+Each delta holds a reference on its base Blob, so bases are only swept
+after every delta built on them is gone. Reconstructed contents are kept
+in a bounded in-process LRU, as the latest revisions are read the most.
+"""
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+
+from django.conf import settings
+
+from . import packs
+from .compression import open_decoded
+from .diffs import PatienceSequenceMatcher
+
+MAGIC = b"CASDELTA1"
+_COPY = b"C"
+_INSERT = b"I"
+_COPY_STRUCT = struct.Struct(">QQ")
+_LEN_STRUCT = struct.Struct(">Q")
+
+
+def make_delta(base, target):
+    """Delta turning bytes ``base`` into bytes ``target``."""
+    lines_a = base.splitlines(keepends=True)
+    lines_b = target.splitlines(keepends=True)
+    offsets_a = [0]
+    for line in lines_a:
+        offsets_a.append(offsets_a[-1] + len(line))
+    offsets_b = [0]
+    for line in lines_b:
+        offsets_b.append(offsets_b[-1] + len(line))
+
+    out = [MAGIC]
+    for tag, i1, i2, j1, j2 in PatienceSequenceMatcher(lines_a, lines_b).get_opcodes():
+        if tag == "equal":
+            out.append(_COPY + _COPY_STRUCT.pack(offsets_a[i1], offsets_a[i2] - offsets_a[i1]))
+        elif j2 > j1:
+            data = target[offsets_b[j1]:offsets_b[j2]]
+            out.append(_INSERT + _LEN_STRUCT.pack(len(data)) + data)
+    return zlib.compress(b"".join(out))
+
+
+def apply_delta(base, delta):
+    """Rebuild the target bytes from ``base`` and a make_delta() result."""
+    ops = zlib.decompress(delta)
+    if not ops.startswith(MAGIC):
+        raise ValueError("Not a CAS delta.")
+    out, pos = [], len(MAGIC)
+    while pos < len(ops):
+        op = ops[pos:pos + 1]
+        pos += 1
+        if op == _COPY:
+            offset, length = _COPY_STRUCT.unpack_from(ops, pos)
+            pos += _COPY_STRUCT.size
+            out.append(base[offset:offset + length])
+        elif op == _INSERT:
+            (length,) = _LEN_STRUCT.unpack_from(ops, pos)
+            pos += _LEN_STRUCT.size
+            out.append(ops[pos:pos + length])
+            pos += length
+        else:
+            raise ValueError("Corrupt CAS delta.")
+    return b"".join(out)
+
+
+class _ByteLRU:
+    """Thread-safe LRU bounded by the total size of its values."""
+
+    def __init__(self):
+        self._data = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value, limit):
+        if len(value) > limit:
+            return
+        with self._lock:
+            if key in self._data:
+                return
+            self._data[key] = value
+            self._size += len(value)
+            while self._size > limit:
+                _, old = self._data.popitem(last=False)
+                self._size -= len(old)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._size = 0
+
+
+reconstructed = _ByteLRU()
+
+
+def _read_stored(blob):
+    with open_decoded(packs.open_blob(blob), blob.codec) as fh:
+        return fh.read()
+
+
+def reconstruct(file_hash, use_cache=True):
+    """
+    Full content of blob ``file_hash``: read directly for a keyframe,
+    otherwise by applying the deltas from the nearest full (or cached)
+    ancestor. ``use_cache=False`` reads everything from storage.
+    """
+    from .models import Blob
+
+    chain, key, data = [], file_hash, None
+    while True:
+        data = reconstructed.get(key) if use_cache else None
+        if data is not None:
+            break
+        blob = Blob.objects.select_related("pack").get(pk=key)
+        chain.append(blob)
+        if blob.codec != "delta":
+            break
+        key = blob.delta_base_id
+
+    data = apply_chain(chain, data)
+    if use_cache:
+        reconstructed.put(file_hash, data, settings.BLOB_DELTA_CACHE_SIZE)
+    return data
+
+
+def load_chain(file_hash):
+    """Blob rows from ``file_hash`` down to the full blob its deltas apply to."""
+    from .models import Blob
+
+    chain = [Blob.objects.select_related("pack").get(pk=file_hash)]
+    while chain[-1].codec == "delta":
+        chain.append(Blob.objects.select_related("pack").get(pk=chain[-1].delta_base_id))
+    return chain
+
+
+def apply_chain(chain, data=None):
+    """
+    Content of ``chain[0]``, from the content ``data`` of the base of the
+    last delta in ``chain`` or, without it, from the full blob ending it.
+    """
+    if data is None:
+        chain = chain[:]
+        data = _read_stored(chain.pop())
+    for blob in reversed(chain):
+        with packs.open_blob(blob) as fh:
+            # pack_blobs packs every delta: decompress it straight from the memory map
+            delta = fh.getbuffer() if isinstance(fh, packs.PackSlice) else fh.read()
+            data = apply_delta(data, delta)
+    return data
+
+
+def prepare_delta(content, base_hash):
+    """
+    ``(base_hash, chain_length, delta)`` for storing bytes ``content`` as a
+    delta against blob ``base_hash``, or None when a full blob is better:
+    the chain would get too long, the base is chunked (it has no stored
+    bytes of its own to apply a delta to), or the delta saves less than half.
+    """
+    from .models import Blob
+
+    base = Blob.objects.filter(pk=base_hash).values_list("chain_length", "codec").first()
+    if base is None or base[1] == "chunked" or base[0] + 1 >= settings.BLOB_DELTA_MAX_CHAIN:
+        return None
+    delta = make_delta(reconstruct(base_hash), content)
+    if len(delta) * 2 > len(content):
+        return None
+    return base_hash, base[0] + 1, delta
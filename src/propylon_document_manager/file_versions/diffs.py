@@ -0,0 +1,289 @@
+"""
+Line diffs between document revisions.
+
+Matching uses the patience algorithm: lines that occur exactly once on
+both sides anchor the alignment and only the gaps between anchors are
+searched further. This is close to linear for documents such as bills,
+where most lines are unique, unlike difflib's Ratcliff/Obershelp matcher.
+Computed opcodes are cached by the ordered pair of blob hashes, since
+revisions never change once stored.
+
+Besides the HTML page, diffs can be produced as unified-diff text, as a
+JSON list of hunks (both generated hunk by hunk so they can be streamed)
+or as line counts only.
+"""
+import json
+from bisect import bisect_left
+from collections import Counter
+from difflib import Match, SequenceMatcher
+from html import escape
+
+from django.conf import settings
+from django.core.cache import caches
+
+# bump when the matching algorithm changes, so stale cached opcodes are ignored
+CACHE_VERSION = 1
+
+
+class PatienceSequenceMatcher(SequenceMatcher):
+    """
+    SequenceMatcher whose matching blocks come from a patience diff.
+
+    Everything built on get_matching_blocks() (get_opcodes,
+    get_grouped_opcodes, ratio) works unchanged.
+    """
+
+    def __init__(self, a=(), b=()):
+        super().__init__(None, a, b, autojunk=False)
+
+    def get_matching_blocks(self):
+        if self.matching_blocks is not None:
+            return self.matching_blocks
+        blocks = []
+        for i, j, n in sorted(_patience_blocks(self.a, self.b)):
+            if blocks and blocks[-1][0] + blocks[-1][2] == i and blocks[-1][1] + blocks[-1][2] == j:
+                blocks[-1][2] += n
+            else:
+                blocks.append([i, j, n])
+        blocks.append([len(self.a), len(self.b), 0])
+        self.matching_blocks = [Match(*block) for block in blocks]
+        return self.matching_blocks
+
+
+def _unique_anchors(a, alo, ahi, b, blo, bhi):
+    """Longest increasing run of (i, j) pairs of lines unique on both sides."""
+    count_a = Counter(a[alo:ahi])
+    count_b = Counter(b[blo:bhi])
+    index_b = {b[j]: j for j in range(blo, bhi) if count_b[b[j]] == 1}
+    pairs = [(i, index_b[a[i]]) for i in range(alo, ahi)
+             if count_a[a[i]] == 1 and a[i] in index_b]
+    if not pairs:
+        return []
+
+    # patience sorting on j, keeping back-pointers to rebuild the sequence
+    tops, top_idx, prev = [], [], [None] * len(pairs)
+    for k, (_, j) in enumerate(pairs):
+        pile = bisect_left(tops, j)
+        if pile:
+            prev[k] = top_idx[pile - 1]
+        if pile == len(tops):
+            tops.append(j)
+            top_idx.append(k)
+        else:
+            tops[pile] = j
+            top_idx[pile] = k
+
+    anchors, k = [], top_idx[-1]
+    while k is not None:
+        anchors.append(pairs[k])
+        k = prev[k]
+    anchors.reverse()
+    return anchors
+
+
+def _patience_blocks(a, b):
+    """Yield unordered (i, j, n) matching blocks of ``a`` and ``b``."""
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        alo, ahi, blo, bhi = stack.pop()
+
+        n = 0
+        while alo + n < ahi and blo + n < bhi and a[alo + n] == b[blo + n]:
+            n += 1
+        if n:
+            yield alo, blo, n
+            alo, blo = alo + n, blo + n
+        n = 0
+        while alo < ahi - n and blo < bhi - n and a[ahi - n - 1] == b[bhi - n - 1]:
+            n += 1
+        if n:
+            yield ahi - n, bhi - n, n
+            ahi, bhi = ahi - n, bhi - n
+        if alo == ahi or blo == bhi:
+            continue
+
+        anchors = _unique_anchors(a, alo, ahi, b, blo, bhi)
+        if not anchors:
+            # no unique lines left to anchor on, fall back to difflib
+            matcher = SequenceMatcher(None, a[alo:ahi], b[blo:bhi], autojunk=False)
+            for i, j, size in matcher.get_matching_blocks():
+                if size:
+                    yield alo + i, blo + j, size
+            continue
+
+        for i, j in anchors:
+            yield i, j, 1
+            stack.append((alo, i, blo, j))
+            alo, blo = i + 1, j + 1
+        stack.append((alo, ahi, blo, bhi))
+
+
+def diff_opcodes(lines_a, lines_b):
+    return PatienceSequenceMatcher(lines_a, lines_b).get_opcodes()
+
+
+def _cache_key(hash_a, hash_b):
+    return f"diff:{CACHE_VERSION}:{hash_a}:{hash_b}"
+
+
+def get_cached_diff_opcodes(hash_a, hash_b):
+    """Previously computed opcodes for the pair, or None."""
+    return caches[settings.DOCUMENT_DIFF_CACHE].get(_cache_key(hash_a, hash_b))
+
+
+def cached_diff_opcodes(hash_a, hash_b, lines_a, lines_b):
+    """
+    Opcodes turning ``lines_a`` into ``lines_b``, cached under the ordered
+    ``(hash_a, hash_b)`` pair. The cache backend handles LRU eviction.
+    """
+    opcodes = get_cached_diff_opcodes(hash_a, hash_b)
+    if opcodes is None:
+        opcodes = diff_opcodes(lines_a, lines_b)
+        caches[settings.DOCUMENT_DIFF_CACHE].set(
+            _cache_key(hash_a, hash_b), opcodes, settings.DOCUMENT_DIFF_CACHE_TIMEOUT
+        )
+    return opcodes
+
+
+def diff_stats(opcodes):
+    """Counts of added, removed and changed lines; needs no file contents."""
+    added = removed = changed = 0
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == "insert":
+            added += j2 - j1
+        elif tag == "delete":
+            removed += i2 - i1
+        elif tag == "replace":
+            common = min(i2 - i1, j2 - j1)
+            changed += common
+            removed += i2 - i1 - common
+            added += j2 - j1 - common
+    return {"added": added, "removed": removed, "changed": changed}
+
+
+def group_opcodes(opcodes, context=None):
+    """
+    Split opcodes into hunks with ``context`` unchanged lines around each
+    change. ``None`` keeps the whole file as a single hunk.
+    """
+    if not opcodes:
+        return []
+    if context is None:
+        return [opcodes]
+    matcher = SequenceMatcher()
+    matcher.opcodes = list(opcodes)
+    return list(matcher.get_grouped_opcodes(context))
+
+
+_HTML_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+table.diff {{font-family: monospace; border-collapse: collapse}}
+table.diff td {{white-space: pre-wrap; vertical-align: top; padding: 0 4px}}
+td.diff_header {{text-align: right; color: #888}}
+.diff_add {{background-color: #aaffaa}}
+.diff_chg {{background-color: #ffff77}}
+.diff_sub {{background-color: #ffaaaa}}
+tr.diff_skip td {{text-align: center; color: #888}}
+</style>
+</head>
+<body>
+<table class="diff">
+<thead><tr><th colspan="2">{fromdesc}</th><th colspan="2">{todesc}</th></tr></thead>
+<tbody>
+{rows}
+</tbody>
+</table>
+</body>
+</html>
+"""
+
+_TAG_CLASS = {"replace": "diff_chg", "delete": "diff_sub", "insert": "diff_add"}
+
+
+def _html_rows(lines_a, lines_b, groups):
+    for g, group in enumerate(groups):
+        if g:
+            yield '<tr class="diff_skip"><td colspan="4">&hellip;</td></tr>'
+        for tag, i1, i2, j1, j2 in group:
+            css = _TAG_CLASS.get(tag, "")
+            for k in range(max(i2 - i1, j2 - j1)):
+                i, j = i1 + k, j1 + k
+                left = (f'<td class="diff_header">{i + 1}</td><td class="{css}">{escape(lines_a[i])}</td>'
+                        if i < i2 else '<td class="diff_header"></td><td></td>')
+                right = (f'<td class="diff_header">{j + 1}</td><td class="{css}">{escape(lines_b[j])}</td>'
+                         if j < j2 else '<td class="diff_header"></td><td></td>')
+                yield f"<tr>{left}{right}</tr>"
+
+
+def render_html(lines_a, lines_b, opcodes, fromdesc, todesc, context=None):
+    """Side-by-side HTML table, the whole file or only ``context`` lines around changes."""
+    rows = "\n".join(_html_rows(lines_a, lines_b, group_opcodes(opcodes, context)))
+    return _HTML_PAGE.format(
+        title=escape(f"{fromdesc} → {todesc}"),
+        fromdesc=escape(fromdesc),
+        todesc=escape(todesc),
+        rows=rows,
+    )
+
+
+def _hunk_range(start, count):
+    # unified diff ranges are 1-based; an empty range points at the line before
+    if count == 0:
+        return f"{start},0"
+    if count == 1:
+        return f"{start + 1}"
+    return f"{start + 1},{count}"
+
+
+def _hunk_lines(lines_a, lines_b, group):
+    for tag, i1, i2, j1, j2 in group:
+        if tag == "equal":
+            for line in lines_a[i1:i2]:
+                yield " ", line
+            continue
+        for line in lines_a[i1:i2]:
+            yield "-", line
+        for line in lines_b[j1:j2]:
+            yield "+", line
+
+
+def iter_unified(lines_a, lines_b, opcodes, fromfile, tofile, context=3):
+    """Yield a unified diff, one hunk per chunk of text."""
+    groups = group_opcodes(opcodes, context)
+    if not groups or (len(groups) == 1 and all(op[0] == "equal" for op in groups[0])):
+        return
+    yield f"--- {fromfile}\n+++ {tofile}\n"
+    for group in groups:
+        first, last = group[0], group[-1]
+        head = (f"@@ -{_hunk_range(first[1], last[2] - first[1])} "
+                f"+{_hunk_range(first[3], last[4] - first[3])} @@\n")
+        yield head + "".join(f"{op}{line}\n" for op, line in _hunk_lines(lines_a, lines_b, group))
+
+
+def iter_json(lines_a, lines_b, opcodes, fromdesc, todesc, context=3):
+    """
+    Yield a JSON document ``{"from", "to", "stats", "hunks": [...]}``
+    piece by piece, one hunk per chunk.
+    """
+    yield '{"from": %s, "to": %s, "stats": %s, "hunks": [' % (
+        json.dumps(fromdesc), json.dumps(todesc), json.dumps(diff_stats(opcodes))
+    )
+    sep = ""
+    for group in group_opcodes(opcodes, context):
+        if all(op[0] == "equal" for op in group):
+            continue
+        first, last = group[0], group[-1]
+        hunk = {
+            "from_start": first[1] + 1,
+            "from_count": last[2] - first[1],
+            "to_start": first[3] + 1,
+            "to_count": last[4] - first[3],
+            "lines": [[op, line] for op, line in _hunk_lines(lines_a, lines_b, group)],
+        }
+        yield sep + json.dumps(hunk)
+        sep = ", "
+    yield "]}"
@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef
+
+from propylon_document_manager.file_versions import chunking
+from propylon_document_manager.file_versions.models import Blob, BlobChunk
+
+
+class Command(BaseCommand):
+    help = "Split large loose CAS blobs into content-defined chunks shared between revisions"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--min-size", type=int, default=None,
+            help="Split blobs of at least this many bytes (default: BLOB_CHUNKING_MIN_SIZE).",
+        )
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--dry-run", action="store_true", help="Only list the blobs that would be split.")
+
+    def handle(self, *args, **options):
+        if not settings.BLOB_CHUNKING:
+            self.stdout.write("BLOB_CHUNKING is off, nothing to do")
+            return
+        min_size = options["min_size"]
+        if min_size is None:
+            min_size = settings.BLOB_CHUNKING_MIN_SIZE
+        candidates = (Blob.objects
+            .filter(size__gte=min_size, refcount__gt=0, pack__isnull=True, codec__in=["", "gzip", "xz"])
+            # delta bases are read from their own file, chunks stay whole
+            .exclude(Exists(Blob.objects.filter(delta_base=OuterRef("pk"))))
+            .exclude(Exists(BlobChunk.objects.filter(chunk=OuterRef("pk")))))
+
+        split = seen = 0
+        last = ""
+        while True:
+            batch = list(candidates.filter(pk__gt=last).order_by("pk")[:options["batch_size"]])
+            if not batch:
+                break
+            last = batch[-1].pk
+            for blob in batch:
+                seen += 1
+                if options["dry_run"]:
+                    self.stdout.write(blob.file_hash)
+                elif chunking.split_blob(Blob.objects, blob, settings.BLOB_CHUNK_AVG_SIZE):
+                    split += 1
+        if options["dry_run"]:
+            self.stdout.write(self.style.SUCCESS(f"Would split {seen} blobs"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Split {split} of {seen} blobs into chunks"))
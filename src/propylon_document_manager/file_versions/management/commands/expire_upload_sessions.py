@@ -0,0 +1,42 @@
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from propylon_document_manager.file_versions import uploads
+from propylon_document_manager.file_versions.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = "Delete upload sessions that were not committed in time, with their staging files"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--max-age", type=int, default=None,
+            help="Seconds after which a session expires (default: UPLOAD_SESSION_MAX_AGE).",
+        )
+
+    def handle(self, *args, **options):
+        max_age = options["max_age"]
+        if max_age is None:
+            max_age = settings.UPLOAD_SESSION_MAX_AGE
+        cutoff = timezone.now() - timedelta(seconds=max_age)
+
+        expired = 0
+        for session_id in UploadSession.objects.filter(created_at__lt=cutoff).values_list("pk", flat=True):
+            if UploadSession.objects.filter(pk=session_id).delete()[0]:
+                uploads.discard(session_id)
+                expired += 1
+
+        # staging files whose session is gone, e.g. after a crash mid-commit
+        staging = uploads.staging_dir()
+        if os.path.isdir(staging):
+            live = {str(pk) for pk in UploadSession.objects.values_list("pk", flat=True)}
+            for name in os.listdir(staging):
+                path = os.path.join(staging, name)
+                if name not in live and os.path.getmtime(path) < cutoff.timestamp():
+                    os.remove(path)
+
+        self.stdout.write(self.style.SUCCESS(f"Expired {expired} upload sessions"))
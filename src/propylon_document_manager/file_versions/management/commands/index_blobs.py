@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Exists, OuterRef
+
+from propylon_document_manager.file_versions import search
+from propylon_document_manager.file_versions.models import Blob, FileVersion
+
+
+class Command(BaseCommand):
+    help = "Add the text of blobs not yet looked at by the search indexer to the search index"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        if search.backend() is None:
+            raise CommandError("The database has no search backend.")
+        pending = (Blob.objects
+            .filter(indexed_at__isnull=True, refcount__gt=0)
+            .filter(Exists(FileVersion.objects.filter(file_hash=OuterRef("pk")))))
+
+        indexed = seen = 0
+        last = ""
+        while True:
+            batch = list(pending
+                .filter(pk__gt=last)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:options["batch_size"]])
+            if not batch:
+                break
+            last = batch[-1]
+            for file_hash in batch:
+                seen += 1
+                if search.index_blob(file_hash):
+                    indexed += 1
+        self.stdout.write(self.style.SUCCESS(f"Looked at {seen} blobs, indexed {indexed} texts"))
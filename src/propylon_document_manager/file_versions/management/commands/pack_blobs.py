@@ -0,0 +1,127 @@
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from propylon_document_manager.file_versions import packs
+from propylon_document_manager.file_versions.models import Blob, BlobChunk, Pack
+
+
+class Command(BaseCommand):
+    help = "Move small or old loose CAS blobs into pack files and rewrite mostly dead packs"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--max-size", type=int, default=64 * 1024,
+            help="Pack blobs of at most this many bytes (deltas always qualify).",
+        )
+        parser.add_argument(
+            "--older-than", type=int, default=0,
+            help="Also pack blobs of any size created this many days ago (0: off).",
+        )
+        parser.add_argument(
+            "--min-age", type=int, default=60 * 60,
+            help="Leave blobs created within this many seconds loose.",
+        )
+        parser.add_argument("--pack-size", type=int, default=64 * 1024 * 1024, help="Target bytes per pack.")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--dry-run", action="store_true", help="Only list the blobs that would be packed.")
+
+    def handle(self, *args, **options):
+        self.options = options
+        now = timezone.now()
+        self.cutoff = now - timedelta(seconds=options["min_age"])
+        wanted = Q(size__lte=options["max_size"]) | Q(codec="delta")
+        if options["older_than"]:
+            wanted |= Q(created_at__lt=now - timedelta(days=options["older_than"]))
+        loose = (Blob.objects
+            .filter(wanted, pack__isnull=True, refcount__gt=0, created_at__lt=self.cutoff)
+            # chunked blobs have no bytes of their own, and chunks are read by path
+            .exclude(codec="chunked")
+            .exclude(Exists(BlobChunk.objects.filter(chunk=OuterRef("pk")))))
+        # packs where swept blobs left more than half of the bytes dead
+        sparse = list(Pack.objects
+            .annotate(live=Coalesce(Sum("blobs__pack_length"), 0))
+            .filter(live__lt=F("size") / 2)
+            .values_list("pk", flat=True))
+        moving = Blob.objects.filter(pack__in=sparse)
+
+        if options["dry_run"]:
+            count = 0
+            for qs in (loose, moving):
+                for blob in self.iter_blobs(qs):
+                    self.stdout.write(blob.file_hash)
+                    count += 1
+            self.stdout.write(self.style.SUCCESS(f"Would pack {count} blobs"))
+            return
+
+        self.stats = {"blobs": 0, "packs": 0, "removed": 0}
+        for qs in (loose, moving):
+            entries = self.stored(self.iter_blobs(qs))
+            while True:
+                name, index = packs.write_pack(entries, options["pack_size"])
+                if name is None:
+                    break
+                self.register(name, index)
+        self.stats["removed"] = self.remove_unused_packs()
+        self.stdout.write(self.style.SUCCESS(
+            f"Packed {self.stats['blobs']} blobs into {self.stats['packs']} packs, "
+            f"removed {self.stats['removed']} packs"
+        ))
+
+    def iter_blobs(self, qs):
+        last = ""
+        while True:
+            batch = list(qs.select_related("pack").filter(pk__gt=last).order_by("pk")[:self.options["batch_size"]])
+            if not batch:
+                return
+            last = batch[-1].pk
+            yield from batch
+
+    def stored(self, blobs):
+        self.sources = {}
+        for blob in blobs:
+            try:
+                fh = packs.open_blob(blob)
+            except FileNotFoundError:
+                # already swept; a missing live blob is for scrub_blobs to report
+                continue
+            self.sources[blob.pk] = blob.pack_id
+            yield blob.pk, fh
+
+    def register(self, name, index):
+        moved = []
+        with transaction.atomic():
+            pack = Pack.objects.create(name=name, size=sum(length for _, _, length in index))
+            for file_hash, offset, length in index:
+                source = self.sources.pop(file_hash)
+                # skipped if the blob was swept or moved meanwhile
+                if Blob.objects.filter(pk=file_hash, pack=source).update(
+                        pack=pack, pack_offset=offset, pack_length=length):
+                    moved.append((file_hash, source))
+        self.stats["packs"] += 1
+        self.stats["blobs"] += len(moved)
+        for file_hash, source in moved:
+            if source is None:
+                default_storage.delete(Blob(file_hash=file_hash).cas_path)
+
+    def remove_unused_packs(self):
+        removed = 0
+        for pack in Pack.objects.filter(~Exists(Blob.objects.filter(pack=OuterRef("pk")))):
+            # readers holding a blob's old location re-read the row once the file is gone
+            pack.delete()
+            default_storage.delete(pack.name)
+            removed += 1
+        # files of packs whose registration failed
+        if default_storage.exists(packs.PACK_ROOT):
+            known = set(Pack.objects.values_list("name", flat=True))
+            _, files = default_storage.listdir(packs.PACK_ROOT)
+            for name in files:
+                path = f"{packs.PACK_ROOT}/{name}"
+                if path not in known and default_storage.get_modified_time(path) < self.cutoff:
+                    default_storage.delete(path)
+        return removed
@@ -0,0 +1,135 @@
+import json
+import os
+import re
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from propylon_document_manager.file_versions.models import Blob, FileVersion, _cas_path
+from propylon_document_manager.utils.throttle import Throttle
+
+CAS_ROOT = "cas"
+_SHARD_RE = re.compile(r"^[0-9a-f]{2}$")
+_HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def _list_shard(shard, throttle):
+    """All file paths under ``cas/<shard>/``; runs in a worker thread."""
+    paths = []
+    throttle.wait()
+    subdirs, _ = default_storage.listdir(f"{CAS_ROOT}/{shard}")
+    for sub in sorted(subdirs):
+        throttle.wait()
+        _, files = default_storage.listdir(f"{CAS_ROOT}/{shard}/{sub}")
+        paths.extend(f"{CAS_ROOT}/{shard}/{sub}/{name}" for name in files)
+    return shard, paths
+
+
+class Command(BaseCommand):
+    help = "Find files under cas/ that no Blob or FileVersion references and delete them"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=8, help="Threads listing shard directories.")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Hashes checked per query.")
+        parser.add_argument("--rate", type=float, default=0, help="Max storage operations per second (0: no limit).")
+        parser.add_argument(
+            "--min-age", type=int, default=60 * 60,
+            help="Only touch files not modified for this many seconds.",
+        )
+        parser.add_argument("--checkpoint", help="File recording finished shards, to resume an interrupted scan.")
+        parser.add_argument("--dry-run", action="store_true", help="Only list the orphans.")
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.throttle = Throttle(options["rate"])
+        self.cutoff = timezone.now() - timedelta(seconds=options["min_age"])
+        self.stats = {"files": 0, "orphans": 0, "deleted": 0}
+
+        checkpoint = options["checkpoint"]
+        done = self.load_checkpoint(checkpoint)
+        if default_storage.exists(CAS_ROOT):
+            shards, _ = default_storage.listdir(CAS_ROOT)
+        else:
+            shards = []
+        todo = [s for s in sorted(shards) if _SHARD_RE.match(s) and s not in done]
+
+        # keep a bounded number of shard listings in memory
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            pending = set()
+            while todo or pending:
+                while todo and len(pending) < 2 * options["workers"]:
+                    pending.add(pool.submit(_list_shard, todo.pop(0), self.throttle))
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    shard, paths = future.result()
+                    self.check_shard(paths)
+                    done.add(shard)
+                    self.save_checkpoint(checkpoint, done)
+
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        verb = "would delete" if options["dry_run"] else "deleted"
+        self.stdout.write(self.style.SUCCESS(
+            f"Scanned {self.stats['files']} files: {self.stats['orphans']} orphans, "
+            f"{verb} {self.stats['deleted']}"
+        ))
+
+    def check_shard(self, paths):
+        size = self.options["batch_size"]
+        for i in range(0, len(paths), size):
+            batch = paths[i:i + size]
+            self.stats["files"] += len(batch)
+            names = {os.path.basename(p) for p in batch}
+            hashes = {n for n in names if _HASH_RE.match(n)}
+            live = set(Blob.objects.filter(pk__in=hashes).values_list("pk", flat=True))
+            live.update(FileVersion.objects
+                .filter(file_hash__in=hashes - live)
+                .values_list("file_hash", flat=True))
+            for path in batch:
+                name = os.path.basename(path)
+                if name in live and path == _cas_path(name):
+                    continue
+                self.reap(path, name)
+
+    def reap(self, path, name):
+        self.throttle.wait()
+        modified = default_storage.get_modified_time(path)
+        if modified > self.cutoff:
+            # possibly an upload that has not registered its Blob yet
+            return
+        self.stats["orphans"] += 1
+        if self.options["dry_run"]:
+            self.stdout.write(path)
+            self.stats["deleted"] += 1
+            return
+
+        if path == _cas_path(name):
+            # hand the file to the Blob table and delete it under the row
+            # lock, so an upload acquiring the same content concurrently wins
+            if not Blob.objects.adopt(name, default_storage.size(path), modified):
+                return
+            deleted = Blob.objects.delete_unreferenced(name, self.cutoff)
+        else:
+            # leftovers like "<hash>_AbCd12" from a lost save() race are never referenced
+            default_storage.delete(path)
+            deleted = True
+        if deleted:
+            self.stdout.write(path)
+            self.stats["deleted"] += 1
+
+    def load_checkpoint(self, checkpoint):
+        if not checkpoint or not os.path.exists(checkpoint):
+            return set()
+        with open(checkpoint) as fh:
+            return set(json.load(fh)["done"])
+
+    def save_checkpoint(self, checkpoint, done):
+        if not checkpoint:
+            return
+        tmp = f"{checkpoint}.tmp"
+        with open(tmp, "w") as fh:
+            json.dump({"done": sorted(done)}, fh)
+        os.replace(tmp, checkpoint)
@@ -0,0 +1,132 @@
+import hashlib
+import io
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils import timezone
+
+from propylon_document_manager.file_versions import chunking, deltas, packs
+from propylon_document_manager.file_versions.compression import open_decoded
+from propylon_document_manager.file_versions.models import Blob, FileVersion
+from propylon_document_manager.utils.throttle import Throttle
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+def _drop_from_page_cache(fh):
+    # a scrub reads everything once; don't evict the hot documents for it
+    try:
+        os.posix_fadvise(fh.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        pass
+
+
+def _rehash(blob, throttle, source=None):
+    """Re-hash the stored file in a worker thread: (blob, sha256 or None if missing, bytes read)."""
+    digest, size = hashlib.sha256(), 0
+    try:
+        if blob.codec == "delta":
+            # straight from storage, a cached copy would hide damage
+            fh = io.BytesIO(deltas.apply_chain(source))
+        elif blob.codec == "chunked":
+            # the chunks are scrubbed as blobs of their own; this checks the manifest
+            fh = chunking.ChunkedFile(source)
+        else:
+            fh = open_decoded(packs.open_blob(blob), blob.codec)
+    except FileNotFoundError:
+        return blob, None, 0
+    with fh:
+        try:
+            while chunk := fh.read(READ_CHUNK_SIZE):
+                throttle.wait(len(chunk))
+                # hashlib (and zlib/lzma) release the GIL on large buffers, so workers run in parallel
+                digest.update(chunk)
+                size += len(chunk)
+        except FileNotFoundError:
+            # a chunk of the manifest is gone
+            return blob, None, 0
+        _drop_from_page_cache(fh)
+    return blob, digest.hexdigest(), size
+
+
+class Command(BaseCommand):
+    help = "Re-hash stored CAS blobs and report any whose content no longer matches its hash"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4, help="Threads reading and hashing blobs.")
+        parser.add_argument(
+            "--rate", type=int, default=32 * 1024 * 1024,
+            help="Read budget in bytes per second shared by all workers (0: no limit).",
+        )
+        parser.add_argument(
+            "--interval", type=int, default=30,
+            help="Days after which a verified blob is due again.",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        throttle = Throttle(options["rate"])
+        started = timezone.now()
+        due = (Blob.objects
+            .select_related("pack")
+            .filter(refcount__gt=0)
+            .filter(Q(verified_at__isnull=True)
+                    | Q(verified_at__lt=started - timedelta(days=options["interval"]))))
+
+        self.stats = {"blobs": 0, "bytes": 0, "bad": 0}
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            for batch in self.batches(due, options["batch_size"]):
+                # delta chains and manifests are read here, workers only touch storage
+                pending = {pool.submit(_rehash, blob, throttle, self.source(blob)) for blob in batch}
+                verified = []
+                while pending:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        blob, actual, size = future.result()
+                        self.stats["blobs"] += 1
+                        self.stats["bytes"] += size
+                        if actual == blob.file_hash:
+                            verified.append(blob.pk)
+                        else:
+                            self.report(blob, actual, size)
+                # marked per batch, so an interrupted run does not start over
+                Blob.objects.filter(pk__in=verified).update(verified_at=timezone.now())
+
+        self.stdout.write(f"Verified {self.stats['blobs']} blobs ({self.stats['bytes']} bytes)")
+        if self.stats["bad"]:
+            raise CommandError(f"{self.stats['bad']} blobs failed verification")
+        self.stdout.write(self.style.SUCCESS("All blobs intact"))
+
+    def source(self, blob):
+        if blob.codec == "delta":
+            return deltas.load_chain(blob.pk)
+        if blob.codec == "chunked":
+            return chunking.manifest_parts(blob.pk)
+        return None
+
+    def batches(self, qs, size):
+        last = ""
+        while True:
+            batch = list(qs.filter(pk__gt=last).order_by("pk")[:size])
+            if not batch:
+                return
+            last = batch[-1].pk
+            yield batch
+
+    def report(self, blob, actual, size):
+        self.stats["bad"] += 1
+        if actual is None:
+            problem = "missing"
+        elif size != blob.size:
+            problem = f"truncated or resized: {size} of {blob.size} bytes, sha256 {actual}"
+        else:
+            problem = f"content changed: sha256 {actual}"
+        self.stderr.write(f"{blob.cas_path}: {problem}")
+        affected = (FileVersion.objects
+            .filter(file_hash=blob.file_hash)
+            .values_list("base_file__owner__username", "base_file__file_name", "version_number"))
+        for username, file_name, version_number in affected:
+            self.stderr.write(f"  {username}: {file_name} revision {version_number}")
@@ -0,0 +1,46 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from propylon_document_manager.file_versions.models import Blob
+
+
+class Command(BaseCommand):
+    help = "Delete CAS blobs that have been unreferenced for longer than the grace period"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--grace-period", type=int, default=None,
+            help="Seconds a blob must be unreferenced (default: BLOB_GC_GRACE_PERIOD).",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--dry-run", action="store_true", help="Only list what would be deleted.")
+
+    def handle(self, *args, **options):
+        grace = options["grace_period"]
+        if grace is None:
+            grace = settings.BLOB_GC_GRACE_PERIOD
+        cutoff = timezone.now() - timedelta(seconds=grace)
+        expired = Blob.objects.filter(refcount=0, unreferenced_at__lte=cutoff)
+
+        deleted = 0
+        last = ""
+        while True:
+            batch = list(expired
+                .filter(pk__gt=last)
+                .order_by("pk")
+                .values_list("pk", flat=True)[: options["batch_size"]])
+            if not batch:
+                break
+            last = batch[-1]
+            for file_hash in batch:
+                if options["dry_run"]:
+                    self.stdout.write(file_hash)
+                    deleted += 1
+                elif Blob.objects.delete_unreferenced(file_hash, cutoff):
+                    deleted += 1
+
+        verb = "Would delete" if options["dry_run"] else "Deleted"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {deleted} unreferenced blobs"))
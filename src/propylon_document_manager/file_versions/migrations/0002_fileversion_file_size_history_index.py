@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:00
+
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+
+
+def backfill_file_size(apps, schema_editor):
+    FileVersion = apps.get_model("file_versions", "FileVersion")
+    sizes = {}
+    for fv in FileVersion.objects.filter(file_size__isnull=True).only("id", "file_content").iterator():
+        name = fv.file_content.name
+        if name not in sizes:
+            sizes[name] = default_storage.size(name) if name and default_storage.exists(name) else None
+        if sizes[name] is not None:
+            FileVersion.objects.filter(pk=fv.pk).update(file_size=sizes[name])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("file_versions", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="fileversion",
+            name="file_size",
+            field=models.BigIntegerField(editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_file_size, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="fileversion",
+            index=models.Index(
+                fields=["base_file", "-version_number", "file_hash", "file_size", "created_at"],
+                name="fileversion_history_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:02
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicate_base_files(apps, schema_editor):
+    """
+    get_or_create could race into several BaseFiles for one path. Keep the
+    oldest and append the versions of the others after its latest version.
+    """
+    BaseFile = apps.get_model("file_versions", "BaseFile")
+    FileVersion = apps.get_model("file_versions", "FileVersion")
+    duplicates = (BaseFile.objects
+        .values("owner_id", "file_name")
+        .annotate(n=Count("id"), keep_id=Min("id"))
+        .filter(n__gt=1))
+    for dup in duplicates:
+        keep = BaseFile.objects.get(pk=dup["keep_id"])
+        others = (BaseFile.objects
+            .filter(owner_id=dup["owner_id"], file_name=dup["file_name"])
+            .exclude(pk=keep.pk)
+            .order_by("id"))
+        for other in others:
+            for fv in FileVersion.objects.filter(base_file=other).order_by("version_number"):
+                fv.base_file = keep
+                fv.version_number = keep.latest_version_number
+                fv.save(update_fields=["base_file", "version_number"])
+                keep.latest_version_number += 1
+            other.delete()
+        keep.save(update_fields=["latest_version_number"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("file_versions", "0002_fileversion_file_size_history_index"),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_base_files, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="basefile",
+            constraint=models.UniqueConstraint(fields=("owner", "file_name"), name="unique_owner_file_name"),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def point_at_latest_versions(apps, schema_editor):
+    BaseFile = apps.get_model("file_versions", "BaseFile")
+    FileVersion = apps.get_model("file_versions", "FileVersion")
+    for base_file in BaseFile.objects.iterator():
+        latest = (FileVersion.objects
+            .filter(base_file=base_file)
+            .order_by("-version_number")
+            .first())
+        if latest is None:
+            continue
+        base_file.latest_version = latest
+        base_file.latest_file_hash = latest.file_hash
+        base_file.latest_file_size = latest.file_size
+        base_file.save(update_fields=["latest_version", "latest_file_hash", "latest_file_size"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("file_versions", "0003_basefile_unique_owner_file_name"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="basefile",
+            name="latest_version",
+            field=models.OneToOneField(
+                blank=True,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="latest_of",
+                to="file_versions.fileversion",
+            ),
+        ),
+        migrations.AddField(
+            model_name="basefile",
+            name="latest_file_hash",
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name="basefile",
+            name="latest_file_size",
+            field=models.BigIntegerField(editable=False, null=True),
+        ),
+        migrations.RunPython(point_at_latest_versions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-17 08:26
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def count_blob_references(apps, schema_editor):
+    Blob = apps.get_model("file_versions", "Blob")
+    FileVersion = apps.get_model("file_versions", "FileVersion")
+    rows = (FileVersion.objects
+        .exclude(file_hash="")
+        .values("file_hash")
+        .annotate(refcount=Count("id"), size=Max("file_size"))
+        .order_by())
+    Blob.objects.bulk_create(
+        (Blob(file_hash=row["file_hash"], size=row["size"] or 0, refcount=row["refcount"]) for row in rows),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("file_versions", "0004_basefile_latest_version"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Blob",
+            fields=[
+                ("file_hash", models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ("size", models.BigIntegerField()),
+                ("refcount", models.PositiveIntegerField(default=0)),
+                ("unreferenced_at", models.DateTimeField(blank=True, db_index=True, null=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RunPython(count_blob_references, migrations.RunPython.noop),
+    ]
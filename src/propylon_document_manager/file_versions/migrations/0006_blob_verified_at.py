@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("file_versions", "0005_blob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="blob",
+            name="verified_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-17 10:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("file_versions", "0006_blob_verified_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="blob",
+            name="codec",
+            field=models.CharField(
+                blank=True,
+                choices=[("", "none"), ("gzip", "gzip"), ("xz", "xz")],
+                default="",
+                max_length=8,
+            ),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-17 10:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("file_versions", "0007_blob_codec"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="blob",
+            name="chain_length",
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="blob",
+            name="delta_base",
+            field=models.ForeignKey(
+                blank=True,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="deltas",
+                to="file_versions.blob",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="blob",
+            name="codec",
+            field=models.CharField(
+                blank=True,
+                choices=[("", "none"), ("gzip", "gzip"), ("xz", "xz"), ("delta", "delta")],
+                default="",
+                max_length=8,
+            ),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-17 11:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("file_versions", "0008_blob_delta"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="blob",
+            name="codec",
+            field=models.CharField(
+                blank=True,
+                choices=[
+                    ("", "none"),
+                    ("gzip", "gzip"),
+                    ("xz", "xz"),
+                    ("delta", "delta"),
+                    ("chunked", "chunked"),
+                ],
+                default="",
+                max_length=8,
+            ),
+        ),
+        migrations.CreateModel(
+            name="BlobChunk",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("index", models.PositiveIntegerField()),
+                ("offset", models.BigIntegerField()),
+                (
+                    "blob",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="manifest",
+                        to="file_versions.blob",
+                    ),
+                ),
+                (
+                    "chunk",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.PROTECT,
+                        related_name="+",
+                        to="file_versions.blob",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("blob", "index")},
+            },
+        ),
+    ]
@@ -0,0 +1,16 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("file_versions", "0011_uploadsession"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="fileversion",
+            index=models.Index(fields=["base_file", "created_at"], name="fileversion_as_of_idx"),
+        ),
+    ]
@@ -1,12 +1,24 @@
 import hashlib
-from django.db import models, transaction
+import io
+import itertools
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import IntegrityError, connections, models, router, transaction
+from django.db.models import Case, Exists, F, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce
 from django.core.files.base import File, ContentFile
 from django.core.files.storage import default_storage
 from django.contrib.auth.models import AbstractUser, PermissionsMixin, BaseUserManager
 from django.db.models import CharField, EmailField
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from . import chunking, compression, deltas, packs, search, uploads
+from .paths import invalidate_document
+
 class UserManager(BaseUserManager):
     def _create_user(self, username, email, password, **extra_fields):
         if not username:
@@ -78,59 +90,648 @@ def _sha256_stream(fileobj, chunk_size=1024 * 1024):
     fileobj.seek(pos)
     return h.hexdigest()
 
-class FileVersionManager(models.Manager):
-    @transaction.atomic
-    def create(self, *args, **kwargs):
-        base_file = kwargs.get("base_file")
+class FileVersionQuerySet(models.QuerySet):
+    def as_of(self, when):
+        """
+        Keep only the newest version of each document created at or before
+        ``when``: the state of the documents at that moment. The subquery
+        is correlated per BaseFile of the matching versions, not per
+        version: one seek on the (base_file, created_at) index per document.
+        """
+        newest = (FileVersion.objects
+            .filter(base_file=OuterRef("pk"), created_at__lte=when)
+            .order_by("-created_at", "-version_number")
+            .values("pk")[:1])
+        docs = (BaseFile.objects
+            .filter(pk__in=self.order_by().values("base_file"))
+            .annotate(version_as_of=Subquery(newest)))
+        # a document without a version by then yields NULL, which IN never matches
+        return self.filter(pk__in=docs.values("version_as_of"))
+
+
+class FileVersionManager(models.Manager.from_queryset(FileVersionQuerySet)):
+    def with_codec(self):
+        """
+        Annotate each version with ``blob_codec``, the codec its blob is
+        stored with, and ``blob_packed``, whether it lives in a pack file.
+        """
+        blob = Blob.objects.filter(pk=OuterRef("file_hash"))
+        return self.get_queryset().annotate(
+            blob_codec=Coalesce(Subquery(blob.values("codec")[:1]), Value("")),
+            blob_packed=Exists(blob.filter(pack__isnull=False)),
+        )
 
-        if base_file is None:
-            # Pop flat arguments used for BaseFile creation
-            file_name = kwargs.pop("file_name", None)
-            owner = kwargs.pop("owner", None)
+    def create(self, *args, **kwargs):
+        """
+        Create the next version of a document.
 
-            if not file_name or not owner:
-                raise ValueError(
-                    "Provide either 'base_file' or both 'file_name' and 'owner'."
-                )
+        The content is hashed and written to the CAS before any transaction
+        is opened. The transaction only claims the version number with one
+        atomic increment and inserts the row, so concurrent uploads to the
+        same path hold the BaseFile lock for that long, not for the copy.
+        """
+        base_file, file_name, owner = _pop_document(kwargs)
+        using = self._db or router.db_for_write(self.model)
+        blobs = Blob.objects.db_manager(using)
+        obj = self.model(*args, **kwargs)
+        obj.hash_content()
+        new_content = not obj.file_content._committed
+        codec = compression.choose_codec(obj.file_content) if new_content else ""
+        delta = None
+        if settings.BLOB_DELTA and new_content:
+            delta = _prepare_delta(obj, base_file, owner, file_name, using)
+        # hold a reference before writing, so the sweeper cannot remove the
+        # blob between the existence check and the insert
+        if delta is not None:
+            try:
+                codec, registered = blobs.acquire(obj.file_hash, obj.file_size, "delta",
+                                                  delta_base=delta[0], chain_length=delta[1])
+            except Blob.DoesNotExist:
+                # the base was swept meanwhile
+                delta = None
+        if delta is None:
+            codec, registered = blobs.acquire(obj.file_hash, obj.file_size, codec)
+            if codec == "delta" and not registered and new_content:
+                # compression cannot encode a delta; write one against the row's base
+                delta = _registered_delta(obj, using)
+        try:
+            if delta is not None:
+                obj.store_blob(codec, replace=registered, encoded=delta[2])
+            else:
+                obj.store_blob(codec, replace=registered)
+            self._insert_version(obj, base_file, owner, file_name, using)
+        except BaseException:
+            blobs.release(obj.file_hash)
+            raise
 
-            # Create or get the BaseFile
-            base_file, created = BaseFile.objects.get_or_create(
-                owner=owner,
-                file_name=file_name,
-            )
-            
-        bf = BaseFile.objects.select_for_update().get(pk=base_file.pk)
+        return obj
 
-        # 3) Enforce policy: version = current latest, then bump latest
-        version_number = bf.latest_version_number
-        kwargs["base_file"] = bf
-        kwargs["version_number"] = version_number  # override any provided value
+    def create_from_chunks(self, chunk_hashes, parts, **kwargs):
+        """
+        Create the next version from the ordered chunk hashes of its content.
 
-        obj = super().create(*args, **kwargs)
+        Chunks the server lacks are uploaded in ``parts`` (hash → file); all
+        others must be stored already. The whole-content hash and size are
+        computed from the chunks, which become the manifest of a "chunked"
+        blob unless that content is stored already.
+        Raises ValueError for a chunk that is neither uploaded nor stored.
+        """
+        base_file, file_name, owner = _pop_document(kwargs)
+        using = self._db or router.db_for_write(self.model)
+        blobs = Blob.objects.db_manager(using)
+
+        held = chunking.acquire_chunks(blobs, chunk_hashes, parts)
+        try:
+            file_hash, size = chunking.hash_chunks(chunk_hashes)
+            codec, registered = blobs.acquire(file_hash, size, "chunked")
+        except BaseException:
+            chunking.release_chunks(blobs, held)
+            raise
+        try:
+            if registered:
+                chunking.write_manifest(blobs, file_hash, held)
+            else:
+                # stored before, with a manifest holding its own references
+                chunking.release_chunks(blobs, held)
+            obj = self.model(file_hash=file_hash, file_size=size, **kwargs)
+            obj.store_blob(codec)
+            self._insert_version(obj, base_file, owner, file_name, using)
+        except BaseException:
+            blobs.release(file_hash)
+            raise
+        return obj
 
-        bf.latest_version_number = version_number + 1
-        bf.save(update_fields=["latest_version_number"])
+    def create_many(self, owner, entries, workers=4, window=64):
+        """
+        Create one version for each ``(file_name, File)`` of ``entries``,
+        in bulk. Entries are consumed ``window`` at a time, as they are
+        read: a pool of ``workers`` threads hashes the contents, the blobs
+        are acquired with a few queries, the new ones written and every
+        file closed before more entries are read. Only the hashes and
+        sizes are kept until all BaseFile and FileVersion rows are inserted
+        with a few bulk queries in one transaction. Entries with the same
+        file_name become consecutive versions. Returns the versions in
+        entry order.
+
+        New blobs may be compressed, but are neither chunked nor stored as
+        deltas: batches are meant for many small documents.
+        """
+        using = self._db or router.db_for_write(self.model)
+        blobs = Blob.objects.db_manager(using)
+
+        def inspect(f):
+            file_hash = getattr(f, "sha256", "") or _sha256_stream(f)
+            return file_hash, f.size, compression.choose_codec(f)
+
+        names, inspected, acquired = [], [], Counter()
+        entries = iter(entries)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            try:
+                while batch := list(itertools.islice(entries, window)):
+                    files = [f for _name, f in batch]
+                    try:
+                        found = list(pool.map(inspect, files))
+                        wanted = {}
+                        for file_hash, size, codec in found:
+                            count = wanted[file_hash][2] + 1 if file_hash in wanted else 1
+                            wanted[file_hash] = (size, codec, count)
+                        registered = blobs.acquire_many(wanted)
+                        acquired.update({file_hash: count for file_hash, (_size, _codec, count) in wanted.items()})
+                        new = {}
+                        for f, (file_hash, _size, _codec) in zip(files, found):
+                            if registered[file_hash][1]:
+                                new.setdefault(file_hash, f)
+                        list(pool.map(lambda h: _replace_blob(h, new[h], registered[h][0]), new))
+                    finally:
+                        for f in files:
+                            f.close()
+                    names.extend(name for name, _f in batch)
+                    inspected.extend(found)
+                return self._insert_many(owner, names, inspected, using)
+            except BaseException:
+                for file_hash, count in acquired.items():
+                    blobs.release(file_hash, count)
+                raise
+
+    def _insert_many(self, owner, names, inspected, using):
+        with transaction.atomic(using=using):
+            docs = {doc.file_name: doc for doc in BaseFile.objects
+                    .select_for_update()
+                    .filter(owner=owner, file_name__in=set(names))}
+            created = [BaseFile(owner=owner, file_name=name) for name in dict.fromkeys(names) if name not in docs]
+            BaseFile.objects.bulk_create(created)
+            docs.update((doc.file_name, doc) for doc in created)
+
+            versions = []
+            for name, (file_hash, size, _codec) in zip(names, inspected):
+                doc = docs[name]
+                versions.append(self.model(
+                    base_file=doc, version_number=doc.latest_version_number,
+                    file_hash=file_hash, file_size=size, file_content=_cas_path(file_hash),
+                ))
+                doc.latest_version_number += 1
+            self.bulk_create(versions)
+
+            # one statement repoints every document at its newest version
+            newest = self.filter(base_file=OuterRef("pk")).order_by("-version_number")[:1]
+            BaseFile.objects.filter(pk__in=[doc.pk for doc in docs.values()]).update(
+                latest_version=Subquery(newest.values("pk")),
+                latest_version_number=Subquery(newest.values("version_number")) + 1,
+                latest_file_hash=Subquery(newest.values("file_hash")),
+                latest_file_size=Subquery(newest.values("file_size")),
+            )
+            for name in docs:
+                invalidate_document(owner.pk, name)
+            search.schedule(dict.fromkeys(file_hash for file_hash, _size, _codec in inspected))
+        return versions
 
+    def create_from_upload(self, session, expected_hash=""):
+        """
+        Create the next version from a complete UploadSession. The staging
+        file is moved into the CAS (or dropped when the content is stored
+        already) and the session deleted; if creating fails the session is
+        kept, so the commit can be retried.
+        Raises ValueError when the content does not hash to ``expected_hash``.
+        """
+        if not UploadSession.objects.filter(pk=session.pk).delete()[0]:
+            # committed or aborted concurrently
+            raise UploadSession.DoesNotExist(f"UploadSession {session.pk} does not exist.")
+        try:
+            file_hash = uploads.finish_hash(session)
+            if expected_hash and file_hash != expected_hash:
+                raise ValueError("The uploaded content does not match its expected SHA-256.")
+            with open(uploads.staging_path(session.pk), "rb") as fh:
+                obj = self.create(
+                    file_content=uploads.StagedFile(fh, name=session.file_name),
+                    file_hash=file_hash,
+                    file_size=session.size,
+                    file_name=session.file_name,
+                    owner=session.owner,
+                )
+        except BaseException:
+            session.save(force_insert=True)
+            raise
+        uploads.discard(session.pk)
         return obj
 
+    def _insert_version(self, obj, base_file, owner, file_name, using):
+        """Claim the next version number of the document and insert ``obj``."""
+        with transaction.atomic(using=using):
+            if base_file is None:
+                # Create or get the BaseFile
+                base_file, created = BaseFile.objects.get_or_create(
+                    owner=owner,
+                    file_name=file_name,
+                )
+            version_number = _claim_version_number(base_file.pk, using)
+            base_file.latest_version_number = version_number + 1
+            obj.base_file = base_file
+            obj.version_number = version_number
+            obj.save(force_insert=True, using=using)
+            _point_latest(base_file, obj, using)
+            invalidate_document(base_file.owner_id, base_file.file_name)
+            search.schedule([obj.file_hash])
+
+    def delete_version(self, fv):
+        """
+        Delete one version. When it is the latest, the BaseFile's pointer
+        (and next version number) moves to the newest remaining version;
+        the BaseFile itself goes with its last version.
+
+        Only metadata changes: the blob's reference is dropped and the
+        file is left for the sweep_blobs command.
+        """
+        using = self._db or router.db_for_write(self.model)
+        with transaction.atomic(using=using):
+            base_file = BaseFile.objects.using(using).select_for_update().get(pk=fv.base_file_id)
+            invalidate_document(base_file.owner_id, base_file.file_name)
+            Blob.objects.db_manager(using).release(fv.file_hash)
+            if base_file.latest_version_id not in (None, fv.pk):
+                fv.delete(using=using)
+                return
+            previous = (self.using(using)
+                .filter(base_file_id=base_file.pk)
+                .exclude(pk=fv.pk)
+                .order_by("-version_number")
+                .first())
+            if previous is None:
+                base_file.delete(using=using)  # cascades to fv
+                return
+            base_file.latest_version_number = previous.version_number + 1
+            _point_latest(base_file, previous, using, ["latest_version_number"])
+            fv.delete(using=using)
+
+    def delete_documents(self, base_files):
+        """
+        Delete whole documents with all their versions, dropping one blob
+        reference per version: for deletes that would otherwise cascade
+        past delete_version, e.g. of a BaseFile or its owner.
+        """
+        using = self._db or router.db_for_write(self.model)
+        with transaction.atomic(using=using):
+            docs = list(BaseFile.objects.using(using)
+                .select_for_update()
+                .filter(pk__in=[doc.pk for doc in base_files]))
+            references = Counter(self.using(using)
+                .filter(base_file__in=docs)
+                .values_list("file_hash", flat=True))
+            blobs = Blob.objects.db_manager(using)
+            for file_hash, count in references.items():
+                blobs.release(file_hash, count)
+            for doc in docs:
+                invalidate_document(doc.owner_id, doc.file_name)
+            BaseFile.objects.using(using).filter(pk__in=[doc.pk for doc in docs]).delete()
+
+
+def _pop_document(kwargs):
+    base_file = kwargs.pop("base_file", None)
+    file_name = kwargs.pop("file_name", None)
+    owner = kwargs.pop("owner", None)
+    if base_file is None and (not file_name or not owner):
+        raise ValueError(
+            "Provide either 'base_file' or both 'file_name' and 'owner'."
+        )
+    kwargs.pop("version_number", None)  # always assigned here
+    return base_file, file_name, owner
+
+
+def _prepare_delta(obj, base_file, owner, file_name, using):
+    """deltas.prepare_delta() of the new content against the document's latest blob."""
+    if obj.file_size is None or obj.file_size > settings.BLOB_DELTA_MAX_SIZE:
+        return None
+    if Blob.objects.using(using).filter(pk=obj.file_hash).exists():
+        # stored already, nothing to write
+        return None
+    documents = BaseFile.objects.using(using)
+    if base_file is not None:
+        documents = documents.filter(pk=base_file.pk)
+    else:
+        documents = documents.filter(owner=owner, file_name=file_name)
+    base_hash = documents.values_list("latest_file_hash", flat=True).first()
+    if not base_hash:
+        return None
+    f = obj.file_content
+    f.seek(0)
+    content = f.read()
+    f.seek(0)
+    return deltas.prepare_delta(content, base_hash)
+
+
+def _registered_delta(obj, using):
+    """
+    For content another upload registered as a delta: its delta against
+    the base the Blob row names, unless the file is stored. That upload
+    may still be writing it, or have failed after registering; either
+    write decodes to the same content.
+    """
+    row = (Blob.objects.using(using)
+        .filter(pk=obj.file_hash)
+        .values_list("delta_base", "chain_length", "pack")
+        .first())
+    if row is None or row[2] is not None or default_storage.exists(obj.cas_path):
+        return None
+    f = obj.file_content
+    f.seek(0)
+    content = f.read()
+    f.seek(0)
+    return row[0], row[1], deltas.make_delta(deltas.reconstruct(row[0]), content)
+
+
+def _point_latest(base_file, fv, using, extra_fields=()):
+    base_file.latest_version = fv
+    base_file.latest_file_hash = fv.file_hash
+    base_file.latest_file_size = fv.file_size
+    base_file.save(
+        using=using,
+        update_fields=["latest_version", "latest_file_hash", "latest_file_size", *extra_fields],
+    )
+
+
+def _can_update_returning(connection):
+    # no feature flag covers UPDATE ... RETURNING (MariaDB returns from
+    # INSERT only), so go by vendor
+    if connection.vendor == "postgresql":
+        return True
+    return connection.vendor == "sqlite" and connection.Database.sqlite_version_info >= (3, 35)
+
+
+def _claim_version_number(base_file_id, using):
+    """
+    Atomically bump BaseFile.latest_version_number and return the number
+    claimed (the value before the bump). The UPDATE row-locks the BaseFile
+    until the surrounding transaction ends.
+    """
+    connection = connections[using]
+    if not _can_update_returning(connection):
+        bumped = BaseFile.objects.using(using).filter(pk=base_file_id)
+        if not bumped.update(latest_version_number=F("latest_version_number") + 1):
+            raise BaseFile.DoesNotExist(f"BaseFile {base_file_id} does not exist.")
+        return bumped.values_list("latest_version_number", flat=True).get() - 1
+
+    # UPDATE ... RETURNING: a single round trip (PostgreSQL, SQLite >= 3.35)
+    qn = connection.ops.quote_name
+    table, column = qn(BaseFile._meta.db_table), qn("latest_version_number")
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {table} SET {column} = {column} + 1 WHERE {qn('id')} = %s RETURNING {column}",
+            [base_file_id],
+        )
+        row = cursor.fetchone()
+    if row is None:
+        raise BaseFile.DoesNotExist(f"BaseFile {base_file_id} does not exist.")
+    return row[0] - 1
+
 class BaseFile(models.Model):
     file_name = models.fields.CharField(max_length=512)
     latest_version_number = models.fields.IntegerField(default=0)
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name="base_files")
+    # denormalized copy of the newest version, kept in step by FileVersionManager
+    latest_version = models.OneToOneField(
+        "FileVersion", null=True, blank=True, editable=False,
+        on_delete=models.SET_NULL, related_name="latest_of",
+    )
+    latest_file_hash = models.CharField(max_length=64, blank=True, editable=False)
+    latest_file_size = models.BigIntegerField(null=True, editable=False)
 
     def __str__(self):
         return f"{self.file_name} (v{self.latest_version_number}) by {self.owner.username}"
 
+    class Meta:
+        constraints = [
+            # one document per logical path; also the index behind path lookups
+            models.UniqueConstraint(fields=["owner", "file_name"], name="unique_owner_file_name"),
+        ]
+
 def _cas_path(hash_hex: str) -> str:
     # shard directories to avoid huge folders
     return f"cas/{hash_hex[:2]}/{hash_hex[2:4]}/{hash_hex}"
 
+def _store_blob(cas_path: str, f, codec: str = "") -> None:
+    """
+    Write the content of FieldFile ``f`` to ``cas_path``, encoded with ``codec``.
+
+    Raw content is handed to the storage as-is: for uploads spooled to disk
+    FileSystemStorage renames the temp file into the CAS tree and only
+    copies it when the two live on different filesystems.
+    """
+    content = f.file
+    if codec:
+        content = File(compression.encode(content, codec))
+    elif not hasattr(content, "temporary_file_path"):
+        content.seek(0)
+    try:
+        saved_name = default_storage.save(cas_path, content)
+    finally:
+        if codec:
+            content.close()
+    if saved_name != cas_path:
+        # lost a race against an identical upload; the blob is already there
+        default_storage.delete(saved_name)
+
+
+def _replace_blob(file_hash, f, codec):
+    # a blob registered just now; a leftover file may be stored with another codec
+    cas_path = _cas_path(file_hash)
+    if default_storage.exists(cas_path):
+        default_storage.delete(cas_path)
+    _store_blob(cas_path, File(f), codec)
+
+
+class BlobManager(models.Manager):
+    def add_ref(self, file_hash, count=1):
+        """Add ``count`` references to a registered blob; False if there is none."""
+        return bool(self.filter(pk=file_hash).update(refcount=F("refcount") + count, unreferenced_at=None))
+
+    def acquire(self, file_hash, size, codec="", delta_base=None, chain_length=0):
+        """
+        Add a reference to the blob, registering it with ``codec`` on first
+        use. Returns the codec the blob is (to be) stored with and whether
+        this call registered it.
+
+        A delta blob registered here takes a reference on ``delta_base``;
+        Blob.DoesNotExist is raised if that base is gone.
+        """
+        blob = self.filter(pk=file_hash)
+        if not self.add_ref(file_hash):
+            try:
+                with transaction.atomic(using=self.db):
+                    if delta_base is not None and not self.add_ref(delta_base):
+                        raise self.model.DoesNotExist(f"Delta base {delta_base} does not exist.")
+                    self.create(file_hash=file_hash, size=size or 0, refcount=1, codec=codec,
+                                delta_base_id=delta_base, chain_length=chain_length)
+                return codec, True
+            except IntegrityError:
+                # registered concurrently
+                self.add_ref(file_hash)
+        return blob.values_list("codec", flat=True).get(), False
+
+    def acquire_many(self, blobs):
+        """
+        acquire() for many blobs with a few queries: ``blobs`` maps each
+        file_hash to ``(size, codec, number of references)``. Returns
+        file_hash → ``(codec, registered)``.
+        """
+        result = dict((h, (codec, False)) for h, codec in
+                      self.filter(pk__in=list(blobs)).values_list("file_hash", "codec"))
+        by_count = defaultdict(list)
+        for file_hash in result:
+            by_count[blobs[file_hash][2]].append(file_hash)
+        for count, hashes in by_count.items():
+            self.filter(pk__in=hashes).update(refcount=F("refcount") + count, unreferenced_at=None)
+
+        new = [self.model(file_hash=h, size=size, codec=codec, refcount=count)
+               for h, (size, codec, count) in blobs.items() if h not in result]
+        try:
+            with transaction.atomic(using=self.db):
+                self.bulk_create(new)
+            result.update((blob.file_hash, (blob.codec, True)) for blob in new)
+        except IntegrityError:
+            # some registered concurrently, fall back to one by one
+            for blob in new:
+                result[blob.file_hash] = self.acquire(blob.file_hash, blob.size, blob.codec)
+                if blob.refcount > 1:
+                    self.add_ref(blob.file_hash, blob.refcount - 1)
+        return result
+
+    def release(self, file_hash, count=1):
+        """Drop ``count`` references; the last one starts the blob's grace period."""
+        self.filter(pk=file_hash, refcount__gte=count).update(
+            refcount=F("refcount") - count,
+            unreferenced_at=Case(When(refcount=count, then=Value(timezone.now())), default=None),
+        )
+
+    def adopt(self, file_hash, size, unreferenced_at):
+        """
+        Register a stored file that has no Blob row as unreferenced since
+        ``unreferenced_at``. False if a row exists, e.g. an upload acquired
+        the same content meanwhile.
+        """
+        try:
+            with transaction.atomic(using=self.db):
+                self.create(file_hash=file_hash, size=size, refcount=0, unreferenced_at=unreferenced_at)
+        except IntegrityError:
+            return False
+        return True
+
+    def delete_unreferenced(self, file_hash, cutoff):
+        """
+        Delete the blob's file and row if it has been unreferenced since
+        ``cutoff`` or earlier. The row stays locked until the file is gone,
+        so a concurrent acquire() either wins or waits and re-registers it.
+        """
+        with transaction.atomic(using=self.db):
+            blob = (self.select_for_update()
+                .filter(pk=file_hash, refcount=0, unreferenced_at__lte=cutoff)
+                .first())
+            if blob is None:
+                return False
+            chunks = Counter(blob.manifest.values_list("chunk_id", flat=True))
+            default_storage.delete(blob.cas_path)
+            search.forget(file_hash)
+            blob.delete()
+            if blob.delta_base_id:
+                self.release(blob.delta_base_id)
+            for chunk_hash, count in chunks.items():
+                self.release(chunk_hash, count)
+        return True
+
+
+class Pack(models.Model):
+    """A file under packs/ holding the stored bytes of many small blobs."""
+    name = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
+
+class Blob(models.Model):
+    """
+    A stored CAS object and the number of FileVersions pointing at it.
+
+    Blobs are never deleted in a request: once ``refcount`` drops to zero
+    ``unreferenced_at`` is set and the sweep_blobs command removes the file
+    after BLOB_GC_GRACE_PERIOD unless it was referenced again meanwhile.
+    """
+    file_hash = models.CharField(max_length=64, primary_key=True)
+    size = models.BigIntegerField()
+    refcount = models.PositiveIntegerField(default=0)
+    unreferenced_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # last time scrub_blobs re-hashed the file and found it intact
+    verified_at = models.DateTimeField(null=True, blank=True)
+    # how the bytes at cas_path are encoded; file_hash and size are of the decoded content
+    codec = models.CharField(
+        max_length=8, blank=True, default="",
+        choices=compression.CODEC_CHOICES + [("delta", "delta"), ("chunked", "chunked")],
+    )
+    # "delta" blobs: the blob the delta applies to, and deltas down to a full blob
+    delta_base = models.ForeignKey(
+        "self", null=True, blank=True, editable=False, on_delete=models.PROTECT, related_name="deltas",
+    )
+    chain_length = models.PositiveSmallIntegerField(default=0, editable=False)
+    # packed blobs: where their stored bytes are, instead of cas_path
+    pack = models.ForeignKey(
+        Pack, null=True, blank=True, editable=False, on_delete=models.PROTECT, related_name="blobs",
+    )
+    pack_offset = models.BigIntegerField(null=True, blank=True, editable=False)
+    pack_length = models.BigIntegerField(null=True, blank=True, editable=False)
+    # when the search indexer looked at the content (text or not); null: pending
+    indexed_at = models.DateTimeField(null=True, blank=True, editable=False, db_index=True)
+
+    objects = BlobManager()
+
+    def __str__(self):
+        return f"{self.file_hash} ({self.refcount} refs)"
+
+    @property
+    def cas_path(self) -> str:
+        return _cas_path(self.file_hash)
+
+
+class BlobChunk(models.Model):
+    """Entry ``index`` of the manifest of a "chunked" blob."""
+    blob = models.ForeignKey(Blob, on_delete=models.CASCADE, related_name="manifest")
+    index = models.PositiveIntegerField()
+    chunk = models.ForeignKey(Blob, on_delete=models.PROTECT, related_name="+")
+    # position of the chunk in the whole content
+    offset = models.BigIntegerField()
+
+    class Meta:
+        unique_together = ("blob", "index")
+
+
+class BlobText(models.Model):
+    """A blob whose content is UTF-8 text; its id keys the row in the search index."""
+    blob = models.OneToOneField(Blob, on_delete=models.CASCADE, related_name="text")
+
+
+class UploadSession(models.Model):
+    """A resumable upload of one version of a document, staged until committed."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name="upload_sessions")
+    file_name = models.CharField(max_length=512)
+    size = models.BigIntegerField()
+    # sorted, disjoint [start, end) byte ranges written so far
+    received = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.file_name} upload by {self.owner.username}"
+
+    @property
+    def complete(self):
+        return uploads.contiguous_end(self.received) >= self.size
+
+
 class FileVersion(models.Model):
     base_file = models.ForeignKey(BaseFile, on_delete=models.CASCADE, related_name="versions")
     file_content = models.FileField(upload_to=user_directory_path)
     version_number = models.fields.IntegerField()
     created_at = models.fields.DateTimeField(auto_now_add=True)
     file_hash = models.CharField(max_length=64, db_index=True, editable=False)
+    file_size = models.BigIntegerField(null=True, editable=False)
     updated_at = models.fields.DateTimeField(auto_now=True)
 
     objects = FileVersionManager()
@@ -141,53 +742,129 @@ class FileVersion(models.Model):
     class Meta:
         unique_together = ('base_file', 'version_number')
         ordering = ['-version_number']
+        indexes = [
+            # covers the version history of one document: seek on
+            # (base_file, version_number) and read the rest from the index
+            models.Index(
+                fields=["base_file", "-version_number", "file_hash", "file_size", "created_at"],
+                name="fileversion_history_idx",
+            ),
+            # point-in-time lookups: newest version per document up to a timestamp
+            models.Index(fields=["base_file", "created_at"], name="fileversion_as_of_idx"),
+        ]
 
     @property
     def cas_path(self) -> str:
         return _cas_path(self.file_hash)
 
-    def _ensure_cas_storage(self):
+    def _ensure_cas_storage(self, codec="", replace=False, encoded=None):
         """
         Ensure the blob is stored exactly once at its CAS path and the FileField points to it.
         If a blob with the same hash already exists, only repoint (no second write).
+        With ``replace`` an existing file is rewritten: a leftover without a
+        Blob row may be stored with a different codec.
         """
-        # Blob already present? Just repoint and mark committed.
-        if default_storage.exists(self.cas_path):
+        if codec == "chunked":
+            # the content lives in the chunk blobs of the manifest
             self.file_content.name = self.cas_path
+            self.file_content._committed = True
             return
-
-        # Save once to CAS
-        f = self.file_content
-        if not f.closed:
-            f.open()
-        f.seek(0)
-        default_storage.save(self.cas_path, File(f))
+        exists = default_storage.exists(self.cas_path)
+        if not exists and not replace and Blob.objects.filter(pk=self.file_hash, pack__isnull=False).exists():
+            # moved into a pack file
+            self.file_content.name = self.cas_path
+            self.file_content._committed = True
+            return
+        if exists and replace:
+            default_storage.delete(self.cas_path)
+        # Blob already present? Just repoint and mark committed.
+        if encoded is not None:
+            _store_blob(self.cas_path, ContentFile(encoded))
+        elif replace or not exists:
+            _store_blob(self.cas_path, self.file_content, codec)
         self.file_content.name = self.cas_path
-    
-    def save(self, *args, **kwargs):
-        if not self.base_file_id:
-            raise ValueError("base_file must be provided when creating a FileVersion.")
+        self.file_content._committed = True
 
+    def hash_content(self):
+        """
+        Fill in file_hash and file_size, reading the content only when the
+        digest is not already known.
+        """
         f = self.file_content
         if not f:
-            raise ValueError("file_content is required.")
+            if not self.file_hash:
+                raise ValueError("file_content is required.")
+            # version of content that is already stored → just point at it
+            size = Blob.objects.filter(pk=self.file_hash).values_list("size", flat=True).first()
+            if size is None:
+                # stored before blobs were registered
+                if not default_storage.exists(self.cas_path):
+                    raise ValueError("No stored blob matches file_hash.")
+                size = default_storage.size(self.cas_path)
+            self.file_content.name = self.cas_path
+            if self.file_size is None:
+                self.file_size = size
+            return
+        if self.file_hash and f._committed and f.name == self.cas_path:
+            # already stored
+            return
+
         if not f.closed:
             f.open()
+        if self.file_size is None:
+            self.file_size = f.size
 
-        # first
-        self.file_hash = _sha256_stream(f)
-        cas_path = _cas_path(self.file_hash)
+        # trust a digest computed while the upload was received
+        if not self.file_hash:
+            self.file_hash = _sha256_stream(f)
 
+    def store_blob(self, codec="", replace=False, encoded=None):
+        """
+        Hash the content (unless the digest is already known) and store it
+        at its CAS path, encoded with ``codec`` (or as the already ``encoded``
+        bytes, for deltas). Does no database work, so FileVersionManager runs
+        it before opening the transaction that creates the row.
+        """
+        self.hash_content()
+        f = self.file_content
+        if f._committed and f.name == self.cas_path:
+            # already stored
+            return
         # ensure one CAS
-        if default_storage.exists(cas_path):
-            # de-dup → just repoint
-            self.file_content.name = cas_path
-        else:
-            # write once to CAS
-            f.seek(0)
-            default_storage.save(cas_path, File(f))
-            self.file_content.name = cas_path
+        self._ensure_cas_storage(codec, replace, encoded)
 
-        self.file_content._committed = True
+    def open_content(self):
+        """
+        Open the stored content for reading, decompressing it if needed.
+        Uses the ``blob_codec`` annotation of FileVersionManager.with_codec()
+        when present; the caller closes the returned file.
+        """
+        codec = getattr(self, "blob_codec", None)
+        if codec is None:
+            codec = Blob.objects.filter(pk=self.file_hash).values_list("codec", flat=True).first() or ""
+        if codec == "delta":
+            return io.BytesIO(deltas.reconstruct(self.file_hash))
+        if codec == "chunked":
+            return chunking.open_chunked(self.file_hash)
+        try:
+            return compression.open_decoded(self.open_stored(), codec)
+        except FileNotFoundError:
+            # split into chunks by chunk_blobs since the codec was looked up
+            if not Blob.objects.filter(pk=self.file_hash, codec="chunked").exists():
+                raise
+            return chunking.open_chunked(self.file_hash)
+
+    def open_stored(self):
+        """Open the blob's bytes as stored (loose or packed, still encoded)."""
+        if not getattr(self, "blob_packed", False):
+            try:
+                return self.file_content.open("rb")
+            except FileNotFoundError:
+                pass  # packed since the row was loaded
+        return packs.open_blob(Blob.objects.select_related("pack").get(pk=self.file_hash))
 
+    def save(self, *args, **kwargs):
+        if not self.base_file_id:
+            raise ValueError("base_file must be provided when creating a FileVersion.")
+        self.store_blob()
         return super().save(*args, **kwargs)
@@ -0,0 +1,160 @@
+"""
+Pack files for small blobs.
+
+Every loose blob is a file of its own at ``cas/xx/yy/<sha256>``, which
+costs an inode and a directory entry per revision. The pack_blobs command
+moves small (and optionally old) blobs into append-only files under
+``packs/``, their stored bytes back to back; the Blob row records the
+pack, offset and length. Fresh and large writes stay loose, and so do the
+parts of chunked blobs.
+
+Packs are read through a memory map. Deltas are decompressed straight
+from it (PackSlice.getbuffer()); other reads copy only the bytes they
+ask for, as downloads must hand bytes to the server anyway. Bytes of
+swept blobs stay in the pack until pack_blobs rewrites packs that are
+mostly dead.
+"""
+import io
+import mmap
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+
+from .compression import COPY_CHUNK_SIZE
+
+PACK_ROOT = "packs"
+# maps kept open per process; an evicted one is unmapped once no slice uses it
+MAX_OPEN_PACKS = 64
+
+
+class PackSlice(io.RawIOBase):
+    """Seekable read-only file over the bytes of one packed blob."""
+
+    def __init__(self, view):
+        self._view = view
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), len(self._view) - self._pos)
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def read(self, size=-1):
+        end = len(self._view) if size is None or size < 0 else min(self._pos + size, len(self._view))
+        data = self._view[self._pos:end].tobytes()
+        self._pos = end
+        return data
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._pos = max(offset, 0)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def getbuffer(self):
+        """The blob's bytes as a memoryview of the pack, without copying."""
+        return self._view
+
+    def close(self):
+        if not self.closed:
+            self._view.release()
+        super().close()
+
+
+class _MapCache:
+    def __init__(self):
+        self._maps = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            m = self._maps.get(name)
+            if m is not None:
+                self._maps.move_to_end(name)
+                return m
+        with open(default_storage.path(name), "rb") as fh:
+            m = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        with self._lock:
+            self._maps[name] = m
+            while len(self._maps) > MAX_OPEN_PACKS:
+                # dropped, not closed: slices still being read keep it mapped
+                self._maps.popitem(last=False)
+        return m
+
+    def clear(self):
+        with self._lock:
+            self._maps.clear()
+
+
+maps = _MapCache()
+
+
+def open_packed(name, offset, length):
+    """Open ``length`` bytes at ``offset`` of pack ``name``."""
+    try:
+        m = maps.get(name)
+    except NotImplementedError:
+        # storage without local paths: no mmap, read the slice
+        with default_storage.open(name, "rb") as fh:
+            fh.seek(offset)
+            return PackSlice(memoryview(fh.read(length)))
+    return PackSlice(memoryview(m)[offset:offset + length])
+
+
+def open_blob(blob):
+    """
+    Open the stored (still encoded) bytes of ``blob``, loose or packed.
+    The row is re-read once if the file moved since it was loaded.
+    """
+    from .models import Blob
+
+    for attempt in range(2):
+        try:
+            if blob.pack_id is None:
+                return default_storage.open(blob.cas_path, "rb")
+            return open_packed(blob.pack.name, blob.pack_offset, blob.pack_length)
+        except FileNotFoundError:
+            if attempt:
+                raise
+            blob = Blob.objects.select_related("pack").get(pk=blob.pk)
+
+
+def write_pack(entries, max_size):
+    """
+    Store ``(file_hash, readable file)`` entries taken from the iterator
+    ``entries`` in a new pack file, until it holds ``max_size`` bytes.
+    Returns its name and the ``(file_hash, offset, length)`` of each entry,
+    or ``(None, [])`` once ``entries`` is exhausted.
+    """
+    index, offset = [], 0
+    with tempfile.TemporaryFile() as tmp:
+        for file_hash, fh in entries:
+            with fh:
+                while data := fh.read(COPY_CHUNK_SIZE):
+                    tmp.write(data)
+            length = tmp.tell() - offset
+            index.append((file_hash, offset, length))
+            offset += length
+            if offset >= max_size:
+                break
+        if not index:
+            return None, []
+        tmp.seek(0)
+        name = default_storage.save(f"{PACK_ROOT}/pack-{uuid.uuid4().hex}.pack", File(tmp))
+    return name, index
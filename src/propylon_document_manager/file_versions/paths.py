@@ -0,0 +1,81 @@
+"""
+Resolution of (owner, logical document path) to a BaseFile.
+
+The GET endpoints only need the BaseFile id and the id of its latest
+FileVersion (BaseFile.latest_version). The pair is kept in Django's
+cache, so resolving a path skips the BaseFile query. Entries are keyed
+by a per-document generation, which FileVersionManager bumps whenever
+either value changes, when a version is created or deleted: a reader
+that queried the database before the change can only cache its result
+under a generation no later reader looks up.
+"""
+import hashlib
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+ResolvedDocument = namedtuple("ResolvedDocument", ["base_file_id", "latest_version_id"])
+
+
+def _cache():
+    return caches[settings.DOCUMENT_PATH_CACHE]
+
+
+def _document_key(owner_id, logical_path):
+    # paths can be long or contain characters memcached keys cannot
+    digest = hashlib.sha1(logical_path.encode("utf-8")).hexdigest()
+    return f"document:{owner_id}:{digest}"
+
+
+def _generation(cache, key):
+    generation = cache.get(key)
+    if generation is None:
+        # after an eviction, start from a value no earlier entry was cached under
+        cache.add(key, time.time_ns(), None)
+        generation = cache.get(key)
+    return generation
+
+
+def _bump(key):
+    try:
+        _cache().incr(key)
+    except ValueError:
+        # no generation yet: nothing is cached under the one add() starts
+        _cache().add(key, time.time_ns(), None)
+
+
+def resolve_document(owner, logical_path):
+    """Return a ResolvedDocument for the owner's path, or None if it does not exist."""
+    cache = _cache()
+    document_key = _document_key(owner.pk, logical_path)
+    # read before the database, so a result that is stale by the time it is
+    # cached lands under a generation invalidate_document has moved past
+    key = f"{document_key}:{_generation(cache, document_key + ':generation')}"
+    cached = cache.get(key)
+    if cached is not None:
+        return ResolvedDocument(*cached)
+
+    from .models import BaseFile
+
+    row = (BaseFile.objects
+        .filter(owner=owner, file_name=logical_path)
+        .values_list("id", "latest_version_id")
+        .first())
+    if row is None:
+        return None
+    cache.set(key, row, settings.DOCUMENT_PATH_CACHE_TIMEOUT)
+    return ResolvedDocument(*row)
+
+
+def invalidate_document(owner_id, logical_path):
+    """
+    Move the document to a new cache generation now, for reads in the
+    current transaction, and again once it commits, for readers that
+    queried the database before then.
+    """
+    key = _document_key(owner_id, logical_path) + ":generation"
+    _bump(key)
+    transaction.on_commit(lambda: _bump(key))
@@ -0,0 +1,196 @@
+"""
+Full-text search over the text revisions of documents.
+
+Text is indexed per blob, so identical contents are indexed once however
+many versions share them. After a version is committed its blob is
+queued for a background thread, which decodes the content as UTF-8 (the
+check diff_file_versions does), records a BlobText row and adds the text
+to the backend's index; Blob.indexed_at marks a blob done, text or not.
+Whatever the thread did not get to (a restart, an error) is picked up by
+the index_blobs command.
+
+The index lives in a table of the database's own full-text engine: an
+FTS5 virtual table on SQLite, a tsvector column with a GIN index on
+PostgreSQL. Its rows are keyed by BlobText.id, and a search joins the
+hits to the caller's versions in the same query.
+"""
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.utils import timezone
+
+TABLE = "file_versions_blobtext_index"
+SNIPPET_START = "**"
+SNIPPET_END = "**"
+SNIPPET_TOKENS = 16
+
+_TERM_RE = re.compile(r"\w+")
+
+
+def extract_text(fh):
+    """The content of ``fh`` as a str, or None when it is not UTF-8 text."""
+    data = fh.read()
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        return None
+
+
+class SQLiteBackend:
+    """FTS5, ranked by bm25."""
+
+    def add(self, cursor, text_id, text):
+        cursor.execute(f"INSERT INTO {TABLE} (rowid, body) VALUES (%s, %s)", [text_id, text])
+
+    def remove(self, cursor, text_ids):
+        for text_id in text_ids:
+            cursor.execute(f"DELETE FROM {TABLE} WHERE rowid = %s", [text_id])
+
+    def query(self, terms):
+        # every term quoted: user input is never read as FTS5 syntax
+        return " ".join('"%s"' % term for term in terms)
+
+    def search(self, cursor, terms, owner_id, latest, limit, offset):
+        cursor.execute(
+            f"""
+            SELECT fv.id, snippet({TABLE}, 0, %s, %s, '...', %s), bm25({TABLE}) AS score
+            FROM {TABLE}
+            JOIN file_versions_blobtext t ON t.id = {TABLE}.rowid
+            JOIN file_versions_fileversion fv ON fv.file_hash = t.blob_id
+            JOIN file_versions_basefile bf ON bf.id = fv.base_file_id
+            WHERE {TABLE} MATCH %s AND bf.owner_id = %s
+              {"AND bf.latest_version_id = fv.id" if latest else ""}
+            ORDER BY score, bf.file_name, fv.version_number DESC
+            LIMIT %s OFFSET %s
+            """,
+            [SNIPPET_START, SNIPPET_END, SNIPPET_TOKENS, self.query(terms), owner_id, limit, offset],
+        )
+        # bm25 is lower for better matches
+        return [(fv_id, snippet, -score) for fv_id, snippet, score in cursor.fetchall()]
+
+
+class PostgresBackend:
+    """A tsvector column with a GIN index, ranked by ts_rank_cd."""
+
+    config = "simple"
+
+    def add(self, cursor, text_id, text):
+        cursor.execute(
+            f"INSERT INTO {TABLE} (id, body, document) VALUES (%s, %s, to_tsvector(%s, %s))",
+            [text_id, text, self.config, text],
+        )
+
+    def remove(self, cursor, text_ids):
+        cursor.execute(f"DELETE FROM {TABLE} WHERE id = ANY(%s)", [list(text_ids)])
+
+    def search(self, cursor, terms, owner_id, latest, limit, offset):
+        # headlines only for the page, not for every match
+        cursor.execute(
+            f"""
+            SELECT hit.fv_id, ts_headline(%s, i.body, hit.q, %s), hit.score
+            FROM (
+                SELECT fv.id AS fv_id, bf.file_name, fv.version_number, t.id,
+                       q, ts_rank_cd(i.document, q) AS score
+                FROM {TABLE} i
+                CROSS JOIN plainto_tsquery(%s, %s) q
+                JOIN file_versions_blobtext t ON t.id = i.id
+                JOIN file_versions_fileversion fv ON fv.file_hash = t.blob_id
+                JOIN file_versions_basefile bf ON bf.id = fv.base_file_id
+                WHERE i.document @@ q AND bf.owner_id = %s
+                  {"AND bf.latest_version_id = fv.id" if latest else ""}
+                ORDER BY score DESC, bf.file_name, fv.version_number DESC
+                LIMIT %s OFFSET %s
+            ) hit
+            JOIN {TABLE} i ON i.id = hit.id
+            ORDER BY hit.score DESC, hit.file_name, hit.version_number DESC
+            """,
+            [
+                self.config, f"StartSel={SNIPPET_START}, StopSel={SNIPPET_END}, MaxWords={SNIPPET_TOKENS}",
+                self.config, " ".join(terms), owner_id, limit, offset,
+            ],
+        )
+        return cursor.fetchall()
+
+
+BACKENDS = {"sqlite": SQLiteBackend(), "postgresql": PostgresBackend()}
+
+
+def backend(using="default"):
+    """The search backend of a database, or None when its vendor has none."""
+    return BACKENDS.get(connections[using].vendor)
+
+
+def index_blob(file_hash):
+    """
+    Index the content of blob ``file_hash`` unless it already is. Returns
+    True if text was added; False for non-text content, a blob no version
+    uses (a chunk) or one that was indexed meanwhile.
+    """
+    from .models import Blob, BlobText, FileVersion
+
+    engine = backend()
+    fv = FileVersion.objects.with_codec().filter(file_hash=file_hash).first()
+    if engine is None or fv is None:
+        return False
+    text = None
+    if fv.file_size is not None and fv.file_size <= settings.SEARCH_MAX_TEXT_SIZE:
+        with fv.open_content() as fh:
+            text = extract_text(fh)
+    with transaction.atomic():
+        claimed = Blob.objects.filter(pk=file_hash, indexed_at__isnull=True).update(indexed_at=timezone.now())
+        if not claimed or text is None:
+            return False
+        text_id = BlobText.objects.create(blob_id=file_hash).pk
+        with connection.cursor() as cursor:
+            engine.add(cursor, text_id, text)
+    return True
+
+
+def forget(file_hash):
+    """Drop the indexed text of a blob that is being deleted."""
+    from .models import BlobText
+
+    engine = backend()
+    text_ids = list(BlobText.objects.filter(blob_id=file_hash).values_list("pk", flat=True))
+    if engine is not None and text_ids:
+        with connection.cursor() as cursor:
+            engine.remove(cursor, text_ids)
+
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search-index")
+
+
+def _index_in_background(hashes):
+    try:
+        for file_hash in hashes:
+            index_blob(file_hash)
+    finally:
+        # failures are left to the index_blobs command
+        connections.close_all()
+
+
+def schedule(hashes):
+    """Index the blobs of newly committed versions in the background, after the commit."""
+    if settings.SEARCH_INDEX_ON_UPLOAD:
+        hashes = list(hashes)
+        transaction.on_commit(lambda: _executor.submit(_index_in_background, hashes))
+
+
+def search(owner, text, latest=True, limit=20, offset=0):
+    """
+    Ranked ``(FileVersion, snippet, score)`` hits among the owner's
+    versions whose text contains every word of ``text``; only the latest
+    version of each document unless ``latest`` is false.
+    """
+    from .models import FileVersion
+
+    engine = backend()
+    terms = _TERM_RE.findall(text)
+    if engine is None or not terms:
+        return []
+    with connection.cursor() as cursor:
+        hits = engine.search(cursor, terms, owner.pk, latest, limit, offset)
+    versions = FileVersion.objects.select_related("base_file").in_bulk([fv_id for fv_id, _, _ in hits])
+    return [(versions[fv_id], snippet, score) for fv_id, snippet, score in hits if fv_id in versions]
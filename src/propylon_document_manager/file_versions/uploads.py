@@ -0,0 +1,92 @@
+"""
+Resumable upload sessions.
+
+A session stages the content of one version in UPLOAD_SESSION_DIR (under
+MEDIA_ROOT by default, so committing can rename the file into the CAS
+tree). Chunks are written at their offset, so clients may send them in
+parallel and in any order and resend whatever a dropped connection lost;
+the byte ranges received so far are kept on the UploadSession row.
+
+The SHA-256 is computed from the staging file on commit. Chunks of one
+session reach any worker in any order, so no process could keep a
+running hash without holding state for sessions it may never see again.
+"""
+import hashlib
+import os
+
+from django.conf import settings
+from django.core.files import File
+
+READ_SIZE = 1024 * 1024
+
+
+class StagedFile(File):
+    """A committed staging file; FileSystemStorage moves it instead of copying."""
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def staging_dir():
+    return settings.UPLOAD_SESSION_DIR or os.path.join(settings.MEDIA_ROOT, "uploads")
+
+
+def staging_path(session_id):
+    return os.path.join(staging_dir(), str(session_id))
+
+
+def create_staging(session):
+    """Create the (sparse) staging file of a new session."""
+    os.makedirs(staging_dir(), exist_ok=True)
+    with open(staging_path(session.pk), "wb") as fh:
+        fh.truncate(session.size)
+
+
+def write_chunk(session, offset, stream, length):
+    """Write up to ``length`` bytes read from ``stream`` at ``offset``; returns the count written."""
+    fd = os.open(staging_path(session.pk), os.O_WRONLY)
+    written = 0
+    try:
+        while written < length:
+            data = stream.read(min(READ_SIZE, length - written))
+            if not data:
+                # client went away; keep what arrived
+                break
+            os.pwrite(fd, data, offset + written)
+            written += len(data)
+    finally:
+        os.close(fd)
+    return written
+
+
+def add_range(ranges, start, end):
+    """``ranges`` (sorted, disjoint ``[start, end)`` pairs) with ``[start, end)`` merged in."""
+    merged = []
+    for s, e in sorted([*ranges, [start, end]]):
+        if merged and s <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], e)
+        else:
+            merged.append([s, e])
+    return merged
+
+
+def contiguous_end(ranges):
+    """Length of the prefix received without gaps."""
+    return ranges[0][1] if ranges and ranges[0][0] == 0 else 0
+
+
+def finish_hash(session):
+    """SHA-256 of the complete staging file."""
+    sha256 = hashlib.sha256()
+    with open(staging_path(session.pk), "rb") as fh:
+        while data := fh.read(READ_SIZE):
+            sha256.update(data)
+    return sha256.hexdigest()
+
+
+def discard(session_id):
+    """Remove the staging file, if still there."""
+    try:
+        os.remove(staging_path(session_id))
+    except FileNotFoundError:
+        pass
@@ -19,12 +19,33 @@ documents_view = FileVersionViewSet.as_view({
     "delete": "delete_document_version"})
 
 documents_mine_view = FileVersionViewSet.as_view({"get": "list_available_files"})
+documents_export_view = FileVersionViewSet.as_view({"get": "export_documents"})
+documents_search_view = FileVersionViewSet.as_view({"get": "search_documents"})
 documents_diff_view = FileVersionViewSet.as_view({"get": "diff_file_versions"})
+documents_history_view = FileVersionViewSet.as_view({"get": "list_document_history"})
+blobs_view = FileVersionViewSet.as_view({"head": "blob_exists"})
+blobs_missing_view = FileVersionViewSet.as_view({"post": "missing_chunks"})
+batch_view = FileVersionViewSet.as_view({"post": "create_documents_batch"})
+uploads_create_view = FileVersionViewSet.as_view({"post": "create_upload_session"})
+uploads_view = FileVersionViewSet.as_view({
+    "get": "upload_session_status",
+    "put": "upload_chunk",
+    "delete": "abort_upload_session"})
+uploads_commit_view = FileVersionViewSet.as_view({"post": "commit_upload_session"})
 
 app_name = "file_versions"
 
 urlpatterns = [
     path("documents/mine", documents_mine_view, name="documents-mine"),
+    path("documents/export", documents_export_view, name="documents-export"),
+    path("documents/search", documents_search_view, name="documents-search"),
+    path("blobs/missing", blobs_missing_view, name="blobs-missing"),
+    re_path(r"^blobs/(?P<sha256>[0-9a-fA-F]{64})$", blobs_view, name="blobs"),
+    path("batch/documents", batch_view, name="documents-batch"),
+    path("uploads", uploads_create_view, name="uploads-create"),
+    path("uploads/<uuid:session_id>", uploads_view, name="uploads"),
+    path("uploads/<uuid:session_id>/commit", uploads_commit_view, name="uploads-commit"),
     re_path(r"^documents/diff/(?P<path>.+)$", documents_diff_view, name="documents-diff"),
+    re_path(r"^documents/history/(?P<path>.+)$", documents_history_view, name="documents-history"),
     re_path(r"^documents/(?P<path>.+)$", documents_view, name="documents"),
 ]
@@ -160,6 +160,13 @@ STATICFILES_FINDERS = [
 MEDIA_ROOT = str(APPS_DIR / "media")
 # https://docs.djangoproject.com/en/dev/ref/settings/#media-url
 MEDIA_URL = "/media/"
+# https://docs.djangoproject.com/en/dev/ref/settings/#file-upload-handlers
+# Same memory/temp-file split as Django's defaults, but the SHA-256 used for
+# the CAS path is computed while the upload is received.
+FILE_UPLOAD_HANDLERS = [
+    "propylon_document_manager.file_versions.upload_handlers.HashingMemoryFileUploadHandler",
+    "propylon_document_manager.file_versions.upload_handlers.HashingTemporaryFileUploadHandler",
+]
 
 # TEMPLATES
 # ------------------------------------------------------------------------------
@@ -283,3 +290,91 @@ CORS_ALLOW_ALL_ORIGINS = True
 
 # Your stuff...
 # ------------------------------------------------------------------------------
+
+# Document delivery
+# ------------------------------------------------------------------------------
+# How retrieve_document hands blob bytes to the client once auth, revision
+# resolution and conditional checks are done:
+#   "python"            stream from the Django worker (local development)
+#   "x-accel-redirect"  nginx; DOCUMENT_DELIVERY_INTERNAL_URL must be an
+#                       `internal` location aliased to MEDIA_ROOT
+#   "x-sendfile"        Apache mod_xsendfile / lighttpd; the header carries
+#                       the absolute path under MEDIA_ROOT
+DOCUMENT_DELIVERY = env("DJANGO_DOCUMENT_DELIVERY", default="python")
+DOCUMENT_DELIVERY_INTERNAL_URL = env("DJANGO_DOCUMENT_DELIVERY_INTERNAL_URL", default="/protected-media/")
+
+# Revision diffs
+# ------------------------------------------------------------------------------
+# Cache alias holding computed diff opcodes keyed by the (from, to) blob
+# hashes; eviction is left to the backend (LocMemCache and Redis are LRU).
+DOCUMENT_DIFF_CACHE = env("DJANGO_DOCUMENT_DIFF_CACHE", default="default")
+DOCUMENT_DIFF_CACHE_TIMEOUT = env.int("DJANGO_DOCUMENT_DIFF_CACHE_TIMEOUT", default=24 * 60 * 60)
+
+# Document path resolution
+# ------------------------------------------------------------------------------
+# Cache alias for (owner, path) → (BaseFile id, latest FileVersion id)
+# lookups on the GET endpoints; entries are invalidated on create/delete.
+DOCUMENT_PATH_CACHE = env("DJANGO_DOCUMENT_PATH_CACHE", default="default")
+DOCUMENT_PATH_CACHE_TIMEOUT = env.int("DJANGO_DOCUMENT_PATH_CACHE_TIMEOUT", default=60 * 60)
+
+# Blob garbage collection
+# ------------------------------------------------------------------------------
+# Seconds a CAS blob must stay unreferenced before `manage.py sweep_blobs`
+# deletes it; an upload of the same content within that window reuses it.
+BLOB_GC_GRACE_PERIOD = env.int("DJANGO_BLOB_GC_GRACE_PERIOD", default=24 * 60 * 60)
+
+# Blob compression
+# ------------------------------------------------------------------------------
+# Codec for newly stored CAS blobs: "" (store raw), "gzip" or "xz". Content
+# smaller than BLOB_COMPRESSION_MIN_SIZE, in a known compressed format or
+# with a high-entropy head is always stored raw. gzip blobs are sent as
+# stored to clients that accept gzip.
+BLOB_COMPRESSION = env("DJANGO_BLOB_COMPRESSION", default="")
+BLOB_COMPRESSION_MIN_SIZE = env.int("DJANGO_BLOB_COMPRESSION_MIN_SIZE", default=1024)
+
+# Delta storage
+# ------------------------------------------------------------------------------
+# Store new versions up to BLOB_DELTA_MAX_SIZE bytes as deltas against the
+# document's latest blob; every BLOB_DELTA_MAX_CHAIN-th blob in a chain is
+# stored in full. Reconstructed contents are kept in a per-process LRU of
+# BLOB_DELTA_CACHE_SIZE bytes.
+BLOB_DELTA = env.bool("DJANGO_BLOB_DELTA", default=False)
+BLOB_DELTA_MAX_CHAIN = env.int("DJANGO_BLOB_DELTA_MAX_CHAIN", default=16)
+BLOB_DELTA_MAX_SIZE = env.int("DJANGO_BLOB_DELTA_MAX_SIZE", default=8 * 1024 * 1024)
+BLOB_DELTA_CACHE_SIZE = env.int("DJANGO_BLOB_DELTA_CACHE_SIZE", default=64 * 1024 * 1024)
+
+# Content-defined chunking
+# ------------------------------------------------------------------------------
+# `manage.py chunk_blobs` splits stored content of at least
+# BLOB_CHUNKING_MIN_SIZE bytes into chunks of about BLOB_CHUNK_AVG_SIZE bytes
+# (a quarter to four times that) at content defined boundaries, stored as
+# blobs of their own, so that large revisions share their unchanged chunks.
+BLOB_CHUNKING = env.bool("DJANGO_BLOB_CHUNKING", default=False)
+BLOB_CHUNKING_MIN_SIZE = env.int("DJANGO_BLOB_CHUNKING_MIN_SIZE", default=8 * 1024 * 1024)
+BLOB_CHUNK_AVG_SIZE = env.int("DJANGO_BLOB_CHUNK_AVG_SIZE", default=1024 * 1024)
+
+# Upload sessions
+# ------------------------------------------------------------------------------
+# Directory for the staging files of resumable uploads (default: "uploads"
+# under MEDIA_ROOT; keep it on the same filesystem so a commit is a rename).
+# `manage.py expire_upload_sessions` drops sessions older than
+# UPLOAD_SESSION_MAX_AGE seconds. A session may declare at most
+# UPLOAD_SESSION_MAX_SIZE bytes.
+UPLOAD_SESSION_DIR = env("DJANGO_UPLOAD_SESSION_DIR", default="")
+UPLOAD_SESSION_MAX_AGE = env.int("DJANGO_UPLOAD_SESSION_MAX_AGE", default=7 * 24 * 60 * 60)
+UPLOAD_SESSION_MAX_SIZE = env.int("DJANGO_UPLOAD_SESSION_MAX_SIZE", default=5 * 1024 * 1024 * 1024)
+
+# Batch ingestion
+# ------------------------------------------------------------------------------
+# POST /api/batch/documents: most documents accepted per request, and
+# threads hashing and storing their contents.
+BATCH_UPLOAD_MAX_ENTRIES = env.int("DJANGO_BATCH_UPLOAD_MAX_ENTRIES", default=10000)
+BATCH_UPLOAD_WORKERS = env.int("DJANGO_BATCH_UPLOAD_WORKERS", default=4)
+
+# Search
+# ------------------------------------------------------------------------------
+# Text blobs are indexed for GET /api/documents/search by a background
+# thread after each upload (`manage.py index_blobs` catches up on the rest).
+# Contents larger than SEARCH_MAX_TEXT_SIZE bytes are not indexed.
+SEARCH_INDEX_ON_UPLOAD = env.bool("DJANGO_SEARCH_INDEX_ON_UPLOAD", default=True)
+SEARCH_MAX_TEXT_SIZE = env.int("DJANGO_SEARCH_MAX_TEXT_SIZE", default=10 * 1024 * 1024)
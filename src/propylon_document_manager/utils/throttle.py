@@ -0,0 +1,25 @@
+import threading
+import time
+
+
+class Throttle:
+    """
+    Spread work to at most ``rate`` units per second across all threads
+    sharing the instance. A rate of 0 (or None) disables throttling.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def wait(self, cost=1):
+        """Block until ``cost`` more units may be spent."""
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(self._next, now)
+            self._next = start + cost * self.interval
+        if start > now:
+            time.sleep(start - now)
@@ -1,5 +1,7 @@
 import pytest
+from django.core.cache import cache
 
+from propylon_document_manager.file_versions import deltas
 from propylon_document_manager.file_versions.models import User
 from .factories import UserFactory
 
@@ -12,6 +14,13 @@ def media_storage(settings, tmpdir):
     settings.MEDIA_ROOT = tmpdir.strpath
 
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # ids are reused across tests, cached path resolutions must not leak
+    cache.clear()
+    deltas.reconstructed.clear()
+
+
 @pytest.fixture
 def user(db) -> User:
     return UserFactory()
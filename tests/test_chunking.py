@@ -0,0 +1,36 @@
+import io
+import random
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from propylon_document_manager.file_versions import chunking
+
+AVG = 1024
+
+
+def _content(n, seed=0):
+    return random.Random(seed).randbytes(n)
+
+
+class ChunkerTests(SimpleTestCase):
+
+    def test_chunks_are_bounded_and_cover_the_content(self):
+        data = _content(64 * AVG)
+        chunks = list(chunking.iter_chunks(io.BytesIO(data), AVG))
+        self.assertEqual(b"".join(chunks), data)
+        self.assertTrue(all(AVG // 4 < len(c) <= AVG * 4 for c in chunks[:-1]))
+        self.assertLess(len(chunks), 64 * 2)
+
+    def test_edit_only_changes_nearby_chunks(self):
+        data = _content(64 * AVG)
+        edited = data[:30 * AVG] + b"inserted text" + data[30 * AVG:]
+        before = set(chunking.iter_chunks(io.BytesIO(data), AVG))
+        after = list(chunking.iter_chunks(io.BytesIO(edited), AVG))
+        self.assertLessEqual(sum(c not in before for c in after), 2)
+
+    def test_boundaries_do_not_depend_on_read_size(self):
+        data = _content(64 * AVG)
+        whole = list(chunking.iter_chunks(io.BytesIO(data), AVG))
+        with mock.patch.object(chunking, "READ_SIZE", 1000):
+            self.assertEqual(list(chunking.iter_chunks(io.BytesIO(data), AVG)), whole)
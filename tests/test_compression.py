@@ -0,0 +1,34 @@
+import gzip
+import io
+import os
+
+from django.test import TestCase, override_settings
+
+from propylon_document_manager.file_versions import compression
+
+XML = b"".join(b"<section id='%d'><p>The Minister may by order amend this Act.</p></section>\n" % i
+               for i in range(200))
+
+
+@override_settings(BLOB_COMPRESSION="gzip", BLOB_COMPRESSION_MIN_SIZE=1024)
+class ChooseCodecTests(TestCase):
+
+    def test_text_is_compressed(self):
+        self.assertEqual(compression.choose_codec(io.BytesIO(XML)), "gzip")
+
+    def test_small_compressed_and_random_content_is_stored_raw(self):
+        self.assertEqual(compression.choose_codec(io.BytesIO(b"tiny")), "")
+        self.assertEqual(compression.choose_codec(io.BytesIO(gzip.compress(XML * 50))), "")
+        self.assertEqual(compression.choose_codec(io.BytesIO(b"%PDF-1.7\n" + XML)), "")
+        self.assertEqual(compression.choose_codec(io.BytesIO(os.urandom(8192))), "")
+
+    @override_settings(BLOB_COMPRESSION="")
+    def test_disabled(self):
+        self.assertEqual(compression.choose_codec(io.BytesIO(XML)), "")
+
+    def test_round_trip(self):
+        for codec in ("gzip", "xz"):
+            encoded = compression.encode(io.BytesIO(XML), codec)
+            with compression.open_decoded(encoded, codec) as reader:
+                self.assertEqual(reader.read(), XML)
+            self.assertTrue(encoded.closed)
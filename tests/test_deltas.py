@@ -0,0 +1,32 @@
+import os
+
+from django.test import SimpleTestCase
+
+from propylon_document_manager.file_versions import deltas
+
+BILL = b"".join(b"Section %d. The Minister shall lay a report before each House.\n" % i for i in range(500))
+
+
+class DeltaCodecTests(SimpleTestCase):
+
+    def test_round_trip(self):
+        target = BILL.replace(b"Section 250.", b"Section 250 (as amended).") + b"Schedule 1.\n"
+        delta = deltas.make_delta(BILL, target)
+        self.assertLess(len(delta), len(target) // 50)
+        self.assertEqual(deltas.apply_delta(BILL, delta), target)
+
+    def test_round_trip_without_trailing_newline_and_binary(self):
+        for base, target in [(b"a\nb\nc", b"a\nB\nc"), (b"", b"new"), (b"old", b""),
+                             (os.urandom(2000), os.urandom(2000))]:
+            self.assertEqual(deltas.apply_delta(base, deltas.make_delta(base, target)), target)
+
+    def test_lru_is_bounded_by_bytes(self):
+        lru = deltas._ByteLRU()
+        lru.put("a", b"x" * 40, limit=100)
+        lru.put("b", b"y" * 40, limit=100)
+        lru.get("a")
+        lru.put("c", b"z" * 40, limit=100)
+        self.assertIsNone(lru.get("b"))
+        self.assertEqual(lru.get("a"), b"x" * 40)
+        lru.put("big", b"w" * 101, limit=100)
+        self.assertIsNone(lru.get("big"))
@@ -0,0 +1,53 @@
+import random
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from propylon_document_manager.file_versions import diffs
+
+
+def apply_opcodes(a, b, opcodes):
+    out = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == "equal":
+            assert a[i1:i2] == b[j1:j2]
+            out.extend(a[i1:i2])
+        else:
+            out.extend(b[j1:j2])
+    return out
+
+
+class PatienceDiffTests(TestCase):
+
+    def test_opcodes_rebuild_target(self):
+        rnd = random.Random(7)
+        for _ in range(200):
+            a = [rnd.choice("abcdefg") for _ in range(rnd.randint(0, 40))]
+            b = [rnd.choice("abcdefg") for _ in range(rnd.randint(0, 40))]
+            self.assertEqual(apply_opcodes(a, b, diffs.diff_opcodes(a, b)), b)
+
+    def test_unique_lines_anchor_moved_blocks(self):
+        a = ["header", "}", "def a():", "    pass", "}", "footer"]
+        b = ["header", "}", "def b():", "    pass", "}", "def a():", "    pass", "}", "footer"]
+        opcodes = diffs.diff_opcodes(a, b)
+        self.assertEqual(apply_opcodes(a, b, opcodes), b)
+        inserted = [b[j1:j2] for tag, _, _, j1, j2 in opcodes if tag == "insert"]
+        self.assertEqual(inserted, [["def b():", "    pass", "}"]])
+
+    def test_context_groups_only_changed_regions(self):
+        a = [f"line {i}" for i in range(100)]
+        b = list(a)
+        b[10] = "changed"
+        b[80] = "changed too"
+        groups = diffs.group_opcodes(diffs.diff_opcodes(a, b), context=2)
+        self.assertEqual(len(groups), 2)
+        self.assertEqual(groups[0][0][1], 8)
+        self.assertEqual(diffs.group_opcodes([], context=2), [])
+
+    def test_opcodes_cached_by_ordered_hash_pair(self):
+        cache.clear()
+        a, b = ["x"], ["x", "z"]
+        first = diffs.cached_diff_opcodes("ha", "hb", a, b)
+        # cache hit: the lines are not looked at again
+        self.assertEqual(diffs.cached_diff_opcodes("ha", "hb", [], []), first)
+        self.assertNotEqual(diffs.cached_diff_opcodes("hb", "ha", b, a), first)
@@ -1,8 +1,22 @@
-from django.test import TestCase
+import hashlib
+import json
+import os
+import random
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib import admin
+from django.db import IntegrityError, connection
+from django.test import RequestFactory, TestCase
 from django.contrib.auth import get_user_model
-from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
-from propylon_document_manager.file_versions.models import BaseFile, FileVersion
+from django.core.management import CommandError, call_command
+from django.utils import timezone
+from propylon_document_manager.file_versions import deltas, models, packs, uploads
+from propylon_document_manager.file_versions.models import BaseFile, Blob, FileVersion, Pack, UploadSession
 
 
 class FileVersionModelTests(TestCase):
@@ -87,3 +101,413 @@ class FileVersionModelTests(TestCase):
                                         file_content=SimpleUploadedFile("f2.txt", b"2"))
         self.assertNotEqual(v0.base_file_id, v1.base_file_id)
         self.assertEqual(BaseFile.objects.filter(owner=u).count(), 2)
+
+    def test_provided_hash_skips_rehashing(self):
+        u = get_user_model().objects.create_user("u6", "u6@example.com", "p")
+        data = b"hashed while uploading"
+        digest = hashlib.sha256(data).hexdigest()
+        with mock.patch("propylon_document_manager.file_versions.models._sha256_stream") as sha:
+            fv = FileVersion.objects.create(file_name="h.txt", owner=u, file_hash=digest,
+                                            file_content=SimpleUploadedFile("h.txt", data))
+        sha.assert_not_called()
+        self.assertEqual(fv.file_hash, digest)
+        self.assertTrue(default_storage.exists(fv.cas_path))
+
+    def test_spooled_upload_is_moved_into_cas(self):
+        u = get_user_model().objects.create_user("u7", "u7@example.com", "p")
+        data = b"spooled to disk"
+        upload = TemporaryUploadedFile("big.txt", "text/plain", len(data), None)
+        upload.write(data)
+        upload.seek(0)
+        temp_path = upload.temporary_file_path()
+
+        fv = FileVersion.objects.create(file_name="big.txt", owner=u, file_content=upload)
+
+        self.assertFalse(os.path.exists(temp_path))
+        with default_storage.open(fv.cas_path, "rb") as fh:
+            self.assertEqual(fh.read(), data)
+        upload.close()
+
+    def test_blob_is_stored_outside_the_version_transaction(self):
+        u = get_user_model().objects.create_user("u8", "u8@example.com", "p")
+        outer_blocks = len(connection.atomic_blocks)
+        seen = []
+        real_store = models._store_blob
+
+        def store(*args):
+            seen.append(len(connection.atomic_blocks))
+            return real_store(*args)
+
+        with mock.patch.object(models, "_store_blob", side_effect=store):
+            FileVersion.objects.create(file_name="tx.txt", owner=u,
+                                       file_content=SimpleUploadedFile("tx.txt", b"outside"))
+        self.assertEqual(seen, [outer_blocks])
+
+    def test_version_claim_without_returning_support(self):
+        u = get_user_model().objects.create_user("u9", "u9@example.com", "p")
+        # e.g. MariaDB, which has INSERT ... RETURNING but not UPDATE ... RETURNING
+        with mock.patch.object(connection, "vendor", "mysql"):
+            v0 = FileVersion.objects.create(file_name="r.txt", owner=u,
+                                            file_content=SimpleUploadedFile("r0.txt", b"0"))
+            v1 = FileVersion.objects.create(file_name="r.txt", owner=u,
+                                            file_content=SimpleUploadedFile("r1.txt", b"1"))
+        self.assertEqual((v0.version_number, v1.version_number), (0, 1))
+        self.assertEqual(BaseFile.objects.get(pk=v1.base_file_id).latest_version_number, 2)
+
+    def test_as_of_seeks_once_per_document(self):
+        u = get_user_model().objects.create_user("u24", "u24@example.com", "p")
+        start = timezone.now() - timedelta(days=10)
+        for name, days in (("a.txt", 0), ("a.txt", 2), ("a.txt", 4), ("b.txt", 3), ("c.txt", 6)):
+            fv = FileVersion.objects.create(file_name=name, owner=u,
+                                            file_content=SimpleUploadedFile(name, f"{name} {days}".encode()))
+            FileVersion.objects.filter(pk=fv.pk).update(created_at=start + timedelta(days=days))
+        qs = FileVersion.objects.filter(base_file__owner=u).as_of(start + timedelta(days=3))
+        self.assertEqual(sorted((fv.base_file.file_name, fv.version_number) for fv in qs),
+                         [("a.txt", 1), ("b.txt", 0)])
+
+        if connection.vendor == "sqlite":
+            plan = qs.explain()
+            # a single subquery, correlated to the BaseFile rows
+            self.assertEqual(plan.count("CORRELATED SCALAR SUBQUERY"), 1)
+            self.assertEqual(plan.count("USING INDEX fileversion_as_of_idx"), 1)
+
+    def test_file_name_is_unique_per_owner(self):
+        u = get_user_model().objects.create_user("u10", "u10@example.com", "p")
+        BaseFile.objects.create(owner=u, file_name="/documents/once.txt")
+        with self.assertRaises(IntegrityError):
+            BaseFile.objects.create(owner=u, file_name="/documents/once.txt")
+
+    def test_latest_pointer_follows_create_and_delete(self):
+        u = get_user_model().objects.create_user("u11", "u11@example.com", "p")
+        v0, v1, v2 = (
+            FileVersion.objects.create(file_name="p.txt", owner=u,
+                                       file_content=SimpleUploadedFile("p.txt", body))
+            for body in (b"zero", b"one", b"two!")
+        )
+        bf = BaseFile.objects.get(pk=v0.base_file_id)
+        self.assertEqual((bf.latest_version_id, bf.latest_file_hash, bf.latest_file_size),
+                         (v2.pk, v2.file_hash, 4))
+
+        FileVersion.objects.delete_version(v0)  # older version: pointer untouched
+        bf.refresh_from_db()
+        self.assertEqual((bf.latest_version_id, bf.latest_version_number), (v2.pk, 3))
+
+        FileVersion.objects.delete_version(v2)
+        bf.refresh_from_db()
+        self.assertEqual((bf.latest_version_id, bf.latest_file_hash, bf.latest_version_number),
+                         (v1.pk, v1.file_hash, 2))
+
+        FileVersion.objects.delete_version(v1)
+        self.assertFalse(BaseFile.objects.filter(pk=bf.pk).exists())
+
+    def test_blob_refcount_and_sweep(self):
+        u = get_user_model().objects.create_user("u12", "u12@example.com", "p")
+        a = FileVersion.objects.create(file_name="a.txt", owner=u,
+                                       file_content=SimpleUploadedFile("a.txt", b"shared"))
+        b = FileVersion.objects.create(file_name="b.txt", owner=u,
+                                       file_content=SimpleUploadedFile("b.txt", b"shared"))
+        blob = Blob.objects.get(pk=a.file_hash)
+        self.assertEqual((blob.refcount, blob.size), (2, 6))
+
+        FileVersion.objects.delete_version(a)
+        FileVersion.objects.delete_version(b)
+        blob.refresh_from_db()
+        self.assertEqual(blob.refcount, 0)
+        self.assertIsNotNone(blob.unreferenced_at)
+        # deletes never touch storage
+        self.assertTrue(default_storage.exists(blob.cas_path))
+
+        call_command("sweep_blobs", stdout=StringIO())  # still within the grace period
+        self.assertTrue(default_storage.exists(blob.cas_path))
+
+        Blob.objects.filter(pk=blob.pk).update(unreferenced_at=timezone.now() - timedelta(days=2))
+        call_command("sweep_blobs", stdout=StringIO())
+        self.assertFalse(default_storage.exists(blob.cas_path))
+        self.assertFalse(Blob.objects.filter(pk=blob.pk).exists())
+
+    def test_admin_deletes_release_blob_references(self):
+        u = get_user_model().objects.create_user("u14", "u14@example.com", "p")
+        blob_hash = hashlib.sha256(b"shared").hexdigest()
+        for name in ("a.txt", "a.txt", "b.txt"):
+            FileVersion.objects.create(file_name=name, owner=u, file_content=SimpleUploadedFile(name, b"shared"))
+        self.assertEqual(Blob.objects.get(pk=blob_hash).refcount, 3)
+        request = RequestFactory().get("/")
+        request.user = u
+
+        version_admin = admin.site._registry[FileVersion]
+        self.assertFalse(version_admin.has_add_permission(request))
+        version_admin.delete_queryset(request, FileVersion.objects.filter(base_file__file_name="a.txt"))
+        self.assertEqual(Blob.objects.get(pk=blob_hash).refcount, 1)
+        self.assertFalse(BaseFile.objects.filter(file_name="a.txt").exists())
+
+        admin.site._registry[get_user_model()].delete_model(request, u)
+        blob = Blob.objects.get(pk=blob_hash)
+        self.assertEqual(blob.refcount, 0)
+        self.assertIsNotNone(blob.unreferenced_at)
+
+    def test_reupload_within_grace_period_revives_blob(self):
+        u = get_user_model().objects.create_user("u13", "u13@example.com", "p")
+        fv = FileVersion.objects.create(file_name="r.txt", owner=u,
+                                        file_content=SimpleUploadedFile("r.txt", b"again"))
+        FileVersion.objects.delete_version(fv)
+        FileVersion.objects.create(file_name="r.txt", owner=u,
+                                   file_content=SimpleUploadedFile("r.txt", b"again"))
+        blob = Blob.objects.get(pk=fv.file_hash)
+        self.assertEqual((blob.refcount, blob.unreferenced_at), (1, None))
+
+        call_command("sweep_blobs", "--grace-period=0", stdout=StringIO())
+        self.assertTrue(default_storage.exists(blob.cas_path))
+
+    def test_failed_create_releases_blob_reference(self):
+        u = get_user_model().objects.create_user("u14", "u14@example.com", "p")
+        with mock.patch.object(models, "_claim_version_number", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                FileVersion.objects.create(file_name="f.txt", owner=u,
+                                           file_content=SimpleUploadedFile("f.txt", b"failed"))
+        blob = Blob.objects.get(pk=hashlib.sha256(b"failed").hexdigest())
+        self.assertEqual(blob.refcount, 0)
+        self.assertIsNotNone(blob.unreferenced_at)
+
+    def _orphan(self, content, name=None, age=2 * 60 * 60):
+        digest = hashlib.sha256(content).hexdigest()
+        path = default_storage.save(models._cas_path(digest) if name is None else name, ContentFile(content))
+        old = timezone.now().timestamp() - age
+        os.utime(default_storage.path(path), (old, old))
+        return path
+
+    def test_scan_orphan_blobs(self):
+        u = get_user_model().objects.create_user("u15", "u15@example.com", "p")
+        live = FileVersion.objects.create(file_name="l.txt", owner=u,
+                                          file_content=SimpleUploadedFile("l.txt", b"live"))
+        orphan = self._orphan(b"crashed upload")
+        leftover = self._orphan(b"dup", name=live.cas_path + "_AbCd123")
+        young = self._orphan(b"in flight", age=0)
+
+        out = StringIO()
+        call_command("scan_orphan_blobs", "--dry-run", "--workers=2", stdout=out)
+        self.assertEqual(set(out.getvalue().splitlines()[:-1]), {orphan, leftover})
+        self.assertTrue(default_storage.exists(orphan))
+
+        call_command("scan_orphan_blobs", "--workers=2", stdout=StringIO())
+        self.assertFalse(default_storage.exists(orphan))
+        self.assertFalse(default_storage.exists(leftover))
+        self.assertFalse(Blob.objects.filter(pk=os.path.basename(orphan)).exists())
+        self.assertTrue(default_storage.exists(young))
+        self.assertTrue(default_storage.exists(live.cas_path))
+
+    def test_scan_orphan_blobs_resumes_from_checkpoint(self):
+        orphan = self._orphan(b"skipped shard")
+        shard = orphan.split("/")[1]
+        checkpoint = os.path.join(default_storage.location, "scan.json")
+        with open(checkpoint, "w") as fh:
+            json.dump({"done": [shard]}, fh)
+
+        call_command("scan_orphan_blobs", f"--checkpoint={checkpoint}", stdout=StringIO())
+        self.assertTrue(default_storage.exists(orphan))
+        self.assertFalse(os.path.exists(checkpoint))
+
+    def test_scrub_blobs_reports_damaged_content(self):
+        u = get_user_model().objects.create_user("u16", "u16@example.com", "p")
+        good = FileVersion.objects.create(file_name="good.txt", owner=u,
+                                          file_content=SimpleUploadedFile("good.txt", b"intact"))
+        bad = FileVersion.objects.create(file_name="bad.txt", owner=u,
+                                         file_content=SimpleUploadedFile("bad.txt", b"bit rot"))
+        with open(default_storage.path(bad.cas_path), "wb") as fh:
+            fh.write(b"bit r0t")
+
+        err = StringIO()
+        with self.assertRaises(CommandError):
+            call_command("scrub_blobs", "--rate=0", stdout=StringIO(), stderr=err)
+        self.assertIn(bad.cas_path, err.getvalue())
+        self.assertIn("bad.txt revision 0", err.getvalue())
+        self.assertIsNotNone(Blob.objects.get(pk=good.file_hash).verified_at)
+        self.assertIsNone(Blob.objects.get(pk=bad.file_hash).verified_at)
+
+        with self.settings(BLOB_COMPRESSION="xz"):
+            FileVersion.objects.create(file_name="xz.txt", owner=u,
+                                       file_content=SimpleUploadedFile("xz.txt", b"compressible " * 200))
+        err = StringIO()
+        with self.assertRaises(CommandError):
+            call_command("scrub_blobs", stdout=StringIO(), stderr=err)
+        self.assertEqual(Blob.objects.filter(verified_at__isnull=True).count(), 1)
+
+        # verified blobs are skipped until they are due again
+        Blob.objects.filter(pk=bad.file_hash).update(refcount=0)
+        out = StringIO()
+        call_command("scrub_blobs", stdout=out)
+        self.assertIn("Verified 0 blobs", out.getvalue())
+
+    def test_delta_chain_with_keyframes(self):
+        u = get_user_model().objects.create_user("u17", "u17@example.com", "p")
+        base = b"".join(b"Section %d. Text of the bill.\n" % i for i in range(300))
+        revisions = [base] + [base + b"Amendment %d.\n" % n for n in range(1, 4)]
+        with self.settings(BLOB_DELTA=True, BLOB_DELTA_MAX_CHAIN=3):
+            versions = [FileVersion.objects.create(file_name="bill.txt", owner=u,
+                                                   file_content=SimpleUploadedFile("bill.txt", body))
+                        for body in revisions]
+        blobs = [Blob.objects.get(pk=fv.file_hash) for fv in versions]
+        self.assertEqual([(b.codec, b.chain_length) for b in blobs],
+                         [("", 0), ("delta", 1), ("delta", 2), ("", 0)])
+        self.assertEqual(blobs[1].delta_base_id, blobs[0].pk)
+        self.assertLess(default_storage.size(blobs[2].cas_path), 100)
+        # the keyframe is referenced by its version and by the first delta
+        self.assertEqual(blobs[0].refcount, 2)
+
+        for fv, body in zip(versions, revisions):
+            with FileVersion.objects.get(pk=fv.pk).open_content() as fh:
+                self.assertEqual(fh.read(), body)
+
+        for fv in versions:
+            FileVersion.objects.delete_version(fv)
+        # a base's grace period starts once the last delta on it is swept
+        for remaining in (2, 1, 0):
+            Blob.objects.update(unreferenced_at=timezone.now() - timedelta(days=2))
+            call_command("sweep_blobs", stdout=StringIO())
+            self.assertEqual(Blob.objects.count(), remaining)
+
+    def test_chunked_blobs_share_unchanged_chunks(self):
+        u = get_user_model().objects.create_user("u19", "u19@example.com", "p")
+        # fixed content: chunk boundaries around the edit are deterministic
+        data = random.Random(19).randbytes(32 * 1024)
+        edited = data[:20000] + b"an edit" + data[20000:]
+        with self.settings(BLOB_CHUNKING=True, BLOB_CHUNKING_MIN_SIZE=8192, BLOB_CHUNK_AVG_SIZE=1024):
+            fv1 = FileVersion.objects.create(file_name="big.bin", owner=u,
+                                             file_content=SimpleUploadedFile("big.bin", data))
+            fv2 = FileVersion.objects.create(file_name="big.bin", owner=u,
+                                             file_content=SimpleUploadedFile("big.bin", edited))
+            # stored whole by the upload, split afterwards
+            self.assertEqual(Blob.objects.get(pk=fv1.file_hash).codec, "")
+            stale = FileVersion.objects.with_codec().get(pk=fv1.pk)
+            call_command("chunk_blobs", stdout=StringIO())
+        # looked up as a loose blob, read from the chunks
+        with stale.open_content() as fh:
+            self.assertEqual(fh.read(), data)
+        blob1, blob2 = Blob.objects.get(pk=fv1.file_hash), Blob.objects.get(pk=fv2.file_hash)
+        self.assertEqual((blob1.codec, blob1.size), ("chunked", len(data)))
+        self.assertFalse(default_storage.exists(blob1.cas_path))
+        chunks1 = set(blob1.manifest.values_list("chunk_id", flat=True))
+        chunks2 = list(blob2.manifest.order_by("index").values_list("chunk_id", flat=True))
+        self.assertLessEqual(sum(c not in chunks1 for c in chunks2), 2)
+
+        for fv, body in ((fv1, data), (fv2, edited)):
+            with FileVersion.objects.get(pk=fv.pk).open_content() as fh:
+                self.assertEqual(fh.read(), body)
+        call_command("scrub_blobs", stdout=StringIO())
+
+        # rebuilt from stored chunks alone, the same content dedups to blob2
+        fv3 = FileVersion.objects.create_from_chunks(chunks2, {}, file_name="copy.bin", owner=u)
+        self.assertEqual((fv3.file_hash, fv3.file_size), (fv2.file_hash, len(edited)))
+        with self.assertRaises(ValueError):
+            FileVersion.objects.create_from_chunks(["0" * 64], {}, file_name="x.bin", owner=u)
+
+        for fv in (fv1, fv2, fv3):
+            FileVersion.objects.delete_version(fv)
+        # chunks are released once their manifests are swept
+        for _ in range(2):
+            Blob.objects.update(unreferenced_at=timezone.now() - timedelta(days=2))
+            call_command("sweep_blobs", stdout=StringIO())
+        self.assertEqual(Blob.objects.count(), 0)
+
+    def test_small_version_after_chunked_one_is_not_a_delta(self):
+        u = get_user_model().objects.create_user("u19b", "u19b@example.com", "p")
+        text = b"".join(b"Line %d of the document.\n" % i for i in range(1000))
+        with self.settings(BLOB_DELTA=True, BLOB_CHUNKING=True, BLOB_CHUNKING_MIN_SIZE=8192,
+                           BLOB_CHUNK_AVG_SIZE=1024):
+            FileVersion.objects.create(file_name="mixed.txt", owner=u,
+                                       file_content=SimpleUploadedFile("mixed.txt", text))
+            call_command("chunk_blobs", stdout=StringIO())
+            fv = FileVersion.objects.create(file_name="mixed.txt", owner=u,
+                                            file_content=SimpleUploadedFile("mixed.txt", text[:4000]))
+        self.assertEqual(Blob.objects.get(pk=fv.file_hash).codec, "")
+        with FileVersion.objects.with_codec().get(pk=fv.pk).open_content() as fh:
+            self.assertEqual(fh.read(), text[:4000])
+
+    def test_upload_of_content_registered_as_an_unwritten_delta(self):
+        u = get_user_model().objects.create_user("u18b", "u18b@example.com", "p")
+        text = b"".join(b"Section %d is unchanged.\n" % i for i in range(300))
+        edited = text.replace(b"Section 7 ", b"Section 7b ")
+        base = FileVersion.objects.create(file_name="base.txt", owner=u,
+                                          file_content=SimpleUploadedFile("base.txt", text))
+        # another upload registered the content as a delta, then failed before writing it
+        edited_hash = hashlib.sha256(edited).hexdigest()
+        Blob.objects.create(file_hash=edited_hash, size=len(edited), codec="delta", refcount=1,
+                            delta_base_id=base.file_hash, chain_length=1)
+        Blob.objects.filter(pk=base.file_hash).update(refcount=2)
+
+        fv = FileVersion.objects.create(file_name="copy.txt", owner=u,
+                                        file_content=SimpleUploadedFile("copy.txt", edited))
+        self.assertEqual(Blob.objects.get(pk=edited_hash).refcount, 2)
+        with FileVersion.objects.with_codec().get(pk=fv.pk).open_content() as fh:
+            self.assertEqual(fh.read(), edited)
+
+    def test_pack_small_blobs_and_repack_sparse_packs(self):
+        u = get_user_model().objects.create_user("u20", "u20@example.com", "p")
+        base = b"".join(b"Clause %d applies.\n" % i for i in range(200))
+        bodies = (base, base + b"New clause.\n")
+        with self.settings(BLOB_COMPRESSION="gzip", BLOB_DELTA=True):
+            versions = [FileVersion.objects.create(file_name="act.txt", owner=u,
+                                                   file_content=SimpleUploadedFile("act.txt", body))
+                        for body in bodies]
+        note = FileVersion.objects.create(file_name="note.bin", owner=u,
+                                          file_content=SimpleUploadedFile("note.bin", os.urandom(8 * 1024)))
+        big = FileVersion.objects.create(file_name="big.bin", owner=u,
+                                         file_content=SimpleUploadedFile("big.bin", os.urandom(100 * 1024)))
+        fresh = FileVersion.objects.create(file_name="fresh.txt", owner=u,
+                                           file_content=SimpleUploadedFile("fresh.txt", b"just written"))
+        Blob.objects.exclude(pk=fresh.file_hash).update(created_at=timezone.now() - timedelta(days=1))
+
+        out = StringIO()
+        call_command("pack_blobs", stdout=out)
+        self.assertIn("Packed 3 blobs into 1 packs", out.getvalue())
+        pack = Pack.objects.get()
+        packed = {fv.file_hash for fv in versions + [note]}
+        self.assertEqual(set(pack.blobs.values_list("pk", flat=True)), packed)
+        for file_hash in packed:
+            self.assertFalse(default_storage.exists(models._cas_path(file_hash)))
+        self.assertTrue(default_storage.exists(big.cas_path))
+        self.assertTrue(default_storage.exists(fresh.cas_path))
+
+        deltas.reconstructed.clear()
+        getbuffer = mock.patch.object(packs.PackSlice, "getbuffer", autospec=True,
+                                      side_effect=packs.PackSlice.getbuffer)
+        with getbuffer as spy:
+            for fv, body in zip(versions, bodies):
+                with FileVersion.objects.with_codec().get(pk=fv.pk).open_content() as fh:
+                    self.assertEqual(fh.read(), body)
+        # the packed delta was applied from the pack's memory, not a copy
+        self.assertEqual(spy.call_count, 1)
+        blob = Blob.objects.select_related("pack").get(pk=note.file_hash)
+        with packs.open_blob(blob) as fh:
+            self.assertIsInstance(fh.getbuffer(), memoryview)
+            self.assertEqual(len(fh.getbuffer()), blob.pack_length)
+        # the same content uploaded again is not written loose a second time
+        FileVersion.objects.create(file_name="copy.bin", owner=u, file_hash=note.file_hash)
+        self.assertFalse(default_storage.exists(note.cas_path))
+        call_command("scrub_blobs", stdout=StringIO())
+
+        # with the note swept most of the pack is dead, so it is rewritten
+        for fv in FileVersion.objects.filter(file_hash=note.file_hash):
+            FileVersion.objects.delete_version(fv)
+        Blob.objects.update(unreferenced_at=timezone.now() - timedelta(days=2))
+        call_command("sweep_blobs", stdout=StringIO())
+        out = StringIO()
+        call_command("pack_blobs", stdout=out)
+        self.assertIn("Packed 2 blobs into 1 packs, removed 1 packs", out.getvalue())
+        self.assertFalse(default_storage.exists(pack.name))
+        deltas.reconstructed.clear()
+        with FileVersion.objects.get(pk=versions[1].pk).open_content() as fh:
+            self.assertEqual(fh.read(), bodies[1])
+
+    def test_expire_upload_sessions(self):
+        u = get_user_model().objects.create_user("u21", "u21@example.com", "p")
+        old = UploadSession.objects.create(owner=u, file_name="/documents/old.bin", size=10)
+        new = UploadSession.objects.create(owner=u, file_name="/documents/new.bin", size=10)
+        for session in (old, new):
+            uploads.create_staging(session)
+        UploadSession.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=30))
+
+        out = StringIO()
+        call_command("expire_upload_sessions", stdout=out)
+        self.assertIn("Expired 1 upload sessions", out.getvalue())
+        self.assertEqual(list(UploadSession.objects.values_list("pk", flat=True)), [new.pk])
+        self.assertEqual(os.listdir(uploads.staging_dir()), [str(new.pk)])
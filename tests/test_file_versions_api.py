@@ -1,10 +1,23 @@
+import hashlib
+import io
+import json
+import os
+import random
+import tarfile
+import zipfile
+from datetime import datetime, timezone
+from unittest import mock
+
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
 from django.test import TestCase
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
-from propylon_document_manager.file_versions.models import BaseFile, FileVersion
+from propylon_document_manager.file_versions import chunking, paths, uploads
+from propylon_document_manager.file_versions.models import BaseFile, Blob, FileVersion
 from propylon_document_manager.file_versions.api.serializers import FileVersionSerializer
 
 from propylon_document_manager.file_versions.models import FileVersion
@@ -19,6 +32,18 @@ def diff_url(path: str) -> str:
 def mine_url() -> str:
     return reverse("file_versions:documents-mine")
 
+def history_url(path: str) -> str:
+    return reverse("file_versions:documents-history", kwargs={"path": path})
+
+def blob_url(sha256: str) -> str:
+    return reverse("file_versions:blobs", kwargs={"sha256": sha256})
+
+def upload_url(session_id) -> str:
+    return reverse("file_versions:uploads", kwargs={"session_id": session_id})
+
+def missing_chunks_url() -> str:
+    return reverse("file_versions:blobs-missing")
+
 
 def create_file_version(user, **params):
     """Helper function to create a FileVersion instance."""
@@ -94,6 +119,159 @@ class PrivateFileVersionAPITests(TestCase):
         self.assertEqual(bf.versions.count(), 2)
         self.assertEqual(bf.latest_version_number, 2)
 
+    def test_upload_hashes_while_receiving(self):
+        data = b"uploaded in one pass"
+        with mock.patch("propylon_document_manager.file_versions.models._sha256_stream") as sha:
+            res = self.client.post(doc_url("upload.txt"), {"file": SimpleUploadedFile("upload.txt", data)})
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        sha.assert_not_called()
+        fv = FileVersion.objects.get(pk=res.data["id"])
+        self.assertEqual(fv.file_hash, hashlib.sha256(data).hexdigest())
+        with fv.file_content.open("rb") as fh:
+            self.assertEqual(fh.read(), data)
+
+    def test_blob_head_and_create_from_hash(self):
+        data = b"already on the server"
+        digest = hashlib.sha256(data).hexdigest()
+        self.assertEqual(self.client.head(blob_url(digest)).status_code, status.HTTP_404_NOT_FOUND)
+
+        create_file_version(self.user, file_name="/documents/orig.txt",
+                            file_content=SimpleUploadedFile("orig.txt", data))
+        self.assertEqual(self.client.head(blob_url(digest)).status_code, status.HTTP_200_OK)
+
+        res = self.client.post(doc_url("copy.txt"), {"file_hash": digest})
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        fv = FileVersion.objects.get(pk=res.data["id"])
+        self.assertEqual(fv.file_hash, digest)
+        self.assertEqual(self.client.get(doc_url("copy.txt")).getvalue(), data)
+
+    def test_create_from_unknown_or_foreign_hash_is_404(self):
+        other = get_user_model().objects.create_user(
+            username="other", email="other@example.com", password="testpass123")
+        data = b"someone else's content"
+        digest = hashlib.sha256(data).hexdigest()
+        create_file_version(other, file_name="/documents/theirs.txt",
+                            file_content=SimpleUploadedFile("theirs.txt", data))
+
+        self.assertEqual(self.client.head(blob_url(digest)).status_code, status.HTTP_404_NOT_FOUND)
+        res = self.client.post(doc_url("mine.txt"), {"file_hash": digest})
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(BaseFile.objects.filter(owner=self.user).exists())
+
+    def test_pinned_revision_is_conditional(self):
+        fv = create_file_version(self.user, file_name="/documents/etag.txt",
+                                 file_content=SimpleUploadedFile("v0.txt", b"pinned"))
+        res = self.client.get(doc_url("etag.txt") + "?revision=0")
+        self.assertEqual(res["ETag"], f'"{fv.file_hash}"')
+        self.assertIn("no-cache", res["Cache-Control"])
+        self.assertIn("private", res["Cache-Control"])
+
+        res = self.client.get(doc_url("etag.txt") + "?revision=0", HTTP_IF_NONE_MATCH=res["ETag"])
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        res = self.client.get(doc_url("etag.txt") + "?revision=0",
+                              HTTP_IF_MODIFIED_SINCE=res["Last-Modified"])
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # a deleted newest revision's number is reused, so the old ETag must stop matching
+        create_file_version(self.user, file_name="/documents/etag.txt",
+                            file_content=SimpleUploadedFile("v1.txt", b"one"))
+        etag = self.client.get(doc_url("etag.txt") + "?revision=1")["ETag"]
+        self.client.delete(doc_url("etag.txt") + "?revision=1")
+        create_file_version(self.user, file_name="/documents/etag.txt",
+                            file_content=SimpleUploadedFile("v1.txt", b"DIFFERENT"))
+        res = self.client.get(doc_url("etag.txt") + "?revision=1", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.getvalue(), b"DIFFERENT")
+
+    def test_latest_revalidates_against_current_hash(self):
+        create_file_version(self.user, file_name="/documents/latest.txt",
+                            file_content=SimpleUploadedFile("v0.txt", b"old"))
+        res = self.client.get(doc_url("latest.txt"))
+        self.assertIn("no-cache", res["Cache-Control"])
+        self.assertNotIn("Last-Modified", res)
+        etag = res["ETag"]
+        self.assertEqual(self.client.get(doc_url("latest.txt"), HTTP_IF_NONE_MATCH=etag).status_code,
+                         status.HTTP_304_NOT_MODIFIED)
+
+        create_file_version(self.user, file_name="/documents/latest.txt",
+                            file_content=SimpleUploadedFile("v1.txt", b"new"))
+        res = self.client.get(doc_url("latest.txt"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.getvalue(), b"new")
+
+    def test_range_requests(self):
+        data = b"0123456789abcdefghij"
+        create_file_version(self.user, file_name="/documents/range.txt",
+                            file_content=SimpleUploadedFile("v0.txt", data))
+        url = doc_url("range.txt") + "?revision=0"
+
+        res = self.client.get(url, HTTP_RANGE="bytes=2-5")
+        self.assertEqual(res.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(res["Content-Range"], "bytes 2-5/20")
+        self.assertEqual(res.getvalue(), b"2345")
+
+        res = self.client.get(url, HTTP_RANGE="bytes=-3")
+        self.assertEqual(res.getvalue(), b"hij")
+
+        res = self.client.get(url, HTTP_RANGE="bytes=0-1,10-11")
+        self.assertEqual(res.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertTrue(res["Content-Type"].startswith("multipart/byteranges"))
+        body = res.getvalue()
+        self.assertEqual(len(body), int(res["Content-Length"]))
+        self.assertIn(b"Content-Range: bytes 0-1/20\r\n\r\n01", body)
+        self.assertIn(b"Content-Range: bytes 10-11/20\r\n\r\nab", body)
+
+        res = self.client.get(url, HTTP_RANGE="bytes=50-")
+        self.assertEqual(res.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(res["Content-Range"], "bytes */20")
+
+    def test_if_range_mismatch_returns_full_content(self):
+        data = b"0123456789"
+        fv = create_file_version(self.user, file_name="/documents/ifrange.txt",
+                                 file_content=SimpleUploadedFile("v0.txt", data))
+        url = doc_url("ifrange.txt")
+
+        res = self.client.get(url, HTTP_RANGE="bytes=5-", HTTP_IF_RANGE=f'"{fv.file_hash}"')
+        self.assertEqual(res.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(res.getvalue(), b"56789")
+
+        res = self.client.get(url, HTTP_RANGE="bytes=5-", HTTP_IF_RANGE='"stale"')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.getvalue(), data)
+
+    def test_packed_blob_is_served_with_ranges(self):
+        data = b"0123456789abcdefghij"
+        create_file_version(self.user, file_name="/documents/packed.txt",
+                            file_content=SimpleUploadedFile("v0.txt", data))
+        call_command("pack_blobs", "--min-age", "0", stdout=io.StringIO())
+        url = doc_url("packed.txt")
+
+        res = self.client.get(url, HTTP_RANGE="bytes=2-5")
+        self.assertEqual(res.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(res.getvalue(), b"2345")
+        # the web server cannot send a slice of a pack file
+        with self.settings(DOCUMENT_DELIVERY="x-accel-redirect"):
+            res = self.client.get(url)
+        self.assertNotIn("X-Accel-Redirect", res.headers)
+        self.assertEqual(res.getvalue(), data)
+        self.assertEqual(res["Content-Length"], str(len(data)))
+
+    def test_x_accel_redirect_delivery(self):
+        fv = create_file_version(self.user, file_name="/documents/offload.txt",
+                                 file_content=SimpleUploadedFile("v0.txt", b"served by nginx"))
+        with self.settings(DOCUMENT_DELIVERY="x-accel-redirect", DOCUMENT_DELIVERY_INTERNAL_URL="/protected/"):
+            res = self.client.get(doc_url("offload.txt"))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res["X-Accel-Redirect"], f"/protected/{fv.file_content.name}")
+        self.assertEqual(res["ETag"], f'"{fv.file_hash}"')
+        self.assertEqual(res.content, b"")
+
+    def test_x_sendfile_delivery(self):
+        fv = create_file_version(self.user, file_name="/documents/offload.txt",
+                                 file_content=SimpleUploadedFile("v0.txt", b"served by apache"))
+        with self.settings(DOCUMENT_DELIVERY="x-sendfile"):
+            res = self.client.get(doc_url("offload.txt") + "?revision=0")
+        self.assertEqual(res["X-Sendfile"], default_storage.path(fv.file_content.name))
+
     def test_get_404_when_document_missing(self):
         res = self.client.get(doc_url("nope.txt"))
         self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
@@ -126,6 +304,144 @@ class PrivateFileVersionAPITests(TestCase):
         self.assertIn("Revision 0", body)
         self.assertIn("Revision 1", body)
 
+    def test_diff_with_context_only_renders_changes(self):
+        file_path = "/documents/context.txt"
+        lines = [f"line {i}" for i in range(50)]
+        create_file_version(self.user, file_name=file_path,
+                            file_content=SimpleUploadedFile("v0.txt", "\n".join(lines).encode()))
+        lines[25] = "line 25 CHANGED"
+        create_file_version(self.user, file_name=file_path,
+                            file_content=SimpleUploadedFile("v1.txt", "\n".join(lines).encode()))
+
+        res = self.client.get(diff_url("context.txt") + "?from=0&to=1&context=1")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        body = res.content.decode("utf-8")
+        self.assertIn("line 25 CHANGED", body)
+        self.assertIn("line 24", body)
+        self.assertNotIn("line 10", body)
+
+        res = self.client.get(diff_url("context.txt") + "?from=0&to=1&context=-1")
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def _create_diff_revisions(self):
+        file_path = "/documents/formats.txt"
+        create_file_version(self.user, file_name=file_path,
+                            file_content=SimpleUploadedFile("v0.txt", b"a\nb\nc\nd\n"))
+        create_file_version(self.user, file_name=file_path,
+                            file_content=SimpleUploadedFile("v1.txt", b"a\nB\nc\nd\ne\n"))
+        return diff_url("formats.txt") + "?from=0&to=1"
+
+    def test_diff_unified_format(self):
+        res = self.client.get(self._create_diff_revisions() + "&format=unified")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res.streaming)
+        self.assertEqual(
+            b"".join(res.streaming_content).decode(),
+            "--- /documents/formats.txt?revision=0\n"
+            "+++ /documents/formats.txt?revision=1\n"
+            "@@ -1,4 +1,5 @@\n a\n-b\n+B\n c\n d\n+e\n",
+        )
+
+    def test_diff_json_and_stats_formats(self):
+        url = self._create_diff_revisions()
+        res = self.client.get(url + "&format=json")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        data = json.loads(b"".join(res.streaming_content))
+        self.assertEqual(data["stats"], {"added": 1, "removed": 0, "changed": 1})
+        self.assertEqual(len(data["hunks"]), 1)
+        self.assertIn(["-", "b"], data["hunks"][0]["lines"])
+
+        res = self.client.get(url + "&format=stats")
+        self.assertEqual(res.json(), {"added": 1, "removed": 0, "changed": 1})
+
+        res = self.client.get(url + "&format=pdf")
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_mine_is_cursor_paginated(self):
+        for name in ("a.txt", "b.txt", "c.txt"):
+            for _ in range(2):
+                create_file_version(self.user, file_name=f"/documents/{name}")
+
+        seen, url = [], mine_url() + "?limit=4"
+        while url:
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            seen.extend((row["file_name"], row["version_number"]) for row in res.json())
+            link = res.headers.get("Link")
+            url = link[1:link.index(">")] if link else None
+        self.assertEqual(seen, [(f"/documents/{n}", v) for n in ("a.txt", "b.txt", "c.txt") for v in (1, 0)])
+
+        res = self.client.get(mine_url() + "?cursor=garbage")
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_mine_latest_only_and_ndjson(self):
+        create_file_version(self.user, file_name="/documents/a.txt")
+        create_file_version(self.user, file_name="/documents/a.txt")
+        create_file_version(self.user, file_name="/documents/b.txt")
+
+        res = self.client.get(mine_url() + "?latest=1")
+        self.assertEqual([(r["file_name"], r["version_number"]) for r in res.json()],
+                         [("/documents/a.txt", 1), ("/documents/b.txt", 0)])
+
+        res = self.client.get(mine_url() + "?format=ndjson")
+        self.assertEqual(res["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in b"".join(res.streaming_content).splitlines()]
+        self.assertEqual(len(rows), 3)
+        expected = FileVersionSerializer(FileVersion.objects.get(pk=rows[0]["id"])).data
+        self.assertEqual(rows[0], json.loads(json.dumps(expected)))
+
+    def test_document_history_is_paginated_by_version(self):
+        for i in range(5):
+            create_file_version(self.user, file_name="/documents/hist.txt",
+                                file_content=SimpleUploadedFile("v.txt", b"x" * (i + 1)))
+        create_file_version(self.user, file_name="/documents/other.txt")
+
+        res = self.client.get(history_url("hist.txt") + "?limit=3")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        page = res.json()
+        self.assertEqual([r["version_number"] for r in page], [4, 3, 2])
+        self.assertEqual(page[0]["file_size"], 5)
+        self.assertEqual(page[0]["file_version_url"], "/documents/hist.txt?revision=4")
+        self.assertEqual(page[0]["file_hash"], hashlib.sha256(b"xxxxx").hexdigest())
+
+        link = res.headers["Link"]
+        res = self.client.get(link[1:link.index(">")])
+        self.assertEqual([r["version_number"] for r in res.json()], [1, 0])
+        self.assertNotIn("Link", res.headers)
+
+        self.assertEqual(self.client.get(history_url("missing.txt")).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_path_resolution_is_cached_and_invalidated(self):
+        create_file_version(self.user, file_name="/documents/hot.txt",
+                            file_content=SimpleUploadedFile("v0.txt", b"v0"))
+        self.client.get(doc_url("hot.txt"))
+        # only the FileVersion row is read, the BaseFile comes from the cache
+        with self.assertNumQueries(1):
+            res = self.client.get(doc_url("hot.txt"))
+        self.assertEqual(res.getvalue(), b"v0")
+
+        self.client.post(doc_url("hot.txt"), {"file": SimpleUploadedFile("v1.txt", b"v1")})
+        self.assertEqual(self.client.get(doc_url("hot.txt")).getvalue(), b"v1")
+
+        self.client.delete(doc_url("hot.txt"))
+        self.assertEqual(self.client.get(doc_url("hot.txt")).getvalue(), b"v0")
+
+    def test_resolution_read_before_a_commit_is_not_served_after_it(self):
+        create_file_version(self.user, file_name="/documents/race.txt",
+                            file_content=SimpleUploadedFile("v0.txt", b"v0"))
+        cache = paths._cache()
+        cache_set = cache.set
+
+        def set_after_commit(*args, **kwargs):
+            # a writer commits between the reader's query and its cache write
+            with self.captureOnCommitCallbacks(execute=True):
+                create_file_version(self.user, file_name="/documents/race.txt",
+                                    file_content=SimpleUploadedFile("v1.txt", b"v1"))
+            cache_set(*args, **kwargs)
+
+        with mock.patch.object(cache, "set", side_effect=set_after_commit):
+            paths.resolve_document(self.user, "/documents/race.txt")
+        self.assertEqual(self.client.get(doc_url("race.txt")).getvalue(), b"v1")
 
     def test_user_cannot_access_another_users_file(self):
         
@@ -154,3 +470,321 @@ class PrivateFileVersionAPITests(TestCase):
         res_client = self.client.get(doc_url("secret.txt"))
         self.assertEqual(res_client.status_code, status.HTTP_200_OK)
 
+    def test_compressed_blob_is_decoded_or_passed_through(self):
+        XML = b"".join(b"<section id='%d'><p>Text of the section.</p></section>\n" % i for i in range(200))
+        with self.settings(BLOB_COMPRESSION="gzip"):
+            fv = create_file_version(self.user, file_name="/documents/act.xml",
+                                     file_content=SimpleUploadedFile("act.xml", XML))
+        with default_storage.open(fv.cas_path, "rb") as fh:
+            stored = fh.read()
+        self.assertLess(len(stored), len(XML) // 5)
+
+        res = self.client.get(doc_url("act.xml"))
+        self.assertEqual(b"".join(res.streaming_content), XML)
+        self.assertEqual(res["Content-Length"], str(len(XML)))
+        self.assertNotIn("Content-Encoding", res.headers)
+        self.assertEqual(res["ETag"], f'"{fv.file_hash}"')
+        self.assertIn("Accept-Encoding", res["Vary"])
+
+        res = self.client.get(doc_url("act.xml"), HTTP_ACCEPT_ENCODING="br, gzip")
+        self.assertEqual(res["Content-Encoding"], "gzip")
+        self.assertEqual(b"".join(res.streaming_content), stored)
+        self.assertEqual(res["ETag"], f'"{fv.file_hash}+gzip"')
+
+        res = self.client.get(doc_url("act.xml"), HTTP_ACCEPT_ENCODING="gzip;q=0")
+        self.assertNotIn("Content-Encoding", res.headers)
+
+        with self.settings(BLOB_COMPRESSION="xz"):
+            self.client.post(doc_url("act.xml"), {"file": SimpleUploadedFile("act.xml", XML + b"<end/>\n")})
+        res = self.client.get(diff_url("act.xml") + "?from=0&to=1&format=stats")
+        self.assertEqual(res.json(), {"added": 1, "removed": 0, "changed": 0})
+
+    def test_chunked_blob_serves_ranges_from_its_chunks(self):
+        data = random.Random(5).randbytes(20000)
+        with self.settings(BLOB_CHUNKING=True, BLOB_CHUNKING_MIN_SIZE=8192, BLOB_CHUNK_AVG_SIZE=1024):
+            create_file_version(self.user, file_name="/documents/ranged.bin",
+                                file_content=SimpleUploadedFile("ranged.bin", data))
+            call_command("chunk_blobs", stdout=io.StringIO())
+        self.assertEqual(Blob.objects.get(pk=hashlib.sha256(data).hexdigest()).codec, "chunked")
+
+        res = self.client.get(doc_url("ranged.bin"), HTTP_RANGE="bytes=0-9")
+        self.assertEqual(res.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(res.getvalue(), data[:10])
+        res = self.client.get(doc_url("ranged.bin"), HTTP_RANGE="bytes=5000-12999")
+        self.assertEqual((res["Content-Range"], res.getvalue()), ("bytes 5000-12999/20000", data[5000:13000]))
+        body = self.client.get(doc_url("ranged.bin"), HTTP_RANGE="bytes=-100,3000-3001").getvalue()
+        self.assertIn(b"Content-Range: bytes 3000-3001/20000\r\n\r\n" + data[3000:3002], body)
+        self.assertIn(b"Content-Range: bytes 19900-19999/20000\r\n\r\n" + data[-100:], body)
+
+        # no file at the CAS path for the web server to send
+        with self.settings(DOCUMENT_DELIVERY="x-accel-redirect"):
+            res = self.client.get(doc_url("ranged.bin"))
+        self.assertNotIn("X-Accel-Redirect", res)
+        self.assertEqual((res["Accept-Ranges"], res["Content-Length"]), ("bytes", "20000"))
+        self.assertEqual(res.getvalue(), data)
+
+    def test_upload_only_missing_chunks(self):
+        data = random.Random(19).randbytes(16 * 1024)
+        with self.settings(BLOB_CHUNKING=True, BLOB_CHUNKING_MIN_SIZE=8192, BLOB_CHUNK_AVG_SIZE=1024):
+            create_file_version(self.user, file_name="/documents/big.bin",
+                                file_content=SimpleUploadedFile("big.bin", data))
+            call_command("chunk_blobs", stdout=io.StringIO())
+        edited = data + b"appended"
+        chunks = list(chunking.iter_chunks(io.BytesIO(edited), 1024))
+        hashes = [hashlib.sha256(c).hexdigest() for c in chunks]
+
+        res = self.client.post(missing_chunks_url(), {"chunks": hashes}, format="json")
+        missing = res.json()["missing"]
+        self.assertTrue(0 < len(missing) <= 2)
+
+        res = self.client.post(doc_url("big.bin"), {"manifest": json.dumps(hashes)})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.json()["missing"], missing)
+
+        parts = {h: SimpleUploadedFile(h, c) for h, c in zip(hashes, chunks) if h in missing}
+        res = self.client.post(doc_url("big.bin"), {"manifest": json.dumps(hashes), **parts})
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res.data["version_number"], 1)
+        self.assertEqual(b"".join(self.client.get(doc_url("big.bin")).streaming_content), edited)
+
+        # chunks of other users' content cannot be referenced
+        other = get_user_model().objects.create_user("other19", "other19@example.com", "p")
+        client = APIClient()
+        client.force_authenticate(other)
+        res = client.post(missing_chunks_url(), {"chunks": hashes}, format="json")
+        self.assertEqual(res.json()["missing"], list(dict.fromkeys(hashes)))
+
+    def test_resumable_upload_session(self):
+        data = os.urandom(300 * 1024)
+        res = self.client.post(reverse("file_versions:uploads-create"),
+                               {"path": "reports/big.bin", "size": len(data)}, format="json")
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        session_id = res.json()["id"]
+        url = upload_url(session_id)
+
+        # out of order; the last chunk "drops" and is sent again
+        for start, end in ((200 * 1024, 300 * 1024), (0, 100 * 1024), (100 * 1024, 150 * 1024)):
+            res = self.client.put(f"{url}?offset={start}", data[start:end],
+                                  content_type="application/octet-stream")
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+        res = self.client.post(url + "/commit", {}, format="json")
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(res.json()["received"], [[0, 150 * 1024], [200 * 1024, 300 * 1024]])
+
+        res = self.client.put(f"{url}?offset={100 * 1024}", data[100 * 1024:200 * 1024],
+                              content_type="application/octet-stream")
+        self.assertTrue(res.json()["complete"])
+        res = self.client.put(f"{url}?offset={len(data) - 1}", b"xx", content_type="application/octet-stream")
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res = self.client.post(url + "/commit", {"sha256": "0" * 64}, format="json")
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        res = self.client.post(url + "/commit", {"sha256": hashlib.sha256(data).hexdigest()}, format="json")
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res.data["file_name"], "/documents/reports/big.bin")
+        fv = FileVersion.objects.get(pk=res.data["id"])
+        self.assertEqual((fv.file_hash, fv.file_size), (hashlib.sha256(data).hexdigest(), len(data)))
+        self.assertEqual(b"".join(self.client.get(doc_url("reports/big.bin")).streaming_content), data)
+        self.assertFalse(os.listdir(uploads.staging_dir()))
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_upload_session_size_is_limited(self):
+        with self.settings(UPLOAD_SESSION_MAX_SIZE=1024):
+            res = self.client.post(reverse("file_versions:uploads-create"),
+                                   {"path": "huge.bin", "size": 1025}, format="json")
+        self.assertEqual(res.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertFalse(os.path.isdir(uploads.staging_dir()) and os.listdir(uploads.staging_dir()))
+
+    def test_upload_session_is_private_and_can_be_aborted(self):
+        res = self.client.post(reverse("file_versions:uploads-create"),
+                               {"path": "a.txt", "size": 3}, format="json")
+        url = upload_url(res.json()["id"])
+        other = get_user_model().objects.create_user("other21", "other21@example.com", "p")
+        client = APIClient()
+        client.force_authenticate(other)
+        self.assertEqual(client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(client.put(f"{url}?offset=0", b"abc", content_type="application/octet-stream").status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+        self.assertEqual(self.client.delete(url).status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(os.listdir(uploads.staging_dir()))
+        self.assertEqual(self.client.post(url + "/commit").status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_batch_upload_multipart_and_archives(self):
+        create_file_version(self.user, file_name="/documents/batch/a.txt",
+                            file_content=SimpleUploadedFile("a.txt", b"a v0"))
+        url = reverse("file_versions:documents-batch")
+        res = self.client.post(url + "?path=batch", {
+            "a.txt": [SimpleUploadedFile("a.txt", b"a v1"), SimpleUploadedFile("a.txt", b"a v2")],
+            "b.txt": SimpleUploadedFile("b.txt", b"a v1"),
+        })
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        results = {(r["file_name"], r["version_number"]) for r in res.json()["results"]}
+        self.assertEqual(results, {("/documents/batch/a.txt", 1), ("/documents/batch/a.txt", 2),
+                                   ("/documents/batch/b.txt", 0)})
+        self.assertEqual(self.client.get(doc_url("batch/a.txt")).getvalue(), b"a v2")
+        self.assertEqual(self.client.get(doc_url("batch/a.txt") + "?revision=1").getvalue(), b"a v1")
+        doc = BaseFile.objects.get(file_name="/documents/batch/a.txt")
+        self.assertEqual((doc.latest_version_number, doc.latest_version.version_number), (3, 2))
+        self.assertEqual(Blob.objects.get(pk=hashlib.sha256(b"a v1").hexdigest()).refcount, 2)
+
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode="w:gz") as tar:
+            for name, data in (("t/one.txt", b"one"), ("t/two.txt", b"two")):
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+            directory = tarfile.TarInfo("t/sub")
+            directory.type = tarfile.DIRTYPE
+            tar.addfile(directory)
+        res = self.client.generic("POST", url, buf.getvalue(), content_type="application/gzip")
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(res.json()["results"]), 2)
+        self.assertEqual(self.client.get(doc_url("t/two.txt")).getvalue(), b"two")
+
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w") as archive:
+            archive.writestr("z/dir/", b"")
+            archive.writestr("z/one.txt", b"one")
+        res = self.client.generic("POST", url, buf.getvalue(), content_type="application/zip")
+        self.assertEqual([r["file_name"] for r in res.json()["results"]], ["/documents/z/one.txt"])
+        self.assertEqual(self.client.get(doc_url("z/one.txt")).getvalue(), b"one")
+
+    def test_batch_entries_are_stored_and_closed_as_they_are_read(self):
+        files = [SimpleUploadedFile(f"{i}.txt", b"entry %d" % i) for i in range(5)]
+        open_at_read = []
+
+        def entries():
+            for f in files:
+                open_at_read.append(sum(not g.closed for g in files[:files.index(f)]))
+                yield f"/documents/w/{f.name}", f
+
+        versions = FileVersion.objects.create_many(self.user, entries(), workers=2, window=2)
+        self.assertEqual([fv.file_hash for fv in versions],
+                         [hashlib.sha256(b"entry %d" % i).hexdigest() for i in range(5)])
+        self.assertEqual(max(open_at_read), 1)
+        self.assertTrue(all(f.closed for f in files))
+
+        url = reverse("file_versions:documents-batch")
+        with self.settings(BATCH_UPLOAD_MAX_ENTRIES=1):
+            res = self.client.post(url, {
+                "x.txt": SimpleUploadedFile("x.txt", b"x"),
+                "y.txt": SimpleUploadedFile("y.txt", b"y"),
+            })
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(BaseFile.objects.filter(file_name="/documents/x.txt").exists())
+        self.assertFalse(Blob.objects.filter(pk=hashlib.sha256(b"x").hexdigest(), refcount__gt=0).exists())
+
+    def test_export_documents_as_tar_and_zip(self):
+        self.client.post(reverse("file_versions:documents-batch") + "?path=ex", {
+            "a.txt": [SimpleUploadedFile("a.txt", b"same"), SimpleUploadedFile("a.txt", b"a v1")],
+            "sub/b.txt": SimpleUploadedFile("b.txt", b"same"),
+            "c.txt": SimpleUploadedFile("c.txt", b"c" * 100000),
+        })
+        create_file_version(self.user, file_name="/documents/other.txt")
+        url = reverse("file_versions:documents-export")
+
+        res = self.client.get(url + "?prefix=ex&format=tar")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res["Content-Type"], "application/x-tar")
+        with tarfile.open(fileobj=io.BytesIO(res.getvalue())) as tar:
+            members = {m.name: m for m in tar.getmembers()}
+            self.assertEqual(set(members), {"ex/a.txt", "ex/sub/b.txt", "ex/c.txt"})
+            self.assertEqual(tar.extractfile("ex/a.txt").read(), b"a v1")
+            self.assertEqual(tar.extractfile("ex/c.txt").read(), b"c" * 100000)
+
+        res = self.client.get(url + "?prefix=ex&revisions=all&format=tar")
+        with tarfile.open(fileobj=io.BytesIO(res.getvalue())) as tar:
+            members = {m.name: m for m in tar.getmembers()}
+            self.assertEqual(set(members), {"ex/a.txt@0", "ex/a.txt@1", "ex/sub/b.txt@0", "ex/c.txt@0"})
+            # identical content is stored once
+            self.assertTrue(members["ex/sub/b.txt@0"].islnk())
+            self.assertEqual(members["ex/sub/b.txt@0"].linkname, "ex/a.txt@0")
+            self.assertEqual(tar.extractfile("ex/sub/b.txt@0").read(), b"same")
+
+        # repeated content goes to a temporary file, and is still read once
+        open_content = FileVersion.open_content
+        with mock.patch("propylon_document_manager.file_versions.archives.ZIP_REPEAT_BUFFER_SIZE", 0), \
+                mock.patch.object(FileVersion, "open_content", autospec=True,
+                                  side_effect=open_content) as opened:
+            res = self.client.get(url + "?revisions=all")
+            body = res.getvalue()
+        self.assertEqual(opened.call_count, 4)
+        self.assertEqual(res["Content-Type"], "application/zip")
+        with zipfile.ZipFile(io.BytesIO(body)) as archive:
+            self.assertEqual(archive.namelist(),
+                             ["ex/a.txt@0", "ex/a.txt@1", "ex/c.txt@0", "ex/sub/b.txt@0", "other.txt@0"])
+            self.assertEqual(archive.read("ex/a.txt@0"), b"same")
+            self.assertEqual(archive.read("ex/sub/b.txt@0"), b"same")
+            self.assertEqual(archive.read("other.txt@0"), b"file content")
+
+        res = self.client.get(url + "?path=ex/sub/b.txt&path=other.txt&format=zip")
+        with zipfile.ZipFile(io.BytesIO(res.getvalue())) as archive:
+            self.assertEqual(sorted(archive.namelist()), ["ex/sub/b.txt", "other.txt"])
+        self.assertEqual(self.client.get(url + "?format=rar").status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_as_of_snapshot(self):
+        self.client.post(reverse("file_versions:documents-batch") + "?path=snap", {
+            "a.txt": [SimpleUploadedFile("a.txt", b"a v0"), SimpleUploadedFile("a.txt", b"a v1")],
+            "b.txt": SimpleUploadedFile("b.txt", b"b v0"),
+        })
+        stamps = {("a.txt", 0): datetime(2024, 1, 1, tzinfo=timezone.utc),
+                  ("a.txt", 1): datetime(2024, 3, 1, tzinfo=timezone.utc),
+                  ("b.txt", 0): datetime(2024, 2, 1, tzinfo=timezone.utc)}
+        for (name, number), when in stamps.items():
+            FileVersion.objects.filter(base_file__file_name=f"/documents/snap/{name}",
+                                       version_number=number).update(created_at=when)
+
+        self.assertEqual(self.client.get(doc_url("snap/a.txt") + "?as_of=2024-02-15T00:00:00Z").getvalue(), b"a v0")
+        self.assertEqual(self.client.get(doc_url("snap/a.txt") + "?as_of=2024-03-01").getvalue(), b"a v1")
+        self.assertEqual(self.client.get(doc_url("snap/b.txt") + "?as_of=2024-01-15").status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(doc_url("snap/a.txt") + "?as_of=yesterday").status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+        res = self.client.get(mine_url() + "?as_of=2024-02-15")
+        self.assertEqual([(r["file_name"], r["version_number"]) for r in res.json()],
+                         [("/documents/snap/a.txt", 0), ("/documents/snap/b.txt", 0)])
+        res = self.client.get(mine_url() + "?as_of=2024-01-15")
+        self.assertEqual([(r["file_name"], r["version_number"]) for r in res.json()], [("/documents/snap/a.txt", 0)])
+
+        res = self.client.get(reverse("file_versions:documents-export") + "?as_of=2024-02-15&format=tar")
+        with tarfile.open(fileobj=io.BytesIO(res.getvalue())) as tar:
+            self.assertEqual(sorted(tar.getnames()), ["snap/a.txt", "snap/b.txt"])
+            self.assertEqual(tar.extractfile("snap/a.txt").read(), b"a v0")
+
+    def test_search_documents(self):
+        self.client.post(reverse("file_versions:documents-batch") + "?path=s", {
+            "notes.txt": [SimpleUploadedFile("notes.txt", b"the quick brown fox"),
+                          SimpleUploadedFile("notes.txt", b"the lazy dog sleeps")],
+            "copy.txt": SimpleUploadedFile("copy.txt", b"the lazy dog sleeps"),
+            "image.bin": SimpleUploadedFile("image.bin", b"\xff\xfe lazy \x00"),
+        })
+        other = get_user_model().objects.create_user("other", "other@example.com", "pass")
+        create_file_version(other, file_name="/documents/s/theirs.txt",
+                            file_content=SimpleUploadedFile("theirs.txt", b"a lazy dog too"))
+        url = reverse("file_versions:documents-search")
+        self.assertEqual(self.client.get(url + "?q=lazy").json(), [])
+
+        call_command("index_blobs", stdout=io.StringIO())
+        # identical content is indexed once
+        self.assertEqual(Blob.objects.filter(text__isnull=False).count(), 3)
+        self.assertFalse(Blob.objects.filter(indexed_at__isnull=True).exists())
+
+        hits = self.client.get(url + "?q=lazy+DOG").json()
+        self.assertEqual(sorted((h["file_name"], h["version_number"]) for h in hits),
+                         [("/documents/s/copy.txt", 0), ("/documents/s/notes.txt", 1)])
+        self.assertIn("**lazy**", hits[0]["snippet"])
+        self.assertEqual(self.client.get(url + "?q=quick").json(), [])
+        hits = self.client.get(url + "?q=quick&revisions=all").json()
+        self.assertEqual([(h["file_name"], h["version_number"]) for h in hits], [("/documents/s/notes.txt", 0)])
+        # FTS syntax in the query is searched for as words
+        self.assertEqual(len(self.client.get(url + '?q=lazy" (dog*').json()), 2)
+        self.assertEqual(self.client.get(url + "?q=+").status_code, status.HTTP_400_BAD_REQUEST)
+
+        # a swept blob leaves the index
+        for h in hits:
+            self.client.delete(doc_url(h["file_name"].removeprefix("/documents/")) + "?revision=0")
+        call_command("sweep_blobs", "--grace-period=0", stdout=io.StringIO())
+        self.assertEqual(self.client.get(url + "?q=quick&revisions=all").json(), [])
+        self.assertEqual(Blob.objects.filter(text__isnull=False).count(), 2)